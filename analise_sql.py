@@ -0,0 +1,234 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from flask import current_app, request
+import banco
+
+# Modo de análise de SQL por requisição (desligado por padrão). Com
+# app.config['SQL_PROFILER'] = True, cada requisição guarda todos os comandos
+# que rodou (com o tempo de cada um) e, ao final:
+#   - agrupa os comandos pela forma (literais e listas IN viram ?) e aponta as
+#     formas repetidas na mesma requisição (N+1);
+#   - roda EXPLAIN QUERY PLAN uma vez por forma e aponta SCAN sem índice em
+#     tabelas grandes;
+#   - devolve o resumo nos cabeçalhos X-SQL-* / Server-Timing e numa linha de log.
+# A chave pode ser trocada com o app rodando (POST /api/admin/sql-profiler), o
+# que permite medir um fluxo antes de subir uma mudança.
+
+_LITERAIS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTA_IN = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_TABELAS = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.I)
+_SCAN = re.compile(r"^SCAN (\w+)\b(?! USING (?:COVERING )?INDEX| VIRTUAL TABLE)")
+_LIMIT = re.compile(r"\bLIMIT\b", re.I)
+_AGREGA = re.compile(r"\b(?:COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(|\bGROUP\s+BY\b|\bDISTINCT\b", re.I)
+_WHERE = re.compile(r"\bWHERE\b(.*?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|$)", re.I | re.S)
+_EXPLICAVEIS = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE')
+_PALAVRAS_SQL = {'WHERE', 'ON', 'LEFT', 'JOIN', 'INNER', 'GROUP', 'ORDER', 'LIMIT', 'SET',
+                 'VALUES', 'SELECT', 'USING', 'NATURAL', 'CROSS', 'DEFAULT', 'RETURNING'}
+
+
+def forma(sql):
+    """SQL normalizado: espaços colapsados, literais e listas IN trocados por ?"""
+    texto = _LITERAIS.sub('?', ' '.join(sql.split()))
+    return _LISTA_IN.sub('(?, ...)', texto)
+
+
+def _aliases(sql):
+    """alias -> tabela, a partir dos FROM/JOIN/UPDATE/INTO do comando"""
+    mapa = {}
+    for tabela, alias in _TABELAS.findall(sql):
+        mapa[tabela] = tabela
+        if alias and alias.upper() not in _PALAVRAS_SQL:
+            mapa[alias] = tabela
+    return mapa
+
+
+class AnaliseSql:
+    """Coleta por requisição e relatório de N+1 / SCAN"""
+
+    def __init__(self, caminho, repeticoes=3, linhas_scan=1000, max_consultas=0,
+                 historico=50, validade_contagem=300.0):
+        self.caminho = caminho
+        self.repeticoes = repeticoes
+        self.linhas_scan = linhas_scan
+        self.max_consultas = max_consultas
+        self.validade_contagem = validade_contagem
+        self.relatorios = deque(maxlen=historico)
+        self._local = threading.local()
+        self._planos = {}       # forma -> tabelas percorridas com SCAN no plano
+        self._linhas = {}       # tabela -> (linhas, medido_em)
+        self._lock = threading.Lock()
+
+    # --- coleta (observador de banco.py) ---
+
+    def observar(self, sql, parametros, duracao):
+        comandos = getattr(self._local, 'comandos', None)
+        if comandos is not None:
+            comandos.append((sql, parametros, duracao))
+
+    def _inicio(self):
+        self._local.comandos = [] if current_app.config.get('SQL_PROFILER') else None
+
+    def _fim(self, resposta):
+        comandos = getattr(self._local, 'comandos', None)
+        self._local.comandos = None
+        if comandos is None:
+            return resposta
+        relatorio = self.analisar(comandos)
+        relatorio.update(metodo=request.method, caminho=request.path, endpoint=request.endpoint,
+                         status=resposta.status_code)
+        self.relatorios.append(relatorio)
+
+        alertas = []
+        if relatorio['n_mais_1']:
+            alertas.append(f"n+1={len(relatorio['n_mais_1'])}")
+        if relatorio['scans']:
+            alertas.append(f"scan={len(relatorio['scans'])}")
+        if relatorio['acima_do_limite']:
+            alertas.append(f"limite={self.max_consultas}")
+        resposta.headers['X-SQL-Consultas'] = str(relatorio['consultas'])
+        resposta.headers['X-SQL-Tempo-ms'] = f"{relatorio['tempo_ms']:.2f}"
+        if alertas:
+            resposta.headers['X-SQL-Alertas'] = '; '.join(alertas)
+        resposta.headers.add('Server-Timing', f'sql;dur={relatorio["tempo_ms"]:.2f};desc="{relatorio["consultas"]} consultas"')
+        self._registrar_log(relatorio)
+        return resposta
+
+    # --- análise ---
+
+    def analisar(self, comandos):
+        por_forma = Counter()
+        tempo_por_forma = Counter()
+        exemplos = {}
+        for sql, parametros, duracao in comandos:
+            chave = forma(sql)
+            por_forma[chave] += 1
+            tempo_por_forma[chave] += duracao
+            exemplos.setdefault(chave, (sql, parametros))
+
+        n_mais_1 = [
+            {'sql': chave, 'vezes': vezes, 'tempo_ms': round(tempo_por_forma[chave] * 1000, 3)}
+            for chave, vezes in por_forma.most_common() if vezes >= self.repeticoes
+        ]
+        scans = []
+        for chave, (sql, parametros) in exemplos.items():
+            for tabela, linhas in self._scans(chave, sql, parametros):
+                scans.append({'sql': chave, 'tabela': tabela, 'linhas': linhas})
+
+        tempo = sum(duracao for _, _, duracao in comandos)
+        return {
+            'consultas': len(comandos),
+            'formas': len(por_forma),
+            'tempo_ms': round(tempo * 1000, 3),
+            'n_mais_1': n_mais_1,
+            'scans': scans,
+            'acima_do_limite': bool(self.max_consultas and len(comandos) > self.max_consultas),
+            'comandos': [
+                {'sql': forma(sql), 'tempo_ms': round(duracao * 1000, 3)} for sql, _, duracao in comandos
+            ],
+        }
+
+    def _scans(self, chave, sql, parametros):
+        """SCANs sem índice em tabelas grandes (plano guardado por forma)"""
+        with self._lock:
+            planos = self._planos.get(chave)
+        if planos is None:
+            planos = self._explicar(sql, parametros)
+            with self._lock:
+                self._planos[chave] = planos
+        return [(tabela, linhas) for tabela, linhas in
+                ((tabela, self._contar_linhas(tabela)) for tabela in planos)
+                if linhas is not None and linhas >= self.linhas_scan]
+
+    def _conexao(self):
+        # Conexão própria, sem cronômetro: o EXPLAIN não entra no relatório nem em /metrics
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(self.caminho, check_same_thread=False)
+        return con
+
+    def _explicar(self, sql, parametros):
+        """Tabelas que o plano percorre inteiras (SCAN sem USING INDEX)"""
+        texto = sql.lstrip()
+        if not texto[:7].upper().startswith(_EXPLICAVEIS):
+            return []
+        if not isinstance(parametros, (list, tuple, dict)):
+            parametros = [None] * sql.count('?')
+        try:
+            plano = self._conexao().execute(f"EXPLAIN QUERY PLAN {sql}", parametros).fetchall()
+        except sqlite3.Error:
+            return []
+        detalhes = [detalhe for *_, detalhe in plano]
+        aliases = _aliases(sql)
+        # SCAN que segue o ORDER BY (sem B-TREE temporária) com LIMIT, sem
+        # agregação e sem filtro na tabela, para nas primeiras linhas: não conta
+        para_cedo = (_LIMIT.search(sql) and not _AGREGA.search(sql)
+                     and not any('TEMP B-TREE' in d for d in detalhes))
+        where = _WHERE.search(sql)
+        tabelas = []
+        for detalhe in detalhes:
+            encontrado = _SCAN.match(detalhe)
+            if not encontrado or encontrado.group(1) not in aliases:
+                continue
+            alias = encontrado.group(1)
+            # com JOIN, o WHERE que só cita colunas de outras tabelas não filtra esta
+            prefixos = set(re.findall(r'\b(\w+)\.', where.group(1))) if where else set()
+            filtrada = where is not None and (alias in prefixos or not prefixos & set(aliases) - {alias})
+            if para_cedo and not filtrada:
+                continue
+            tabelas.append(aliases[alias])
+        return tabelas
+
+    def _contar_linhas(self, tabela):
+        """Tamanho aproximado pela maior rowid (O(log n)), guardado por alguns minutos"""
+        agora = time.monotonic()
+        with self._lock:
+            guardado = self._linhas.get(tabela)
+        if guardado and agora - guardado[1] < self.validade_contagem:
+            return guardado[0]
+        try:
+            linhas = self._conexao().execute(f'SELECT MAX(rowid) FROM "{tabela}"').fetchone()[0] or 0
+        except sqlite3.Error:
+            linhas = None  # WITHOUT ROWID ou tabela virtual
+        with self._lock:
+            self._linhas[tabela] = (linhas, agora)
+        return linhas
+
+    def _registrar_log(self, relatorio):
+        linha = (f"🔎 SQL {relatorio['metodo']} {relatorio['caminho']} -> {relatorio['status']}: "
+                 f"{relatorio['consultas']} consultas ({relatorio['formas']} formas), {relatorio['tempo_ms']:.1f} ms")
+        for item in relatorio['n_mais_1']:
+            linha += f"\n   ⚠️  N+1: {item['vezes']}x {item['sql'][:120]}"
+        for item in relatorio['scans']:
+            linha += f"\n   ⚠️  SCAN {item['tabela']} (~{item['linhas']:,} linhas): {item['sql'][:120]}"
+        if relatorio['acima_do_limite']:
+            linha += f"\n   ⚠️  Acima do limite de {self.max_consultas} consultas por requisição"
+        print(linha)
+
+    def resumo(self):
+        """Relatórios recentes e o maior número de consultas visto por endpoint"""
+        por_endpoint = {}
+        for relatorio in self.relatorios:
+            atual = por_endpoint.setdefault(relatorio['endpoint'], {'requisicoes': 0, 'max_consultas': 0})
+            atual['requisicoes'] += 1
+            atual['max_consultas'] = max(atual['max_consultas'], relatorio['consultas'])
+        return {'por_endpoint': por_endpoint, 'recentes': list(self.relatorios)}
+
+
+def init_app(app, caminho):
+    app.config.setdefault('SQL_PROFILER', os.getenv('SQL_PROFILER', 'False') == 'True')
+    analise = AnaliseSql(
+        caminho,
+        repeticoes=int(os.getenv('SQL_PROFILER_REPETICOES', '3')),
+        linhas_scan=int(os.getenv('SQL_PROFILER_LINHAS_SCAN', '1000')),
+        max_consultas=int(os.getenv('SQL_PROFILER_MAX_CONSULTAS', '0')),
+        historico=int(os.getenv('SQL_PROFILER_HISTORICO', '50')),
+    )
+    app.extensions['analise_sql'] = analise
+    app.before_request(analise._inicio)
+    app.after_request(analise._fim)
+    banco.observadores.append(analise.observar)
+    return analise
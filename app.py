@@ -1,19 +1,43 @@
 import os
+import queue
 import sqlite3
-from flask import Flask, render_template, jsonify, request, send_from_directory, session, redirect, url_for
-from flask_mail import Mail, Message
-import qrcode
-from io import BytesIO
-import base64
+import threading
+import time
+import click
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, render_template, jsonify, request, send_file, send_from_directory, session, redirect, url_for
 from dotenv import load_dotenv
-import requests
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import hashlib
 from functools import wraps
-import time
 import smtplib
-import socket
-socket.setdefaulttimeout(30) # Espera 30 segundos antes de dar erro
+import analise_sql
+import ativos
+import banco
+import busca
+import cache_http
+import cache_paginas
+import cache_pdfs
+import capas
+import entregas
+import envio_email
+import eventos
+import http_remoto
+import idempotencia
+import links_download
+import migracoes
+import pix
+import pool_smtp
+import rollups
+import telemetria
+import tabelas_admin
+from banco import conectar
+from cache_pdfs import PdfIndisponivel
+from entregas import FalhaEntrega
+from idempotencia import ErroIdempotencia
+from links_download import LinkInvalido
+from tabelas_admin import ConsultaInvalida
 # 1. Carregar variáveis de ambiente
 load_dotenv()
 
@@ -22,7 +46,7 @@ app = Flask(__name__, static_folder='static', template_folder='templates')
 # Chave secreta para sessões (necessária para login admin)
 app.secret_key = os.getenv('SECRET_KEY', 'chave-secreta-mudar-em-producao')
 
-# 2. Configuração de E-mail (Mais robusta)
+# 2. Configuração de E-mail (lida pelo pool SMTP, ver pool_smtp.py)
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
 app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', '465'))
 app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'False') == 'False'
@@ -31,12 +55,8 @@ app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_USERNAME')
 app.config['MAIL_DEBUG'] = True  # Isso ajuda a ver detalhes do erro no terminal
-app.config['MAIL_MAX_EMAILS'] = None
 app.config['MAIL_SUPPRESS_SEND'] = False
-app.config['MAIL_ASCII_ATTACHMENTS'] = False
 app.config['MAIL_TIMEOUT'] = 30  # Timeout de 30 segundos
-
-mail = Mail(app)
 DB = 'loja.db'
 
 # --- VERIFICAÇÃO INICIAL ---
@@ -45,35 +65,156 @@ if app.config['MAIL_PASSWORD'] == 'sua_senha_de_app_16_caracteres':
     print("\n⚠️  ATENÇÃO: Você não configurou a Senha de App no arquivo .env!")
     print("   O envio de e-mail VAI FALHAR. Edite o arquivo .env agora.\n")
 
-def conectar():
-    """Conecta ao banco de dados SQLite"""
-    con = sqlite3.connect(DB)
-    con.row_factory = sqlite3.Row
-    return con
+# Pool de conexões: cada requisição recebe uma conexão via conectar(),
+# devolvida automaticamente ao pool no teardown do app context
+banco.init_app(app, DB)
+
+# Latência por endpoint, status, requisições em andamento e tempo de SQL
+# exportados em /metrics no formato do Prometheus (ver telemetria.py)
+metricas = telemetria.init_app(app)
+
+# Análise de SQL por requisição (N+1, SCAN em tabelas grandes), desligada
+# por padrão e trocável em tempo de execução (ver analise_sql.py)
+analisador_sql = analise_sql.init_app(app, DB)
+
+# Todo DDL fica em migracoes.py (versionado por PRAGMA user_version)
+migracoes.aplicar(DB)
+
+# Arquivos estáticos com hash no nome, gzip/brotli e cache imutável (ver ativos.py)
+ativos.init_app(app)
+
+# ETags calculados a partir das versões de dados (ver cache_http.py)
+cache_http.init_app(app)
+
+# HTML renderizado do catálogo guardado em memória (ver cache_paginas.py)
+cache_paginas.init_app(app)
+
+# Conexões SMTP autenticadas reaproveitadas entre envios (ver pool_smtp.py)
+smtp_pool = pool_smtp.init_app(app)
+
+# Cliente HTTP compartilhado (keep-alive, retry, limite por host) - ver http_remoto.py
+cliente_http = http_remoto.init_app(app)
+
+# Capas espelhadas e redimensionadas (WebP/JPEG) - ver capas.py
+capas.init_app(app, cliente_http)
+
+# PDFs remotos guardados em disco por hash do conteúdo (ver cache_pdfs.py)
+cache_pdfs_disco = cache_pdfs.init_app(app, cliente_http)
+
+# Links assinados /download/<token> para a entrega por link (ver links_download.py)
+links = links_download.init_app(app, cache_pdfs_disco.pasta)
+
+# Envio dos e-books em segundo plano (tarefa registrada junto de enviar_livro_email)
+fila_entregas = entregas.init_app(app)
+
+# Eventos de pedidos para o painel e para o cliente via SSE (ver eventos.py)
+sse = eventos.init_app(app)
 
 # --- ROTAS DE PÁGINAS (FRONTEND) ---
 
+# Catálogo paginado por cursor (keyset): o cursor é o último id visto e a
+# consulta usa a PK em ordem decrescente, sem OFFSET
+CAMPOS_LIVRO = ('id', 'titulo', 'autor', 'preco', 'imagem', 'origem', 'descricao', 'criado_em')
+CAMPOS_LIVRO_PADRAO = ('id', 'titulo', 'autor', 'preco', 'imagem')
+CATALOGO_PAGINA_INICIAL = 8  # mesmo valor de itensPorPagina no carrossel do index.html
+CATALOGO_LIMITE_MAXIMO = 100
+
+def listar_livros_pagina(con, cursor=None, limite=CATALOGO_PAGINA_INICIAL, campos=CAMPOS_LIVRO_PADRAO):
+    """Retorna (livros, proximo_cursor) com id < cursor, do mais novo para o mais antigo"""
+    colunas = ', '.join(dict.fromkeys(('id',) + tuple(campos)))
+    if cursor is None:
+        rows = con.execute(f"SELECT {colunas} FROM livros ORDER BY id DESC LIMIT ?",
+                           (limite + 1,)).fetchall()
+    else:
+        rows = con.execute(f"SELECT {colunas} FROM livros WHERE id < ? ORDER BY id DESC LIMIT ?",
+                           (cursor, limite + 1)).fetchall()
+    
+    # Uma linha a mais indica que existe próxima página
+    proximo_cursor = rows[limite - 1]['id'] if len(rows) > limite else None
+    livros = [{campo: row[campo] for campo in campos} for row in rows[:limite]]
+    if 'imagem' in campos:
+        for livro, row in zip(livros, rows):
+            livro['capa'] = app.extensions['capas'].urls(row)
+    return livros, proximo_cursor
+
 @app.route('/')
+@cache_http.condicional(lambda: ['livros'], 'public, max-age=60')
+@cache_paginas.em_cache
 def index():
-    """Página inicial com catálogo"""
+    """Página inicial com catálogo (só a primeira página; o resto vem de /api/livros)"""
     try:
         con = conectar()
-        livros = con.execute("SELECT id, titulo, autor, preco, imagem FROM livros ORDER BY id DESC").fetchall()
-        con.close()
-        return render_template('index.html', livros=[dict(l) for l in livros])
+        livros, proximo_cursor = listar_livros_pagina(con)
+        total_livros = rollups.total_livros(con)
+        return render_template('index.html', livros=livros, proximo_cursor=proximo_cursor,
+                               total_livros=total_livros, pagina_tamanho=CATALOGO_PAGINA_INICIAL)
     except Exception as e:
-        return f"Erro ao carregar banco de dados: {e}. Verifique se rodou 'criar_banco.py'."
+        return f"Erro ao carregar banco de dados: {e}. Verifique se rodou 'criar_banco.py'.", 500
+
+@app.route('/api/livros')
+def api_livros():
+    """Catálogo paginado: ?cursor=<id>&limite=<n>&campos=id,titulo,..."""
+    cursor = request.args.get('cursor', type=int)
+    limite = request.args.get('limite', CATALOGO_PAGINA_INICIAL, type=int)
+    limite = max(1, min(limite, CATALOGO_LIMITE_MAXIMO))
+    
+    campos = CAMPOS_LIVRO_PADRAO
+    if request.args.get('campos'):
+        campos = tuple(c.strip() for c in request.args['campos'].split(',') if c.strip())
+        invalidos = [c for c in campos if c not in CAMPOS_LIVRO]
+        if invalidos or not campos:
+            return jsonify({'error': f'Campos inválidos: {", ".join(invalidos)}',
+                            'campos_permitidos': list(CAMPOS_LIVRO)}), 400
+    
+    livros, proximo_cursor = listar_livros_pagina(conectar(), cursor, limite, campos)
+    return jsonify({'livros': livros, 'proximo_cursor': proximo_cursor, 'limite': limite})
+
+@app.route('/api/livros/busca')
+def api_livros_busca():
+    """Busca no catálogo: ?q=<texto>&limite=<n>&inicio=<n> (relevância bm25)"""
+    texto = request.args.get('q', '').strip()
+    if not texto:
+        return jsonify({'error': 'Informe o texto da busca (q)'}), 400
+    limite = max(1, min(request.args.get('limite', 20, type=int), busca.BUSCA_LIMITE_MAXIMO))
+    inicio = max(0, request.args.get('inicio', 0, type=int))
+    
+    resultados = busca.buscar(conectar(), texto, limite, inicio)
+    return jsonify({'q': texto, 'resultados': resultados, 'limite': limite, 'inicio': inicio})
 
 @app.route('/livro/<int:livro_id>')
+@cache_http.condicional(lambda livro_id: [f'livro:{livro_id}'], 'public, max-age=300')
+@cache_paginas.em_cache
 def livro(livro_id):
     """Página de detalhes do livro"""
     con = conectar()
     livro = con.execute("SELECT * FROM livros WHERE id=?", (livro_id,)).fetchone()
-    con.close()
     if not livro:
         return "Livro não encontrado", 404
     return render_template('livro.html', livro=dict(livro))
 
+@app.route('/capas/<int:livro_id>/<chave>-<int:largura>.<formato>')
+def capa_variante(livro_id, chave, largura, formato):
+    """Miniatura da capa (espelhada e redimensionada na primeira vez, depois só disco)"""
+    if largura not in capas.LARGURAS or formato not in capas.FORMATOS:
+        return "Formato de capa não suportado", 404
+    
+    livro = conectar().execute("SELECT imagem FROM livros WHERE id=?", (livro_id,)).fetchone()
+    if not livro or not livro['imagem'] or capas.chave_origem(livro['imagem']) != chave:
+        return "Capa não encontrada", 404
+    
+    try:
+        caminho = app.extensions['capas'].variante(livro['imagem'], largura, formato)
+    except capas.CapaIndisponivel as e:
+        # Sem cópia local: manda o navegador para a imagem original
+        print(f"⚠️  Capa do livro #{livro_id} indisponível: {e}")
+        if livro['imagem'].startswith('http'):
+            return redirect(livro['imagem'])
+        return redirect(url_for('static', filename='images/' + livro['imagem']))
+    
+    resp = send_file(caminho, mimetype=capas.FORMATOS[formato][1], conditional=True)
+    resp.headers['Cache-Control'] = ativos.CACHE_IMUTAVEL
+    return resp
+
 @app.route('/cadastro')
 def cadastro_page():
     return render_template('cadastroForm.html')
@@ -119,52 +260,70 @@ def perfil_page():
     """Página de perfil do usuário"""
     return render_template('perfil.html')
 
+# Resumo do perfil numa consulta só: usuário + rollup_usuario (mantido por
+# triggers, ver migração 009), sem agregar o histórico a cada visita
+SQL_PERFIL_RESUMO = """
+    SELECT u.id, u.nome, u.email, u.criado_em,
+           COALESCE(r.pedidos, 0) AS total_pedidos,
+           COALESCE(r.pedidos_pagos, 0) AS pedidos_pagos,
+           COALESCE(r.pedidos_pendentes, 0) AS pedidos_pendentes,
+           COALESCE(r.total_gasto, 0) AS total_gasto
+    FROM usuarios u
+    LEFT JOIN rollup_usuario r ON r.usuario_id = u.id
+    WHERE u.id=?
+"""
+
+# Histórico por keyset em (criado_em, id) decrescente, lido do índice
+# idx_pedidos_usuario_data; o cursor é o id do último pedido da página
+SQL_PERFIL_PEDIDOS = """
+    SELECT 
+        p.id,
+        p.status,
+        p.criado_em,
+        p.total,
+        l.titulo,
+        l.autor,
+        l.imagem
+    FROM pedidos p
+    LEFT JOIN livros l ON p.livro_id = l.id
+    WHERE p.usuario_id=? {}
+    ORDER BY p.criado_em DESC, p.id DESC
+    LIMIT ?
+"""
+SQL_PERFIL_PEDIDOS_CURSOR = "AND (p.criado_em, p.id) < (SELECT criado_em, id FROM pedidos WHERE id=?)"
+PERFIL_PAGINA = 10
+PERFIL_LIMITE_MAXIMO = 50
+
+def listar_pedidos_usuario(con, usuario_id, cursor=None, limite=PERFIL_PAGINA):
+    """Retorna (pedidos, proximo_cursor) do usuário, do mais recente para o mais antigo"""
+    if cursor is None:
+        rows = con.execute(SQL_PERFIL_PEDIDOS.format(''), (usuario_id, limite + 1)).fetchall()
+    else:
+        rows = con.execute(SQL_PERFIL_PEDIDOS.format(SQL_PERFIL_PEDIDOS_CURSOR),
+                           (usuario_id, cursor, limite + 1)).fetchall()
+    
+    # Uma linha a mais indica que existe próxima página
+    proximo_cursor = rows[limite - 1]['id'] if len(rows) > limite else None
+    pedidos = [{
+        'id': p['id'],
+        'titulo': p['titulo'],
+        'autor': p['autor'],
+        'preco': float(p['total']),
+        'status': p['status'],
+        'data': p['criado_em'],
+        'imagem': p['imagem']
+    } for p in rows[:limite]]
+    return pedidos, proximo_cursor
+
 @app.route('/api/perfil/<int:usuario_id>')
+@cache_http.condicional(lambda usuario_id: [f'usuario:{usuario_id}'], 'private, no-cache')
 def api_perfil(usuario_id):
-    """API para buscar dados do perfil do usuário"""
-    con = conectar()
-    
-    # Dados do usuário
-    usuario = con.execute("""
-        SELECT id, nome, email, criado_em 
-        FROM usuarios 
-        WHERE id=?
-    """, (usuario_id,)).fetchone()
+    """Resumo do perfil (dados + estatísticas); o histórico vem de /api/perfil/<id>/pedidos"""
+    usuario = conectar().execute(SQL_PERFIL_RESUMO, (usuario_id,)).fetchone()
     
     if not usuario:
-        con.close()
         return jsonify({'error': 'Usuário não encontrado'}), 404
     
-    # Estatísticas do usuário
-    stats = con.execute("""
-        SELECT 
-            COUNT(*) as total_pedidos,
-            COUNT(CASE WHEN status='PAGO' THEN 1 END) as pedidos_pagos,
-            COUNT(CASE WHEN status='PENDENTE' THEN 1 END) as pedidos_pendentes,
-            COALESCE(SUM(CASE WHEN status='PAGO' THEN l.preco ELSE 0 END), 0) as total_gasto
-        FROM pedidos p
-        LEFT JOIN livros l ON p.livro_id = l.id
-        WHERE p.usuario_id=?
-    """, (usuario_id,)).fetchone()
-    
-    # Histórico de pedidos
-    pedidos = con.execute("""
-        SELECT 
-            p.id,
-            p.status,
-            p.criado_em,
-            l.titulo,
-            l.autor,
-            l.preco,
-            l.imagem
-        FROM pedidos p
-        LEFT JOIN livros l ON p.livro_id = l.id
-        WHERE p.usuario_id=?
-        ORDER BY p.criado_em DESC
-    """, (usuario_id,)).fetchall()
-    
-    con.close()
-    
     return jsonify({
         'usuario': {
             'id': usuario['id'],
@@ -173,29 +332,66 @@ def api_perfil(usuario_id):
             'membro_desde': usuario['criado_em']
         },
         'stats': {
-            'total_pedidos': stats['total_pedidos'],
-            'pedidos_pagos': stats['pedidos_pagos'],
-            'pedidos_pendentes': stats['pedidos_pendentes'],
-            'total_gasto': float(stats['total_gasto'])
+            'total_pedidos': usuario['total_pedidos'],
+            'pedidos_pagos': usuario['pedidos_pagos'],
+            'pedidos_pendentes': usuario['pedidos_pendentes'],
+            'total_gasto': float(usuario['total_gasto'])
         },
-        'pedidos': [{
-            'id': p['id'],
-            'titulo': p['titulo'],
-            'autor': p['autor'],
-            'preco': float(p['preco']) if p['preco'] else 0,
-            'status': p['status'],
-            'data': p['criado_em'],
-            'imagem': p['imagem']
-        } for p in pedidos]
+        'pedidos_url': url_for('api_perfil_pedidos', usuario_id=usuario_id)
     })
 
+@app.route('/api/perfil/<int:usuario_id>/pedidos')
+@cache_http.condicional(lambda usuario_id: [f'usuario:{usuario_id}', 'livros'], 'private, no-cache')
+def api_perfil_pedidos(usuario_id):
+    """Histórico de compras paginado: ?cursor=<id do último pedido>&limite=<n>"""
+    cursor = request.args.get('cursor', type=int)
+    limite = request.args.get('limite', PERFIL_PAGINA, type=int)
+    limite = max(1, min(limite, PERFIL_LIMITE_MAXIMO))
+    
+    pedidos, proximo_cursor = listar_pedidos_usuario(conectar(), usuario_id, cursor, limite)
+    return jsonify({'pedidos': pedidos, 'proximo_cursor': proximo_cursor, 'limite': limite})
+
 @app.route('/ebooks/<path:filename>')
 def ebooks(filename):
     """Rota para servir arquivos locais se necessário"""
     return send_from_directory(os.path.join(app.static_folder, 'ebooks'), filename)
 
+@app.route('/download/<token>')
+def download_pedido(token):
+    """PDF do pedido pelo link assinado do e-mail (Range/206, X-Sendfile/X-Accel-Redirect)"""
+    con = conectar()
+    try:
+        link = links.validar(con, token)
+    except LinkInvalido as e:
+        return str(e), e.status
+    pedido = con.execute(SQL_PEDIDOS_ENTREGA.format('?'), (link['pedido_id'],)).fetchone()
+    if not pedido or pedido['status'] == 'REJEITADO':
+        return "Pedido indisponível", 410
+    try:
+        caminho = obter_pdf_livro(pedido['pdf'])
+    except FalhaEntrega as e:
+        print(f"❌ Download do pedido #{pedido['id']}: {e}")
+        return "Arquivo temporariamente indisponível, tente novamente em instantes", 503
+    links.registrar(con, link, request.range, os.path.getsize(caminho))
+    return links.resposta(caminho, f"{pedido['titulo'][:30].replace(' ', '_')}.pdf")
+
 # --- APIs (BACKEND) ---
 
+def checkout_transacional(funcao):
+    """Roda funcao(con) -> (resposta, status) numa transação BEGIN IMMEDIATE com um
+    só COMMIT, honrando o cabeçalho Idempotency-Key (ver idempotencia.py)"""
+    try:
+        resposta, status, repetida = idempotencia.executar(
+            conectar(), request.endpoint, request.headers.get('Idempotency-Key'),
+            request.get_data(), funcao
+        )
+    except ErroIdempotencia as e:
+        return jsonify({'error': str(e)}), e.status
+    resp = jsonify(resposta)
+    if repetida:
+        resp.headers['Idempotent-Replayed'] = 'true'
+    return resp, status
+
 @app.route('/api/checkout', methods=['POST'])
 def api_checkout():
     """Cria o pedido e gera o PIX real via Mercado Pago"""
@@ -211,48 +407,29 @@ def api_checkout():
     livro = con.execute("SELECT id, titulo, preco FROM livros WHERE id=?", (livro_id,)).fetchone()
     
     if not livro:
-        con.close()
         return jsonify({'error': 'Livro indisponível'}), 404
 
-    # 1. Registrar pedido com usuario_id
-    cur = con.cursor()
-    # Verificar se coluna usuario_id existe, senão criar
-    try:
-        cur.execute("""INSERT INTO pedidos (email, livro_id, usuario_id, status) 
-                       VALUES (?, ?, ?, ?)""",
-                    (email, livro_id, usuario_id, 'PENDENTE'))
-    except sqlite3.OperationalError:
-        # Coluna não existe, adicionar e tentar novamente
-        cur.execute("ALTER TABLE pedidos ADD COLUMN usuario_id INTEGER")
-        cur.execute("""INSERT INTO pedidos (email, livro_id, usuario_id, status) 
-                       VALUES (?, ?, ?, ?)""",
-                    (email, livro_id, usuario_id, 'PENDENTE'))
-    
-    pedido_id = cur.lastrowid
-    con.commit()
+    def criar_pedido(con):
+        # 1. Registrar pedido com usuario_id
+        pedido_id = con.execute("""INSERT INTO pedidos (email, livro_id, usuario_id, status, total) 
+                                   VALUES (?, ?, ?, ?, ?)""",
+                                (email, livro_id, usuario_id, 'PENDENTE', livro['preco'])).lastrowid
+        con.execute("INSERT INTO pedido_itens (pedido_id, livro_id, titulo, preco) VALUES (?, ?, ?, ?)",
+                    (pedido_id, livro['id'], livro['titulo'], livro['preco']))
 
-    # Gerar PIX Simulado
-    valor = f"{livro['preco']:.2f}"
-    texto_pix = f"00020126580014BR.GOV.BCB.PIX0136{email}520400005303986540{valor}5802BR5911ClicLeitura6009Sao_Paulo62070503***6304"
-    
-    img = qrcode.make(texto_pix)
-    buf = BytesIO()
-    img.save(buf, format='PNG')
-    qr_b64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-    
-    cur.execute("UPDATE pedidos SET pix_code=? WHERE id=?", 
-               (f"SIMULADO_{pedido_id}", pedido_id))
-    con.commit()
-    con.close()
-    
-    print(f"✅ PIX SIMULADO gerado para pedido #{pedido_id}")
+        # Gerar PIX (BR Code com CRC); o QR é servido por /pix/<pedido_id>.png
+        texto_pix = pix.payload_pedido(pedido_id, livro['preco'])
+        con.execute("UPDATE pedidos SET pix_code=? WHERE id=?", (texto_pix, pedido_id))
+        
+        print(f"✅ PIX SIMULADO gerado para pedido #{pedido_id}")
+        return {
+            'pedido_id': pedido_id, 
+            'qr_url': url_for('pix_qr', pedido_id=pedido_id, formato='png'),
+            'pix_text': texto_pix,
+            'real_pix': False
+        }, 200
 
-    return jsonify({
-        'pedido_id': pedido_id, 
-        'qr_base64': qr_b64, 
-        'pix_text': texto_pix,
-        'real_pix': False
-    })
+    return checkout_transacional(criar_pedido)
 
 # WEBHOOK DESATIVADO - Envio manual pelo painel admin
 # Para reativar envio automático, descomente o código abaixo
@@ -291,219 +468,275 @@ def api_checkout():
 #         print(f"❌ Erro no webhook: {e}")
 #         return jsonify({'error': str(e)}), 500
 
+SQL_PEDIDOS_ENTREGA = """
+    SELECT p.id, p.email, p.status, p.livro_id, l.pdf, l.titulo, l.autor,
+           COALESCE(NULLIF(u.nome, ''), 'Cliente') AS nome_cliente
+    FROM pedidos p 
+    JOIN livros l ON p.livro_id = l.id 
+    LEFT JOIN usuarios u ON p.usuario_id = u.id
+    WHERE p.id IN ({})
+"""
+
+def obter_pdf_livro(pdf):
+    """Caminho local do PDF (baixado pelo cache de PDFs se for remoto); levanta FalhaEntrega"""
+    if pdf.startswith('http'):
+        print(f"⏳ Obtendo PDF de: {pdf[:70]}...")
+        
+        # Cache em disco: títulos já baixados não voltam a ir à rede (ver cache_pdfs.py)
+        inicio = time.perf_counter()
+        try:
+            caminho = cache_pdfs_disco.obter(pdf)
+        except PdfIndisponivel as e:
+            metricas.pdf.observar(time.perf_counter() - inicio, resultado='erro')
+            print(f"💡 O Archive.org pode estar bloqueando downloads automáticos")
+            raise FalhaEntrega(str(e))
+        metricas.pdf.observar(time.perf_counter() - inicio, resultado='ok')
+            
+    else:
+        # PDF local
+        caminho = os.path.join(app.static_folder, 'ebooks', pdf)
+        if not os.path.exists(caminho):
+            raise FalhaEntrega(f"Arquivo local não encontrado: {caminho}", definitiva=True)
+
+    tamanho_pdf = os.path.getsize(caminho)
+    if not tamanho_pdf:
+        raise FalhaEntrega("PDF vazio ou não disponível")
+    print(f"✅ PDF pronto: {tamanho_pdf:,} bytes ({tamanho_pdf/1024/1024:.2f} MB)")
+    return caminho
+
+# Entrega por link: "anexo" (padrão) anexa o PDF; "link" manda só a URL de
+# download. Mesmo no modo anexo, PDFs acima de ENTREGA_LINK_ACIMA_MB vão por link
+# (limite de tamanho das caixas de e-mail; 0 desliga)
+ENTREGA_MODO = os.getenv('ENTREGA_MODO', 'anexo').lower()
+ENTREGA_LINK_ACIMA = int(float(os.getenv('ENTREGA_LINK_ACIMA_MB', '20')) * 1024 * 1024)
+SITE_URL = os.getenv('SITE_URL', 'http://localhost:5000').rstrip('/')
+
+def link_download(con, pedido, caminho):
+    """URL assinada para o pedido se a entrega for por link; None para anexar (não faz commit)"""
+    if ENTREGA_MODO != 'link' and not (ENTREGA_LINK_ACIMA and os.path.getsize(caminho) > ENTREGA_LINK_ACIMA):
+        return None
+    return f"{SITE_URL}/download/{links.emitir(con, pedido['id'])}"
+
+def enviar_pedido(envio, pedido, caminho, url_download=None):
+    """Envia o e-mail do pedido pela conexão emprestada do pool (None = envio suprimido)"""
+    pdf_name = f"{pedido['titulo'][:30].replace(' ', '_')}.pdf"
+    
+    if url_download:
+        entrega = (
+            f"O seu novo e-book, \"{pedido['titulo']}\", já está disponível para download neste link:\n\n"
+            f"{url_download}\n\n"
+            f"O link é pessoal e vale por {links.validade // 86400} dias"
+            f"{f' ({links.max_downloads} downloads)' if links.max_downloads else ''}. "
+            f"Agora é só baixar, preparar um café (ou chá!) e aproveitar a leitura.\n\n"
+            f"Instruções rápidas:\n"
+            f"• Abra o link e baixe o PDF.\n"
+        )
+    else:
+        entrega = (
+            f"O arquivo do seu novo e-book, \"{pedido['titulo']}\", já está anexado a este e-mail. "
+            f"Agora é só baixar, preparar um café (ou chá!) e aproveitar a leitura.\n\n"
+            f"Instruções rápidas:\n"
+            f"• Baixe o anexo.\n"
+        )
+
+    # Corpo do email formatado
+    corpo = (
+        f"Olá, {pedido['nome_cliente']}!\n\n"
+        f"Que ótima notícia: seu pagamento foi confirmado! ✅\n\n"
+        f"{entrega}"
+        f"• Salve em seu dispositivo preferido.\n"
+        f"• Comece a ler!\n\n"
+        f"Caso tenha alguma dúvida sobre o uso do arquivo, você pode consultar nossos "
+        f"Termos e Políticas de Uso em {SITE_URL}/terms ou responder a este e-mail.\n\n"
+        f"Obrigada por escolher a ClicLeitura. Esperamos que essa história seja incrível!\n\n"
+        f"Um abraço,\n"
+        f"Equipe ClicLeitura!\n"
+    )
+    
+    remetente = app.config['MAIL_DEFAULT_SENDER']
+    assunto = "Tudo certo! Seu ebook já está com você 📚✨"
+    if url_download:
+        mensagem = envio_email.mensagem_texto(remetente, [pedido['email']], assunto, corpo)
+        tamanho = None
+    else:
+        # Mensagem gerada em pedaços: o PDF é codificado em base64 direto do disco
+        # para o socket, sem montar o anexo inteiro na memória (ver envio_email.py)
+        mensagem = envio_email.mensagem_com_anexo(
+            remetente, [pedido['email']], assunto, corpo, caminho, pdf_name
+        )
+        tamanho = envio_email.tamanho_estimado(caminho)
+    if envio is not None:  # MAIL_SUPPRESS_SEND / TESTING não envia
+        resultado = 'erro'
+        inicio = time.perf_counter()
+        try:
+            envio.enviar(envio_email.enviar, remetente, [pedido['email']], mensagem, tamanho=tamanho)
+            resultado = 'ok'
+        finally:
+            metricas.smtp.observar(time.perf_counter() - inicio, resultado=resultado)
+
+def _falha_smtp(e):
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        print("💡 A senha de app do Gmail pode estar incorreta ou expirada")
+        print("   Acesse: https://myaccount.google.com/apppasswords")
+        return FalhaEntrega(f"Erro de autenticação SMTP: {e}")
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return FalhaEntrega(f"Destinatário recusado: {e}", definitiva=True)
+    if isinstance(e, smtplib.SMTPException):
+        return FalhaEntrega(f"Erro SMTP: {e}")
+    return FalhaEntrega(f"Erro ao enviar email: {e}")
+
+# Status em que o pedido pode ser entregue (e virar PAGO ao fim do envio)
+STATUS_APROVAVEIS = ('PENDENTE_APROVACAO', 'APROVADO')
+SQL_MARCAR_PAGO = f"""
+    UPDATE pedidos SET status='PAGO'
+    WHERE id=? AND status IN ({', '.join(repr(s) for s in STATUS_APROVAVEIS)})
+"""
+
 def enviar_livro_email(pedido_id):
-    """Função auxiliar para enviar o livro por email"""
-    con = conectar()
-    query = """
-        SELECT p.id, p.email, l.pdf, l.titulo, l.origem, l.autor 
-        FROM pedidos p 
-        JOIN livros l ON p.livro_id = l.id 
-        WHERE p.id=?
+    """Envia o livro por email (executada pelos trabalhadores da fila de entregas).
+
+    Levanta FalhaEntrega em caso de erro; novas tentativas ficam a cargo da fila.
     """
-    pedido = con.execute(query, (pedido_id,)).fetchone()
+    con = conectar()
+    pedido = con.execute(SQL_PEDIDOS_ENTREGA.format('?'), (pedido_id,)).fetchone()
     
     if not pedido:
-        con.close()
         print(f"❌ Pedido #{pedido_id} não encontrado")
-        return False
+        raise FalhaEntrega(f"Pedido #{pedido_id} não encontrado", definitiva=True)
+    if pedido['status'] == 'REJEITADO':
+        # Rejeitado depois de entrar na fila (ou durante o backoff): não entrega
+        raise FalhaEntrega(f"Pedido #{pedido_id} foi rejeitado", definitiva=True)
 
-    # Baixar/localizar PDF
-    pdf_content = None
-    pdf_name = f"{pedido['titulo'][:30].replace(' ', '_')}.pdf"
-    autor = pedido['autor'] if pedido['autor'] else 'Desconhecido'
-    
     print(f"📖 Preparando envio: {pedido['titulo']}")
-
     try:
-        if pedido['pdf'].startswith('http'):
-            print(f"⏳ Baixando PDF de: {pedido['pdf'][:70]}...")
-            
-            # Para Archive.org, usar sessão com headers de navegador real
-            session = requests.Session()
-            session.headers.update({
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'application/pdf,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Referer': 'https://archive.org/',
-                'DNT': '1',
-                'Upgrade-Insecure-Requests': '1',
-                'Sec-Fetch-Dest': 'document',
-                'Sec-Fetch-Mode': 'navigate',
-                'Sec-Fetch-Site': 'same-origin'
-            })
-            
-            # Tentar múltiplas vezes
-            tentativas = 0
-            max_tentativas = 3
-            
-            while tentativas < max_tentativas and not pdf_content:
-                tentativas += 1
-                
-                try:
-                    print(f"   Tentativa {tentativas}/{max_tentativas}...")
-                    
-                    # Aguardar entre tentativas para parecer mais humano
-                    if tentativas > 1:
-                        time.sleep(3)
-                    
-                    response = session.get(pedido['pdf'], timeout=60, stream=True, allow_redirects=True)
-                    
-                    if response.status_code == 200:
-                        # Verificar se é realmente PDF
-                        content_type = response.headers.get('Content-Type', '')
-                        if 'pdf' not in content_type.lower() and 'application/octet-stream' not in content_type:
-                            print(f"⚠️  Resposta não é PDF: {content_type}")
-                            continue
-                        
-                        # Baixar em chunks
-                        chunks = []
-                        downloaded = 0
-                        print(f"   📥 Baixando...", end='', flush=True)
-                        
-                        for chunk in response.iter_content(chunk_size=65536):  # 64KB chunks
-                            if chunk:
-                                chunks.append(chunk)
-                                downloaded += len(chunk)
-                                if downloaded % (1024 * 1024) == 0:  # A cada 1MB
-                                    print(f" {downloaded // (1024*1024)}MB", end='', flush=True)
-                        
-                        print()  # Nova linha
-                        pdf_content = b''.join(chunks)
-                        
-                        if len(pdf_content) > 10000:  # Pelo menos 10KB
-                            print(f"✅ PDF baixado: {len(pdf_content):,} bytes ({len(pdf_content)/1024/1024:.2f} MB)")
-                        else:
-                            print(f"⚠️  Arquivo muito pequeno ({len(pdf_content)} bytes) - pode não ser válido")
-                            pdf_content = None
-                            
-                    elif response.status_code in [403, 401]:
-                        print(f"❌ Acesso negado ({response.status_code}) - Archive.org bloqueou o acesso")
-                        if tentativas < max_tentativas:
-                            print(f"   ⏳ Aguardando antes de tentar novamente...")
-                            time.sleep(5)
-                    else:
-                        print(f"❌ Erro HTTP {response.status_code}")
-                        if tentativas < max_tentativas:
-                            time.sleep(2)
-                        
-                except requests.exceptions.Timeout:
-                    print(f"⏱️  Timeout na tentativa {tentativas}")
-                    if tentativas < max_tentativas:
-                        print(f"   ⏳ Aumentando timeout e tentando novamente...")
-                        time.sleep(3)
-                except Exception as err:
-                    print(f"❌ Erro na tentativa {tentativas}: {err}")
-                    if tentativas < max_tentativas:
-                        time.sleep(2)
-                        
-            if not pdf_content:
-                print(f"❌ Não foi possível baixar o PDF após {tentativas} tentativas")
-                print(f"💡 O Archive.org pode estar bloqueando downloads automáticos")
-                con.close()
-                return False
-                
-        else:
-            # PDF local
-            caminho = os.path.join(app.static_folder, 'ebooks', pedido['pdf'])
-            if os.path.exists(caminho):
-                with open(caminho, 'rb') as f:
-                    pdf_content = f.read()
-                print(f"✅ PDF local encontrado: {len(pdf_content):,} bytes")
-            else:
-                print(f"❌ Arquivo local não encontrado: {caminho}")
-                con.close()
-                return False
-
-    except requests.exceptions.Timeout:
-        print(f"❌ Timeout ao baixar PDF (excedeu 60s)")
-        con.close()
-        return False
-    except Exception as e:
-        print(f"❌ Erro ao obter PDF: {e}")
-        con.close()
-        return False
+        caminho = obter_pdf_livro(pedido['pdf'])
+        url_download = link_download(con, pedido, caminho)
+        if url_download:
+            con.commit()
+            print(f"🔗 Entrega por link: {url_download}")
+        
+        # Enviar email
+        try:
+            print(f"📧 Enviando para: {pedido['email']}")
+            print(f"   Servidor SMTP: {app.config['MAIL_SERVER']}:{app.config['MAIL_PORT']}")
+            print(f"   Usuário: {app.config['MAIL_USERNAME']}")
+            with smtp_pool.conexao() as envio:
+                enviar_pedido(envio, pedido, caminho, url_download)
+            print("✅ E-MAIL ENVIADO COM SUCESSO!")
+        except Exception as e:
+            raise _falha_smtp(e)
+    except FalhaEntrega as e:
+        sse.publicar('admin', 'entrega', {'pedido_id': pedido_id, 'ok': False, 'erro': str(e)})
+        raise
 
-    if not pdf_content:
-        con.close()
-        print("❌ PDF vazio ou não disponível")
-        return False
+    # Atualizar status (sem sobrescrever um REJEITADO feito durante o envio)
+    alterado = con.execute(SQL_MARCAR_PAGO, (pedido_id,)).rowcount
+    con.commit()
+    sse.publicar('admin', 'entrega', {'pedido_id': pedido_id, 'ok': True})
+    if alterado:
+        publicar_status(pedido_id, 'PAGO')
+    return True
 
-    # Buscar nome do usuário
-    nome_cliente = "Cliente"
-    try:
-        usuario = con.execute("""
-            SELECT u.nome 
-            FROM pedidos p 
-            LEFT JOIN usuarios u ON p.usuario_id = u.id 
-            WHERE p.id=?
-        """, (pedido_id,)).fetchone()
-        if usuario and usuario['nome']:
-            nome_cliente = usuario['nome']
-    except:
-        pass
-    
-    # Enviar email
-    try:
-        print(f"📧 Enviando para: {pedido['email']}")
-        print(f"   Tamanho do anexo: {len(pdf_content):,} bytes ({len(pdf_content)/1024/1024:.2f} MB)")
-        print(f"   Servidor SMTP: {app.config['MAIL_SERVER']}:{app.config['MAIL_PORT']}")
-        print(f"   Usuário: {app.config['MAIL_USERNAME']}")
-        
-        with app.app_context():
-            print("   Criando mensagem...")
-            msg = Message(
-                subject="Tudo certo! Seu ebook já está com você 📚✨",
-                recipients=[pedido['email']]
-            )
-            
-            # Corpo do email formatado
-            msg.body = (
-                f"Olá, {nome_cliente}!\n\n"
-                f"Que ótima notícia: seu pagamento foi confirmado! ✅\n\n"
-                f"O arquivo do seu novo e-book, \"{pedido['titulo']}\", já está anexado a este e-mail. "
-                f"Agora é só baixar, preparar um café (ou chá!) e aproveitar a leitura.\n\n"
-                f"Instruções rápidas:\n"
-                f"• Baixe o anexo.\n"
-                f"• Salve em seu dispositivo preferido.\n"
-                f"• Comece a ler!\n\n"
-                f"Caso tenha alguma dúvida sobre o uso do arquivo, você pode consultar nossos "
-                f"Termos e Políticas de Uso em http://localhost:5000/terms ou responder a este e-mail.\n\n"
-                f"Obrigada por escolher a ClicLeitura. Esperamos que essa história seja incrível!\n\n"
-                f"Um abraço,\n"
-                f"Equipe ClicLeitura!\n"
-            )
-            
-            print("   Anexando PDF...")
-            msg.attach(pdf_name, 'application/pdf', pdf_content)
-            
-            print("   Conectando ao servidor SMTP e enviando...")
-            mail.send(msg)
-        
-        print("✅ E-MAIL ENVIADO COM SUCESSO!")
+LOTE_MAXIMO = 500
+LOTE_DOWNLOADS = int(os.getenv('LOTE_DOWNLOADS', '4'))
 
-        # Atualizar status
-        con.execute("UPDATE pedidos SET status=? WHERE id=?", ('PAGO', pedido_id))
-        con.commit()
-        con.close()
-        
-        return True
+def entregar_lote(pedidos):
+    """Entrega vários pedidos: cada PDF é obtido uma vez (por livro), em paralelo,
+    e os envios começam assim que o PDF do livro fica pronto, com uma thread por
+    conexão do pool SMTP. Devolve {pedido_id: None (enviado) ou FalhaEntrega}.
+    """
+    por_livro = defaultdict(list)
+    for pedido in pedidos:
+        por_livro[pedido['livro_id']].append(pedido)
+    resultados = {}
+    prontos = queue.Queue()
 
-    except smtplib.SMTPAuthenticationError as e:
-        con.close()
-        print(f"❌ ERRO DE AUTENTICAÇÃO SMTP: {e}")
-        print("💡 A senha de app do Gmail pode estar incorreta ou expirada")
-        print("   Acesse: https://myaccount.google.com/apppasswords")
-        return False
-    except smtplib.SMTPException as e:
-        con.close()
-        print(f"❌ ERRO SMTP: {e}")
-        return False
-    except Exception as e:
-        con.close()
-        print(f"❌ Erro ao enviar email: {e}")
-        return False
+    def preparar(livro_id):
+        with app.app_context():  # cache_pdfs e links usam conectar()
+            caminho = obter_pdf_livro(por_livro[livro_id][0]['pdf'])
+            con = conectar()
+            urls = {pedido['id']: link_download(con, pedido, caminho) for pedido in por_livro[livro_id]}
+            con.commit()
+            return caminho, urls
+
+    def enviar_da_fila():
+        while True:
+            item = prontos.get()
+            if item is None:
+                return
+            pedido, caminho, url_download = item
+            try:
+                with smtp_pool.conexao() as envio:
+                    enviar_pedido(envio, pedido, caminho, url_download)
+                resultados[pedido['id']] = None
+            except Exception as e:
+                resultados[pedido['id']] = _falha_smtp(e)
+
+    remetentes = [threading.Thread(target=enviar_da_fila, daemon=True)
+                  for _ in range(smtp_pool.tamanho)]
+    for t in remetentes:
+        t.start()
+    with ThreadPoolExecutor(max_workers=LOTE_DOWNLOADS) as executor:
+        futuros = {executor.submit(preparar, livro_id): livro_id for livro_id in por_livro}
+        for futuro in as_completed(futuros):
+            livro_id = futuros[futuro]
+            try:
+                caminho, urls = futuro.result()
+            except Exception as e:
+                falha = e if isinstance(e, FalhaEntrega) else FalhaEntrega(str(e))
+                for pedido in por_livro[livro_id]:
+                    resultados[pedido['id']] = falha
+                continue
+            for pedido in por_livro[livro_id]:
+                prontos.put((pedido, caminho, urls[pedido['id']]))
+    for _ in remetentes:
+        prontos.put(None)
+    for t in remetentes:
+        t.join()
+    return resultados
+
+fila_entregas.tarefa = enviar_livro_email
+
+def publicar_status(pedido_id, status):
+    """Avisa a página do pedido e o painel (SSE) que o status mudou"""
+    dados = {'pedido_id': pedido_id, 'status': status}
+    sse.publicar(f'pedido:{pedido_id}', 'status', dados)
+    sse.publicar('admin', 'status', dados)
+    if status in ('PAGO', 'REJEITADO'):
+        # Status final: a página do pedido não espera mais nada deste canal
+        sse.encerrar(f'pedido:{pedido_id}')
+
+def publicar_pendente(con, pedido_id):
+    """Pedido entrou em PENDENTE_APROVACAO: o painel recebe o card pronto"""
+    pedido = con.execute(SQL_PEDIDOS_PENDENTES.format('AND p.id = ?'), (pedido_id,)).fetchone()
+    if pedido:
+        sse.publicar('admin', 'pendente', pedido_pendente_json(pedido))
+    publicar_status(pedido_id, 'PENDENTE_APROVACAO')
+
+def enfileirar_entrega(pedido_id, novo_status=None):
+    """Enfileira o envio do pedido e responde 202 com o job (ou 404)"""
+    con = conectar()
+    if not con.execute("SELECT 1 FROM pedidos WHERE id=?", (pedido_id,)).fetchone():
+        return jsonify({'error': 'Pedido não encontrado'}), 404
+    entrega_id, criada = fila_entregas.enfileirar(con, pedido_id)
+    if novo_status:
+        alterado = con.execute("UPDATE pedidos SET status=? WHERE id=? AND status != 'PAGO'",
+                               (novo_status, pedido_id)).rowcount
+    con.commit()
+    fila_entregas.avisar()
+    if novo_status and alterado:
+        publicar_status(pedido_id, novo_status)
+    
+    print(f"📬 Pedido #{pedido_id} na fila de entregas (job #{entrega_id}{'' if criada else ', já existente'})")
+    status_url = url_for('admin_entrega_status', entrega_id=entrega_id)
+    resp = jsonify({
+        'ok': True,
+        'entrega_id': entrega_id,
+        'status_url': status_url,
+        'message': f'Pedido #{pedido_id} na fila de envio. O e-book será enviado em instantes.'
+    })
+    resp.headers['Location'] = status_url
+    return resp, 202
 
 @app.route('/api/confirmar_pagamento', methods=['POST'])
 def confirmar_pagamento():
@@ -515,9 +748,10 @@ def confirmar_pagamento():
     
     # Atualizar status do pedido para aguardar aprovação do admin
     con = conectar()
-    con.execute("UPDATE pedidos SET status=? WHERE id=?", ('PENDENTE_APROVACAO', pedido_id))
+    alterado = con.execute("UPDATE pedidos SET status=? WHERE id=?", ('PENDENTE_APROVACAO', pedido_id)).rowcount
     con.commit()
-    con.close()
+    if alterado:
+        publicar_pendente(con, pedido_id)
     
     return jsonify({
         'ok': True, 
@@ -532,13 +766,10 @@ def api_cadastro():
         con.execute("INSERT INTO usuarios (nome, email, senha) VALUES (?, ?, ?)", 
                    (data['nome'], data['email'], data['senha']))
         con.commit()
-        con.close()
         return jsonify({'ok': True, 'message': 'Cadastro realizado com sucesso!'})
     except sqlite3.IntegrityError:
-        con.close()
         return jsonify({'error': 'E-mail já existe'}), 400
     except Exception as e:
-        con.close()
         print(f"❌ Erro no cadastro: {e}")
         return jsonify({'error': 'Erro ao processar cadastro'}), 500
 
@@ -548,7 +779,6 @@ def api_login():
     con = conectar()
     user = con.execute("SELECT * FROM usuarios WHERE email=? AND senha=?", 
                       (data.get('email'), data.get('senha'))).fetchone()
-    con.close()
     if user:
         return jsonify({'ok': True, 'usuario': {
             'id': user['id'],
@@ -577,7 +807,6 @@ def api_atualizar_perfil():
         ).fetchone()
         
         if email_existe:
-            con.close()
             return jsonify({'error': 'Este e-mail já está em uso'}), 400
         
         # Atualizar dados
@@ -586,12 +815,10 @@ def api_atualizar_perfil():
             (novo_nome, novo_email, usuario_id)
         )
         con.commit()
-        con.close()
         
         return jsonify({'ok': True, 'message': 'Dados atualizados com sucesso'})
         
     except Exception as e:
-        con.close()
         return jsonify({'error': f'Erro ao atualizar dados: {str(e)}'}), 500
 
 @app.route('/api/alterar-senha', methods=['POST'])
@@ -614,7 +841,6 @@ def api_alterar_senha():
         ).fetchone()
         
         if not usuario:
-            con.close()
             return jsonify({'error': 'Senha atual incorreta'}), 401
         
         # Atualizar senha
@@ -623,12 +849,10 @@ def api_alterar_senha():
             (nova_senha, usuario_id)
         )
         con.commit()
-        con.close()
         
         return jsonify({'ok': True, 'message': 'Senha alterada com sucesso'})
         
     except Exception as e:
-        con.close()
         return jsonify({'error': f'Erro ao alterar senha: {str(e)}'}), 500
 
 # --- APIs DO CARRINHO ---
@@ -648,7 +872,6 @@ def api_carrinho_adicionar():
         # Verificar se o livro existe
         livro = con.execute("SELECT id FROM livros WHERE id=?", (livro_id,)).fetchone()
         if not livro:
-            con.close()
             return jsonify({'error': 'Livro não encontrado'}), 404
         
         # Adicionar ao carrinho (UNIQUE constraint previne duplicatas)
@@ -659,38 +882,37 @@ def api_carrinho_adicionar():
             )
             con.commit()
         except sqlite3.IntegrityError:
-            con.close()
             return jsonify({'error': 'Este livro já está no carrinho'}), 400
         
-        con.close()
         return jsonify({'ok': True, 'message': 'Livro adicionado ao carrinho'})
         
     except Exception as e:
-        con.close()
         return jsonify({'error': f'Erro ao adicionar ao carrinho: {str(e)}'}), 500
 
+SQL_CARRINHO_ITENS = """
+    SELECT 
+        c.id,
+        c.livro_id,
+        l.titulo,
+        l.autor,
+        l.preco,
+        l.imagem
+    FROM carrinho c
+    JOIN livros l ON c.livro_id = l.id
+    WHERE c.usuario_id = ?
+    ORDER BY c.adicionado_em DESC
+"""
+
 @app.route('/api/carrinho/<int:usuario_id>')
+@cache_http.condicional(lambda usuario_id: [f'carrinho:{usuario_id}', 'livros'], 'private, no-cache')
 def api_carrinho_listar(usuario_id):
     """Lista os itens do carrinho do usuário"""
     con = conectar()
     try:
-        itens = con.execute("""
-            SELECT 
-                c.id,
-                c.livro_id,
-                l.titulo,
-                l.autor,
-                l.preco,
-                l.imagem
-            FROM carrinho c
-            JOIN livros l ON c.livro_id = l.id
-            WHERE c.usuario_id = ?
-            ORDER BY c.adicionado_em DESC
-        """, (usuario_id,)).fetchall()
+        itens = con.execute(SQL_CARRINHO_ITENS, (usuario_id,)).fetchall()
         
         total = sum(item['preco'] for item in itens)
         
-        con.close()
         
         return jsonify({
             'itens': [{
@@ -705,7 +927,6 @@ def api_carrinho_listar(usuario_id):
         })
         
     except Exception as e:
-        con.close()
         return jsonify({'error': f'Erro ao carregar carrinho: {str(e)}'}), 500
 
 @app.route('/api/carrinho/remover/<int:item_id>', methods=['DELETE'])
@@ -715,12 +936,10 @@ def api_carrinho_remover(item_id):
     try:
         con.execute("DELETE FROM carrinho WHERE id=?", (item_id,))
         con.commit()
-        con.close()
         
         return jsonify({'ok': True, 'message': 'Item removido do carrinho'})
         
     except Exception as e:
-        con.close()
         return jsonify({'error': f'Erro ao remover item: {str(e)}'}), 500
 
 @app.route('/api/carrinho/finalizar', methods=['POST'])
@@ -733,47 +952,45 @@ def api_carrinho_finalizar():
         return jsonify({'error': 'Usuário não informado'}), 400
     
     con = conectar()
-    try:
-        # Buscar usuário
-        usuario = con.execute("SELECT email FROM usuarios WHERE id=?", (usuario_id,)).fetchone()
-        if not usuario:
-            con.close()
-            return jsonify({'error': 'Usuário não encontrado'}), 404
-        
-        # Buscar itens do carrinho
-        itens = con.execute("""
-            SELECT c.id, c.livro_id
+    # Buscar usuário
+    usuario = con.execute("SELECT email FROM usuarios WHERE id=?", (usuario_id,)).fetchone()
+    if not usuario:
+        return jsonify({'error': 'Usuário não encontrado'}), 404
+
+    def criar_pedidos(con):
+        # Um pedido por item do carrinho num único INSERT ... SELECT; o carrinho é
+        # lido dentro da transação, então um segundo envio encontra o carrinho vazio
+        criados = con.execute("""
+            INSERT INTO pedidos (email, livro_id, usuario_id, status, total)
+            SELECT ?, c.livro_id, c.usuario_id, 'PENDENTE', l.preco
             FROM carrinho c
+            JOIN livros l ON c.livro_id = l.id
             WHERE c.usuario_id = ?
-        """, (usuario_id,)).fetchall()
+            ORDER BY c.id
+            RETURNING id, livro_id, total
+        """, (usuario['email'], usuario_id)).fetchall()
         
-        if not itens:
-            con.close()
-            return jsonify({'error': 'Carrinho vazio'}), 400
+        if not criados:
+            return {'error': 'Carrinho vazio'}, 400
         
-        # Criar pedidos para cada item
-        pedidos_criados = []
-        for item in itens:
-            cursor = con.cursor()
-            cursor.execute(
-                "INSERT INTO pedidos (email, livro_id, usuario_id, status) VALUES (?, ?, ?, ?)",
-                (usuario['email'], item['livro_id'], usuario_id, 'PENDENTE')
-            )
-            pedidos_criados.append(cursor.lastrowid)
+        # Item de cada pedido com o preço da compra (snapshot)
+        con.executemany("""
+            INSERT INTO pedido_itens (pedido_id, livro_id, titulo, preco)
+            SELECT ?, id, titulo, ? FROM livros WHERE id = ?
+        """, [(row['id'], row['total'], row['livro_id']) for row in criados])
+        pedidos_criados = [row['id'] for row in criados]
         
         # Limpar carrinho
         con.execute("DELETE FROM carrinho WHERE usuario_id=?", (usuario_id,))
-        con.commit()
-        con.close()
-        
-        return jsonify({
+        return {
             'ok': True,
             'message': f'{len(pedidos_criados)} pedido(s) criado(s) com sucesso',
             'pedidos': pedidos_criados
-        })
-        
+        }, 200
+
+    try:
+        return checkout_transacional(criar_pedidos)
     except Exception as e:
-        con.close()
         return jsonify({'error': f'Erro ao finalizar compra: {str(e)}'}), 500
 
 
@@ -786,9 +1003,8 @@ def api_carrinho_finalizar_pix():
     
     if not usuario_id or not email:
         return jsonify({'error': 'Dados incompletos'}), 400
-    
-    con = conectar()
-    try:
+
+    def criar_pedido_consolidado(con):
         # Buscar itens do carrinho com informações dos livros
         itens = con.execute("""
             SELECT c.livro_id, l.titulo, l.preco
@@ -798,8 +1014,7 @@ def api_carrinho_finalizar_pix():
         """, (usuario_id,)).fetchall()
         
         if not itens:
-            con.close()
-            return jsonify({'error': 'Carrinho vazio'}), 400
+            return {'error': 'Carrinho vazio'}, 400
         
         # Calcular total
         total = sum(item['preco'] for item in itens)
@@ -807,55 +1022,77 @@ def api_carrinho_finalizar_pix():
         
         # Criar UM pedido consolidado com múltiplos livros
         # Vamos usar o primeiro livro como referência e adicionar observação com todos os títulos
-        livro_ids = [str(item['livro_id']) for item in itens]
         titulos = [item['titulo'] for item in itens]
         
         observacao = f"PEDIDO CONSOLIDADO - {quantidade} livro(s): " + ", ".join(titulos)
         
-        cursor = con.cursor()
-        cursor.execute(
-            """INSERT INTO pedidos (email, livro_id, usuario_id, status, observacao) 
-               VALUES (?, ?, ?, ?, ?)""",
-            (email, itens[0]['livro_id'], usuario_id, 'PENDENTE', observacao)
+        pedido_id = con.execute(
+            """INSERT INTO pedidos (email, livro_id, usuario_id, status, observacao, total) 
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (email, itens[0]['livro_id'], usuario_id, 'PENDENTE', observacao, total)
+        ).lastrowid
+        con.executemany(
+            "INSERT INTO pedido_itens (pedido_id, livro_id, titulo, preco) VALUES (?, ?, ?, ?)",
+            [(pedido_id, item['livro_id'], item['titulo'], item['preco']) for item in itens]
         )
-        pedido_id = cursor.lastrowid
-        con.commit()
-        
-        # Gerar PIX
-        valor_str = f"{total:.2f}"
-        texto_pix = f"00020126580014BR.GOV.BCB.PIX0136{email}520400005303986540{valor_str}5802BR5911ClicLeitura6009Sao_Paulo62070503***6304"
         
-        img = qrcode.make(texto_pix)
-        buf = BytesIO()
-        img.save(buf, format='PNG')
-        qr_b64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-        
-        cursor.execute("UPDATE pedidos SET pix_code=? WHERE id=?", 
-                      (f"SIMULADO_{pedido_id}", pedido_id))
-        con.commit()
+        # Gerar PIX (BR Code com CRC); o QR é servido por /pix/<pedido_id>.png
+        texto_pix = pix.payload_pedido(pedido_id, total)
+        con.execute("UPDATE pedidos SET pix_code=? WHERE id=?", (texto_pix, pedido_id))
         
         # Limpar carrinho
         con.execute("DELETE FROM carrinho WHERE usuario_id=?", (usuario_id,))
-        con.commit()
-        con.close()
         
         print(f"✅ Pedido consolidado #{pedido_id} criado - {quantidade} livro(s) - Total: R$ {total:.2f}")
-        
-        return jsonify({
+        return {
             'pedido_id': pedido_id,
-            'qr_base64': qr_b64,
+            'qr_url': url_for('pix_qr', pedido_id=pedido_id, formato='png'),
             'pix_text': texto_pix,
             'total': total,
             'quantidade': quantidade,
             'livros': titulos
-        })
-        
+        }, 200
+
+    try:
+        return checkout_transacional(criar_pedido_consolidado)
     except Exception as e:
-        con.close()
         print(f"❌ Erro ao finalizar compra com PIX: {str(e)}")
         return jsonify({'error': f'Erro ao gerar pagamento PIX: {str(e)}'}), 500
 
 
+@app.route('/pix/<int:pedido_id>.<formato>')
+def pix_qr(pedido_id, formato):
+    """QR Code PIX do pedido (PNG ou SVG), renderizado uma vez e reaproveitado do cache"""
+    if formato not in pix.FORMATOS_QR:
+        return "Formato não suportado", 404
+    
+    pedido = conectar().execute("""
+        SELECT pix_code, total
+        FROM pedidos
+        WHERE id=?
+    """, (pedido_id,)).fetchone()
+    if not pedido:
+        return "Pedido não encontrado", 404
+    
+    texto_pix = pedido['pix_code']
+    if not texto_pix or not pix.payload_valido(texto_pix):
+        # Pedidos antigos guardavam só "SIMULADO_<id>"
+        texto_pix = pix.payload_pedido(pedido_id, pedido['total'])
+    
+    etag = f"{texto_pix[-4:]}-{formato}"
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        falhas = pix.renderizar_qr.cache_info().misses
+        inicio = time.perf_counter()
+        imagem = pix.renderizar_qr(texto_pix, formato)
+        if pix.renderizar_qr.cache_info().misses > falhas:  # gerado agora, não veio do cache
+            metricas.qr.observar(time.perf_counter() - inicio, formato=formato)
+        resp = app.response_class(imagem, mimetype=pix.FORMATOS_QR[formato])
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, max-age=86400'
+    return resp
+
 @app.route('/api/pedido/<int:pedido_id>/confirmar-pix', methods=['POST'])
 def api_confirmar_pagamento_pix(pedido_id):
     """Marca o pedido como aguardando aprovação após confirmação de pagamento"""
@@ -865,14 +1102,13 @@ def api_confirmar_pagamento_pix(pedido_id):
         pedido = con.execute("SELECT id, status FROM pedidos WHERE id=?", (pedido_id,)).fetchone()
         
         if not pedido:
-            con.close()
             return jsonify({'error': 'Pedido não encontrado'}), 404
         
         # Atualizar status para PENDENTE_APROVACAO
         con.execute("UPDATE pedidos SET status=? WHERE id=?", 
                    ('PENDENTE_APROVACAO', pedido_id))
         con.commit()
-        con.close()
+        publicar_pendente(con, pedido_id)
         
         print(f"✅ Pagamento PIX confirmado para pedido #{pedido_id} - Aguardando aprovação do admin")
         
@@ -883,7 +1119,6 @@ def api_confirmar_pagamento_pix(pedido_id):
         })
         
     except Exception as e:
-        con.close()
         print(f"❌ Erro ao confirmar pagamento PIX: {str(e)}")
         return jsonify({'error': f'Erro ao confirmar pagamento: {str(e)}'}), 500
 
@@ -932,7 +1167,6 @@ def admin_login():
             else:
                 print(f"   → Email não existe no banco")
         
-        con.close()
         
         if admin:
             session['admin_id'] = admin['id']
@@ -946,122 +1180,23 @@ def admin_login():
 @app.route('/admin/dashboard')
 @login_required
 def admin_dashboard():
-    con = conectar()
-    
-    # Estatísticas básicas
-    total_pedidos = con.execute("SELECT COUNT(*) as total FROM pedidos").fetchone()['total']
-    pedidos_pagos = con.execute("SELECT COUNT(*) as total FROM pedidos WHERE status='PAGO'").fetchone()['total']
-    pedidos_pendentes = con.execute("SELECT COUNT(*) as total FROM pedidos WHERE status='PENDENTE'").fetchone()['total']
-    pedidos_aguardando_aprovacao = con.execute("SELECT COUNT(*) as total FROM pedidos WHERE status='PENDENTE_APROVACAO'").fetchone()['total']
-    
-    # Receita total
-    receita = con.execute("""
-        SELECT SUM(l.preco) as total 
-        FROM pedidos p 
-        LEFT JOIN livros l ON p.livro_id = l.id 
-        WHERE p.status='PAGO' AND l.preco IS NOT NULL
-    """).fetchone()
-    receita_total = receita['total'] if receita['total'] else 0
-    
-    # Estatísticas do dashboard
-    pedidos_hoje = con.execute("""
-        SELECT COUNT(*) as total FROM pedidos 
-        WHERE DATE(criado_em) = DATE('now')
-    """).fetchone()['total']
-    
-    receita_hoje = con.execute("""
-        SELECT SUM(l.preco) as total 
-        FROM pedidos p 
-        LEFT JOIN livros l ON p.livro_id = l.id 
-        WHERE p.status='PAGO' AND DATE(p.criado_em) = DATE('now')
-    """).fetchone()
-    receita_hoje_valor = receita_hoje['total'] if receita_hoje['total'] else 0
-    
-    total_livros = con.execute("SELECT COUNT(*) as total FROM livros").fetchone()['total']
-    total_clientes = con.execute("SELECT COUNT(*) as total FROM usuarios").fetchone()['total']
-    
-    # Livro mais vendido
-    livro_mais_vendido = con.execute("""
-        SELECT l.titulo, COUNT(*) as vendas
-        FROM pedidos p
-        JOIN livros l ON p.livro_id = l.id
-        WHERE p.status = 'PAGO'
-        GROUP BY l.titulo
-        ORDER BY vendas DESC
-        LIMIT 1
-    """).fetchone()
-    livro_mais_vendido_nome = livro_mais_vendido['titulo'][:50] if livro_mais_vendido else None
-    
-    # Clientes novos este mês
-    clientes_mes = con.execute("""
-        SELECT COUNT(*) as total FROM usuarios 
-        WHERE strftime('%Y-%m', criado_em) = strftime('%Y-%m', 'now')
-    """).fetchone()['total']
-    
-    # Últimos pedidos
-    pedidos = con.execute("""
-        SELECT 
-            p.id,
-            p.email,
-            p.livro_id,
-            p.status,
-            p.criado_em,
-            p.usuario_id,
-            COALESCE(u.nome, 'Cliente não identificado') as nome_cliente,
-            COALESCE(l.titulo, 'Livro não disponível (ID: ' || p.livro_id || ')') as titulo,
-            COALESCE(l.preco, 0) as preco
-        FROM pedidos p 
-        LEFT JOIN livros l ON p.livro_id = l.id
-        LEFT JOIN usuarios u ON p.usuario_id = u.id
-        ORDER BY p.id DESC 
-        LIMIT 50
-    """).fetchall()
-    
-    # Todos os livros
-    livros = con.execute("""
-        SELECT id, titulo, autor, preco, imagem, origem
-        FROM livros
-        ORDER BY id DESC
-    """).fetchall()
-    
-    # Clientes com estatísticas
-    clientes = con.execute("""
-        SELECT 
-            u.id,
-            u.nome,
-            u.email,
-            u.criado_em,
-            COUNT(p.id) as total_compras,
-            COALESCE(SUM(CASE WHEN p.status='PAGO' THEN l.preco ELSE 0 END), 0) as total_gasto
-        FROM usuarios u
-        LEFT JOIN pedidos p ON u.id = p.usuario_id
-        LEFT JOIN livros l ON p.livro_id = l.id
-        GROUP BY u.id, u.nome, u.email, u.criado_em
-        ORDER BY u.id DESC
-    """).fetchall()
-    
-    con.close()
-    
-    stats = {
-        'total_pedidos': total_pedidos,
-        'pedidos_pagos': pedidos_pagos,
-        'pedidos_pendentes': pedidos_pendentes,
-        'pedidos_aguardando_aprovacao': pedidos_aguardando_aprovacao,
-        'receita_total': receita_total,
-        'pedidos_hoje': pedidos_hoje,
-        'receita_hoje': receita_hoje_valor,
-        'total_livros': total_livros,
-        'total_clientes': total_clientes,
-        'livro_mais_vendido': livro_mais_vendido_nome,
-        'clientes_mes': clientes_mes
-    }
+    # Só o esqueleto e as estatísticas (rollups mantidos por triggers, ver
+    # rollups.py); cada aba carrega a sua tabela sob demanda em /api/admin/<aba>
+    stats = rollups.painel(conectar())
     
     return render_template('dashboard.html', 
                          admin_email=session['admin_email'],
-                         stats=stats,
-                         pedidos=pedidos,
-                         livros=livros,
-                         clientes=clientes)
+                         stats=stats)
+
+@app.route('/api/admin/<any(pedidos, livros, clientes):tabela>')
+@login_required
+def admin_tabela(tabela):
+    """Uma página da aba: ?ordem=-criado_em&campos=id,email&limite=25&cursor=...&status=PAGO"""
+    try:
+        pagina = tabelas_admin.listar(conectar(), tabela, request.args)
+    except ConsultaInvalida as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'ok': True, **pagina})
 
 @app.route('/admin/enviar-livro', methods=['POST'])
 @login_required
@@ -1075,13 +1210,7 @@ def admin_enviar_livro():
     
     print(f"\n📤 Admin solicitou envio do pedido #{pedido_id}")
     
-    # Usar a função auxiliar que já criamos
-    sucesso = enviar_livro_email(pedido_id)
-    
-    if sucesso:
-        return jsonify({'ok': True, 'message': 'Livro enviado com sucesso'})
-    else:
-        return jsonify({'error': 'Falha ao enviar o livro. Verifique os logs.'}), 500
+    return enfileirar_entrega(pedido_id)
 
 @app.route('/admin/logout')
 def admin_logout():
@@ -1089,59 +1218,271 @@ def admin_logout():
     session.pop('admin_email', None)
     return redirect(url_for('admin_login'))
 
+@app.route('/api/admin/metricas')
+@login_required
+def admin_metricas():
+    """Séries de pedidos/receita/clientes: ?de=AAAA-MM-DD&ate=AAAA-MM-DD&granularidade=dia|semana|mes"""
+    granularidade = request.args.get('granularidade', 'dia')
+    if granularidade not in rollups.BALDES:
+        return jsonify({'error': 'granularidade deve ser dia, semana ou mes'}), 400
+    try:
+        ate = date.fromisoformat(request.args['ate']) if request.args.get('ate') else datetime.utcnow().date()
+        de = date.fromisoformat(request.args['de']) if request.args.get('de') else ate - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'Datas no formato AAAA-MM-DD'}), 400
+    if de > ate:
+        return jsonify({'error': 'de deve ser anterior a ate'}), 400
+    if rollups.quantidade_baldes(de, ate, granularidade) > rollups.SERIE_MAXIMO_BALDES:
+        return jsonify({'error': f'Intervalo longo demais (máximo {rollups.SERIE_MAXIMO_BALDES} pontos); '
+                                 f'use uma granularidade maior'}), 400
+    
+    pontos = rollups.serie(conectar(), de, ate, granularidade)
+    return jsonify({
+        'ok': True,
+        'de': de.isoformat(),
+        'ate': ate.isoformat(),
+        'granularidade': granularidade,
+        'serie': pontos,
+        'totais': {
+            campo: round(sum(p[campo] for p in pontos), 2)
+            for campo in ('pedidos', 'pedidos_pagos', 'receita', 'novos_clientes')
+        },
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Métricas no formato texto do Prometheus (METRICAS_TOKEN exige Bearer)"""
+    token = os.getenv('METRICAS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return "Não autorizado", 401
+    resp = app.response_class(metricas.exportar(), mimetype='text/plain')
+    resp.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+@app.route('/api/admin/sql-profiler', methods=['GET', 'POST'])
+@login_required
+def admin_sql_profiler():
+    """Liga/desliga a análise de SQL (POST {"ativo": true}) e mostra os relatórios recentes"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        app.config['SQL_PROFILER'] = bool(data.get('ativo'))
+        print(f"🔎 Análise de SQL {'ligada' if app.config['SQL_PROFILER'] else 'desligada'} por {session['admin_email']}")
+    return jsonify({'ok': True, 'ativo': app.config['SQL_PROFILER'], **analisador_sql.resumo()})
+
+@app.route('/api/admin/db-pool')
+@login_required
+def admin_db_pool():
+    """Contadores do pool de conexões (acertos/falhas/esperas) para dimensionamento"""
+    return jsonify({'ok': True, 'pool': app.extensions['pool_db'].estatisticas()})
+
+SQL_PEDIDOS_PENDENTES = """
+    SELECT p.id, p.criado_em, p.total, p.status,
+           u.nome as cliente_nome, u.email as cliente_email,
+           l.titulo as livro_titulo, l.imagem as livro_capa
+    FROM pedidos p
+    JOIN usuarios u ON p.usuario_id = u.id
+    JOIN livros l ON p.livro_id = l.id
+    WHERE p.status = 'PENDENTE_APROVACAO' {}
+    ORDER BY p.criado_em DESC
+"""
+
+def pedido_pendente_json(p):
+    return {
+        'id': p['id'],
+        'data_pedido': p['criado_em'],
+        'preco_final': p['total'] if p['total'] else 0,
+        'status': p['status'],
+        'cliente_nome': p['cliente_nome'],
+        'cliente_email': p['cliente_email'],
+        'livro_titulo': p['livro_titulo'],
+        'livro_capa': p['livro_capa']
+    }
+
+@app.route('/api/admin/cache-paginas')
+@login_required
+def admin_cache_paginas():
+    """Estatísticas do cache de páginas renderizadas (acertos/falhas/remoções)"""
+    return jsonify({'ok': True, 'cache': app.extensions['cache_paginas'].estatisticas()})
+
+@app.route('/api/admin/cache-pdfs')
+@login_required
+def admin_cache_pdfs():
+    """Estatísticas do cache de PDFs (acertos, revalidações, bytes economizados)"""
+    return jsonify({'ok': True, 'cache': cache_pdfs_disco.estatisticas()})
+
+@app.route('/api/admin/http-hosts')
+@login_required
+def admin_http_hosts():
+    """Downloads por host remoto e estado do disjuntor de 403"""
+    return jsonify({'ok': True, 'hosts': cliente_http.estatisticas()})
+
+@app.route('/api/admin/smtp-pool')
+@login_required
+def admin_smtp_pool():
+    """Conexões SMTP criadas/reaproveitadas e tempo médio por mensagem"""
+    return jsonify({'ok': True, 'pool': smtp_pool.estatisticas()})
+
+@app.route('/api/admin/downloads')
+@login_required
+def admin_downloads():
+    """Links de download emitidos, downloads contados e modo de entrega"""
+    return jsonify({'ok': True, 'modo': ENTREGA_MODO, 'sendfile': links.modo_sendfile or None,
+                    'downloads': links.estatisticas(conectar())})
+
+@app.route('/api/admin/cache-pix')
+@login_required
+def admin_cache_pix():
+    """Estatísticas do cache de QR Codes PIX renderizados"""
+    return jsonify({'ok': True, 'cache': pix.estatisticas()})
+
 @app.route('/api/admin/pedidos-pendentes')
 @login_required
 def listar_pedidos_pendentes():
     """Lista todos os pedidos aguardando aprovação do admin"""
     con = conectar()
-    cur = con.cursor()
-    
-    pedidos = cur.execute("""
-        SELECT p.id, p.criado_em, l.preco, p.status,
-               u.nome as cliente_nome, u.email as cliente_email,
-               l.titulo as livro_titulo, l.imagem as livro_capa
-        FROM pedidos p
-        JOIN usuarios u ON p.usuario_id = u.id
-        JOIN livros l ON p.livro_id = l.id
-        WHERE p.status = 'PENDENTE_APROVACAO'
-        ORDER BY p.criado_em DESC
-    """).fetchall()
+    pedidos = con.execute(SQL_PEDIDOS_PENDENTES.format('')).fetchall()
     
-    con.close()
-    
-    pedidos_lista = []
-    for p in pedidos:
-        pedidos_lista.append({
-            'id': p[0],
-            'data_pedido': p[1],
-            'preco_final': p[2] if p[2] else 0,
-            'status': p[3],
-            'cliente_nome': p[4],
-            'cliente_email': p[5],
-            'livro_titulo': p[6],
-            'livro_capa': p[7]
-        })
-    
-    return jsonify({'ok': True, 'pedidos': pedidos_lista})
+    # Depois da carga inicial, o painel acompanha as mudanças por /api/admin/eventos
+    return jsonify({'ok': True, 'pedidos': [pedido_pendente_json(p) for p in pedidos]})
+
+def resposta_sse(canal):
+    """Conexão text/event-stream do canal; Last-Event-ID repõe o que se perdeu"""
+    ultimo_id = request.headers.get('Last-Event-ID', type=int)
+    resp = app.response_class(sse.stream(canal, ultimo_id), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'  # nginx: não segurar os eventos no buffer
+    return resp
+
+@app.route('/api/admin/eventos')
+@login_required
+def admin_eventos():
+    """SSE do painel: pedidos novos aguardando aprovação, mudanças de status e entregas"""
+    return resposta_sse('admin')
+
+@app.route('/api/pedido/<int:pedido_id>/eventos')
+def pedido_eventos(pedido_id):
+    """SSE do cliente: status do pedido (aguardando, aprovado, pago, rejeitado)"""
+    if not conectar().execute("SELECT 1 FROM pedidos WHERE id=?", (pedido_id,)).fetchone():
+        return jsonify({'error': 'Pedido não encontrado'}), 404
+    return resposta_sse(f'pedido:{pedido_id}')
+
+@app.route('/api/admin/sse')
+@login_required
+def admin_sse():
+    """Conexões SSE abertas e eventos publicados/entregues/descartados"""
+    return jsonify({'ok': True, 'sse': sse.estatisticas()})
 
 @app.route('/api/admin/aprovar/<int:pedido_id>', methods=['POST'])
 @login_required
 def aprovar_pedido(pedido_id):
-    """Aprova pedido, envia o e-book e atualiza status para PAGO"""
+    """Aprova pedido e enfileira o envio do e-book (status vira PAGO quando o e-mail sai)"""
     print(f"\n✅ Admin aprovando pedido #{pedido_id}...")
     
-    # Enviar o e-book
-    sucesso = enviar_livro_email(pedido_id)
+    return enfileirar_entrega(pedido_id, novo_status='APROVADO')
+
+@app.route('/api/admin/aprovar-lote', methods=['POST'])
+@login_required
+def aprovar_lote():
+    """Aprova vários pedidos de uma vez e entrega na hora, com resultado por pedido.
+
+    Falhas temporárias vão para a fila de entregas (novas tentativas com backoff).
+    """
+    data = request.get_json(silent=True) or {}
+    ids = data.get('pedido_ids')
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+        return jsonify({'error': 'Informe pedido_ids (lista de ids)'}), 400
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > LOTE_MAXIMO:
+        return jsonify({'error': f'No máximo {LOTE_MAXIMO} pedidos por lote'}), 400
     
-    if sucesso:
-        return jsonify({
-            'ok': True, 
-            'message': f'Pedido #{pedido_id} aprovado! E-book enviado ao cliente.'
-        })
-    else:
-        return jsonify({
-            'error': 'Falha ao enviar o e-book. Verifique os logs.'
-        }), 500
+    inicio = time.perf_counter()
+    print(f"\n✅ Admin aprovando lote de {len(ids)} pedidos...")
+    con = conectar()
+    marcadores = ', '.join('?' * len(ids))
+    pedidos = {row['id']: row for row in con.execute(SQL_PEDIDOS_ENTREGA.format(marcadores), ids)}
+    na_fila = {row['pedido_id']: row['id'] for row in con.execute(f"""
+        SELECT id, pedido_id FROM entregas
+        WHERE pedido_id IN ({marcadores}) AND estado IN ('PENDENTE', 'PROCESSANDO')
+    """, ids)}
+    
+    resultados = {}
+    entregar = []
+    for pedido_id in ids:
+        pedido = pedidos.get(pedido_id)
+        if not pedido:
+            resultados[pedido_id] = {'ok': False, 'status': 'NAO_ENCONTRADO'}
+        elif pedido['status'] == 'PAGO':
+            resultados[pedido_id] = {'ok': True, 'status': 'JA_ENVIADO'}
+        elif pedido_id in na_fila:
+            # Já tem um trabalhador cuidando: não enviar duas vezes
+            resultados[pedido_id] = {'ok': True, 'status': 'NA_FILA', 'entrega_id': na_fila[pedido_id]}
+        elif pedido['status'] not in STATUS_APROVAVEIS:
+            # Rejeitado ou ainda não pago: não entrega
+            resultados[pedido_id] = {'ok': False, 'status': 'STATUS_INVALIDO',
+                                     'status_pedido': pedido['status']}
+        else:
+            entregar.append(pedido)
+    
+    # O status pode ter mudado desde a leitura: só segue quem ainda é aprovável
+    aprovaveis = ', '.join('?' * len(STATUS_APROVAVEIS))
+    for pedido in list(entregar):
+        alterado = con.execute(f"UPDATE pedidos SET status='APROVADO' WHERE id=? AND status IN ({aprovaveis})",
+                               (pedido['id'], *STATUS_APROVAVEIS)).rowcount
+        if not alterado:
+            entregar.remove(pedido)
+            resultados[pedido['id']] = {'ok': False, 'status': 'STATUS_INVALIDO'}
+    con.commit()
+    for pedido in entregar:
+        publicar_status(pedido['id'], 'APROVADO')
+    
+    enviados = []
+    for pedido_id, falha in entregar_lote(entregar).items():
+        if falha is None:
+            enviados.append((pedido_id,))
+            resultados[pedido_id] = {'ok': True, 'status': 'ENVIADO'}
+        elif falha.definitiva:
+            # Fica registrada como entrega FALHOU (visível em /api/admin/entregas)
+            entrega_id = fila_entregas.registrar_falha(con, pedido_id, str(falha))
+            resultados[pedido_id] = {'ok': False, 'status': 'FALHOU', 'entrega_id': entrega_id,
+                                     'erro': str(falha)}
+        else:
+            entrega_id, _ = fila_entregas.enfileirar(con, pedido_id)
+            resultados[pedido_id] = {'ok': True, 'status': 'NA_FILA', 'entrega_id': entrega_id,
+                                     'erro': str(falha)}
+    pagos = [pedido_id for pedido_id, in enviados if con.execute(SQL_MARCAR_PAGO, (pedido_id,)).rowcount]
+    con.commit()
+    fila_entregas.avisar()
+    for pedido_id in pagos:
+        publicar_status(pedido_id, 'PAGO')
+    
+    resumo = defaultdict(int)
+    for resultado in resultados.values():
+        resumo[resultado['status']] += 1
+    tempo = time.perf_counter() - inicio
+    print(f"📦 Lote concluído em {tempo:.1f}s: {dict(resumo)}")
+    return jsonify({
+        'ok': True,
+        'resumo': resumo,
+        'livros': len({p['livro_id'] for p in entregar}),
+        'tempo_s': round(tempo, 2),
+        'resultados': [dict(pedido_id=pedido_id, **resultados[pedido_id]) for pedido_id in ids]
+    })
+
+@app.route('/api/admin/entregas')
+@login_required
+def admin_entregas():
+    """Contadores da fila de entregas por estado"""
+    return jsonify({'ok': True, 'fila': fila_entregas.estatisticas(conectar())})
+
+@app.route('/api/admin/entregas/<int:entrega_id>')
+@login_required
+def admin_entrega_status(entrega_id):
+    """Estado de um job de entrega (tentativas, próxima execução, último erro)"""
+    entrega = fila_entregas.obter(conectar(), entrega_id)
+    if not entrega:
+        return jsonify({'error': 'Entrega não encontrada'}), 404
+    return jsonify({'ok': True, 'entrega': entrega})
 
 @app.route('/api/admin/rejeitar/<int:pedido_id>', methods=['POST'])
 @login_required
@@ -1153,25 +1494,176 @@ def rejeitar_pedido(pedido_id):
     print(f"\n❌ Admin rejeitando pedido #{pedido_id}. Motivo: {motivo}")
     
     con = conectar()
-    
-    # Verificar se a coluna observacao existe, caso não, adicioná-la
-    try:
-        con.execute("ALTER TABLE pedidos ADD COLUMN observacao TEXT")
-        con.commit()
-        print("✅ Coluna 'observacao' adicionada à tabela pedidos")
-    except:
-        pass  # Coluna já existe
-    
     con.execute("UPDATE pedidos SET status=?, observacao=? WHERE id=?", 
                 ('REJEITADO', motivo, pedido_id))
+    # Entregas ainda na fila (ou em backoff) não saem mais
+    canceladas = fila_entregas.cancelar(con, pedido_id, f"Pedido rejeitado: {motivo}")
     con.commit()
-    con.close()
+    if canceladas:
+        print(f"🛑 {canceladas} entrega(s) do pedido #{pedido_id} cancelada(s)")
+    publicar_status(pedido_id, 'REJEITADO')
     
     return jsonify({
         'ok': True, 
         'message': f'Pedido #{pedido_id} rejeitado.'
     })
 
+# --- COMANDOS DE MANUTENÇÃO (flask --app app <comando>) ---
+
+@app.cli.command('migrar')
+def cli_migrar():
+    """Aplica as migrações pendentes do banco"""
+    aplicadas = migracoes.aplicar(DB)
+    if not aplicadas:
+        print("✅ Banco já está atualizado")
+    print(f"🗄️  Versão do esquema: {migracoes.versao_atual(conectar())}")
+
+@app.cli.command('explicar-consultas')
+def cli_explicar_consultas():
+    """Mostra o EXPLAIN QUERY PLAN das consultas quentes"""
+    consultas = [
+        ('api_perfil: resumo', SQL_PERFIL_RESUMO, (1,)),
+        ('api_perfil_pedidos: 1ª página', SQL_PERFIL_PEDIDOS.format(''), (1, PERFIL_PAGINA + 1)),
+        ('api_perfil_pedidos: cursor', SQL_PERFIL_PEDIDOS.format(SQL_PERFIL_PEDIDOS_CURSOR),
+         (1, 1, PERFIL_PAGINA + 1)),
+        ('api_carrinho_listar', SQL_CARRINHO_ITENS, (1,)),
+        ('listar_pedidos_pendentes', SQL_PEDIDOS_PENDENTES.format(''), ()),
+        ('publicar_pendente', SQL_PEDIDOS_PENDENTES.format('AND p.id = ?'), (1,)),
+    ]
+    for tabela, spec in tabelas_admin.TABELAS.items():
+        for ordem in spec['ordenaveis']:
+            sql, params, *_ = tabelas_admin.consulta(tabela, {'ordem': f'-{ordem}'})
+            consultas.append((f'admin_tabela {tabela}: ordem -{ordem}', sql, params))
+    migracoes.explicar(conectar(), consultas)
+
+@app.cli.command('sql-perfil')
+@click.argument('caminhos', nargs=-1, required=True)
+@click.option('--max-consultas', default=0, help='Falha se alguma requisição passar deste número')
+def cli_sql_perfil(caminhos, max_consultas):
+    """Faz GET nos caminhos com a análise de SQL ligada; sai com erro se houver N+1/SCAN"""
+    app.config['SQL_PROFILER'] = True
+    analisador_sql.max_consultas = max_consultas or analisador_sql.max_consultas
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:  # rotas /admin e /api/admin
+        sessao['admin_id'], sessao['admin_email'] = 0, 'sql-perfil'
+    problemas = 0
+    for caminho in caminhos:
+        cliente.get(caminho)
+        relatorio = analisador_sql.relatorios[-1]
+        problemas += bool(relatorio['n_mais_1'] or relatorio['scans'] or relatorio['acima_do_limite'])
+    if problemas:
+        raise click.ClickException(f"{problemas} de {len(caminhos)} requisições com alertas de SQL")
+    print(f"✅ {len(caminhos)} requisições sem N+1, SCAN ou excesso de consultas")
+
+@app.cli.command('rollups-reconstruir')
+def cli_rollups_reconstruir():
+    """Recalcula os agregados do dashboard e do perfil a partir do histórico completo"""
+    con = conectar()
+    rollups.reconstruir(con)
+    rollups.reconstruir_usuarios(con)
+    con.commit()
+    print("✅ Rollups do dashboard e do perfil reconstruídos")
+
+@app.cli.command('busca-reindexar')
+def cli_busca_reindexar():
+    """Reconstrói o índice de busca textual (livros existentes)"""
+    con = conectar()
+    busca.reindexar(con)
+    con.commit()
+    print("✅ Índice de busca reconstruído")
+
+@app.cli.command('ativos-build')
+def cli_ativos_build():
+    """Gera os nomes com hash e as variantes .gz/.br dos arquivos estáticos"""
+    if 'ativos' not in app.extensions:
+        print("⚠️  ATIVOS_FINGERPRINT desativado - nada a fazer")
+        return
+    resumo = app.extensions['ativos'].estatisticas()
+    print(f"✅ {resumo['arquivos']} arquivos ({resumo['gzip']} gzip, {resumo['brotli']} brotli)")
+
+@app.cli.command('capas-gerar')
+def cli_capas_gerar():
+    """Espelha as capas remotas e gera todas as miniaturas antecipadamente"""
+    servico = app.extensions['capas']
+    con = conectar()
+    for livro in con.execute("SELECT id, imagem FROM livros WHERE imagem IS NOT NULL AND imagem != ''"):
+        try:
+            for largura in capas.LARGURAS:
+                for formato in capas.FORMATOS:
+                    servico.variante(livro['imagem'], largura, formato)
+        except capas.CapaIndisponivel as e:
+            print(f"⚠️  Livro #{livro['id']}: {e}")
+    resumo = servico.estatisticas()
+    print(f"✅ Capas: {resumo['espelhadas']} espelhadas, {resumo['geradas']} miniaturas geradas, {resumo['falhas']} falhas")
+
+@app.cli.command('entregas-trabalhar')
+def cli_entregas_trabalhar():
+    """Roda os trabalhadores da fila de entregas em primeiro plano (processo dedicado)"""
+    print(f"📬 {fila_entregas.trabalhadores} trabalhadores consumindo a fila de entregas (Ctrl+C para sair)")
+    fila_entregas.rodar()
+
+@app.cli.command('http-bench')
+@click.option('--downloads', default=20, help='Downloads simultâneos')
+@click.option('--mb', default=2.0, help='Tamanho de cada PDF')
+@click.option('--atraso', default=0.05, help='Latência simulada do servidor (s)')
+def cli_http_bench(downloads, mb, atraso):
+    """Mede downloads em rajada contra o servidor local de PDFs (servidores_locais.py)"""
+    from concurrent.futures import ThreadPoolExecutor
+    from servidores_locais import ServidorPdf
+
+    def baixar(url):
+        inicio = time.perf_counter()
+        with cliente_http.abrir(url) as resp:
+            for _ in resp.iter_content(chunk_size=65536):
+                pass
+        return time.perf_counter() - inicio
+
+    with ServidorPdf(atraso=atraso) as servidor:
+        urls = [f"{servidor.url}/bench-{i % 4}.pdf?mb={mb}" for i in range(downloads)]
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=downloads) as executor:
+            tempos = sorted(executor.map(baixar, urls))
+        total = time.perf_counter() - inicio
+    print(f"✅ {downloads} downloads de {mb:g} MB em {total:.2f}s "
+          f"(p50 {tempos[len(tempos) // 2]:.3f}s, p95 {tempos[int(len(tempos) * 0.95) - 1]:.3f}s, "
+          f"limite {cliente_http.limite_por_host} por host)")
+
+@app.cli.command('smtp-bench')
+@click.option('--mensagens', default=50, help='Mensagens enviadas em cada modo')
+@click.option('--kb', default=256, help='Tamanho do anexo')
+def cli_smtp_bench(mensagens, kb):
+    """Compara uma conexão SMTP por mensagem com o pool, contra o SMTP local"""
+    import tempfile
+    from servidores_locais import ServidorSmtp
+
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as anexo, ServidorSmtp() as servidor:
+        anexo.write(b'%PDF-1.4\n' + os.urandom(kb * 1024))
+        anexo.flush()
+        remetente = 'loja@localhost'
+
+        def mensagem():
+            return envio_email.mensagem_com_anexo(remetente, ['cliente@localhost'], 'Teste',
+                                                  'Olá!', anexo.name, 'teste.pdf')
+
+        pool = pool_smtp.PoolSmtp('127.0.0.1', servidor.porta, usar_ssl=False, tamanho=1)
+        inicio = time.perf_counter()
+        for _ in range(mensagens):
+            smtp = smtplib.SMTP('127.0.0.1', servidor.porta, timeout=30)
+            envio_email.enviar(smtp, remetente, ['cliente@localhost'], mensagem())
+            smtp.quit()
+        sem_pool = (time.perf_counter() - inicio) / mensagens
+
+        inicio = time.perf_counter()
+        with pool.conexao() as envio:
+            for _ in range(mensagens):
+                envio.enviar(envio_email.enviar, remetente, ['cliente@localhost'], mensagem())
+        com_pool = (time.perf_counter() - inicio) / mensagens
+        pool.fechar_todas()
+
+    print(f"✅ {servidor.mensagens} mensagens recebidas em {servidor.conexoes} conexões")
+    print(f"   Nova conexão por mensagem: {sem_pool * 1000:.1f} ms/mensagem")
+    print(f"   Conexão do pool (lote):    {com_pool * 1000:.1f} ms/mensagem")
+
 if __name__ == '__main__':
     print("🚀 Servidor iniciando em http://localhost:5000")
     app.run(debug=True)
@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from flask import current_app, request, send_file, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # opcional: sem o pacote só geramos .gz
+    brotli = None
+
+# Pipeline de arquivos estáticos: cada arquivo de static/css, static/js e
+# static/images ganha um nome com hash do conteúdo (css/index.3f2a1b9c04de.css),
+# servido com cache imutável de 1 ano. Textos recebem variantes .gz/.br.
+
+PASTAS = ('css', 'js', 'images')
+EXTENSOES_COMPRIMIVEIS = ('.css', '.js', '.svg', '.json', '.txt')
+CACHE_IMUTAVEL = 'public, max-age=31536000, immutable'
+
+
+def _nome_com_hash(caminho_relativo, digest):
+    base, ext = os.path.splitext(caminho_relativo)
+    return f"{base}.{digest}{ext}"
+
+
+class Ativos:
+    """Manifesto nome original -> nome com hash, e as variantes comprimidas"""
+
+    def __init__(self, pasta_static, pasta_build):
+        self.pasta_static = pasta_static
+        self.pasta_build = pasta_build
+        self._por_nome = {}
+        self._por_hash = {}
+        self._lock = threading.Lock()
+
+    def construir(self):
+        """Calcula os hashes e gera os .gz/.br que ainda não existem"""
+        for pasta in PASTAS:
+            raiz = os.path.join(self.pasta_static, pasta)
+            if not os.path.isdir(raiz):
+                continue
+            for diretorio, _, arquivos in os.walk(raiz):
+                for arquivo in arquivos:
+                    caminho = os.path.join(diretorio, arquivo)
+                    relativo = os.path.relpath(caminho, self.pasta_static).replace(os.sep, '/')
+                    self._registrar(relativo)
+        return len(self._por_nome)
+
+    def _registrar(self, relativo):
+        caminho = os.path.join(self.pasta_static, relativo)
+        st = os.stat(caminho)
+        with open(caminho, 'rb') as f:
+            conteudo = f.read()
+        digest = hashlib.sha256(conteudo).hexdigest()[:12]
+        nome_hash = _nome_com_hash(relativo, digest)
+
+        ativo = {
+            'original': relativo,
+            'hash': nome_hash,
+            'caminho': caminho,
+            'mtime': st.st_mtime_ns,
+            'mimetype': mimetypes.guess_type(relativo)[0] or 'application/octet-stream',
+            'gzip': None,
+            'br': None,
+        }
+        if relativo.endswith(EXTENSOES_COMPRIMIVEIS):
+            ativo['gzip'] = self._variante(nome_hash, '.gz', conteudo,
+                                           lambda c: gzip.compress(c, compresslevel=9, mtime=0))
+            if brotli is not None:
+                ativo['br'] = self._variante(nome_hash, '.br', conteudo,
+                                             lambda c: brotli.compress(c, quality=11))
+
+        with self._lock:
+            antigo = self._por_nome.get(relativo)
+            if antigo is not None:
+                self._por_hash.pop(antigo['hash'], None)
+            self._por_nome[relativo] = ativo
+            self._por_hash[nome_hash] = ativo
+        return ativo
+
+    def _variante(self, nome_hash, sufixo, conteudo, comprimir):
+        """Grava a variante comprimida (nome com hash = nunca precisa ser refeita)"""
+        destino = os.path.join(self.pasta_build, nome_hash + sufixo)
+        if not os.path.exists(destino):
+            comprimido = comprimir(conteudo)
+            if len(comprimido) >= len(conteudo):
+                return None
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            temporario = f"{destino}.{os.getpid()}.tmp"
+            with open(temporario, 'wb') as f:
+                f.write(comprimido)
+            os.replace(temporario, destino)
+        return destino
+
+    def _ativo(self, relativo):
+        ativo = self._por_nome.get(relativo)
+        if ativo is not None and current_app.debug:
+            # Modo debug: CSS/JS editados com o servidor rodando ganham novo hash
+            try:
+                if os.stat(ativo['caminho']).st_mtime_ns != ativo['mtime']:
+                    ativo = self._registrar(relativo)
+            except FileNotFoundError:
+                return None
+        return ativo
+
+    def nome_publico(self, relativo):
+        """Nome com hash para url_for('static'); arquivos fora do manifesto ficam iguais"""
+        ativo = self._ativo(relativo)
+        return ativo['hash'] if ativo else relativo
+
+    def servir(self, filename):
+        """View de /static: nomes com hash recebem cache imutável e Content-Encoding"""
+        ativo = self._por_hash.get(filename)
+        if ativo is None:
+            # Nome original (ex: caminho fixo em JS) ou arquivo novo: comportamento padrão
+            return send_from_directory(self.pasta_static, filename)
+
+        caminho, codificacao = ativo['caminho'], None
+        aceitas = request.accept_encodings
+        if ativo['br'] and aceitas['br']:
+            caminho, codificacao = ativo['br'], 'br'
+        elif ativo['gzip'] and aceitas['gzip']:
+            caminho, codificacao = ativo['gzip'], 'gzip'
+
+        resp = send_file(caminho, mimetype=ativo['mimetype'], conditional=True)
+        if codificacao:
+            resp.headers['Content-Encoding'] = codificacao
+        if ativo['gzip'] or ativo['br']:
+            resp.vary.add('Accept-Encoding')
+        resp.headers['Cache-Control'] = CACHE_IMUTAVEL
+        return resp
+
+    def estatisticas(self):
+        return {
+            'arquivos': len(self._por_nome),
+            'gzip': sum(1 for a in self._por_nome.values() if a['gzip']),
+            'brotli': sum(1 for a in self._por_nome.values() if a['br']),
+        }
+
+
+def init_app(app):
+    """Constrói o manifesto e troca a view de /static pela versão com fingerprint"""
+    if os.getenv('ATIVOS_FINGERPRINT', 'True') != 'True':
+        return None
+    ativos = Ativos(
+        app.static_folder,
+        os.getenv('ATIVOS_BUILD_DIR', os.path.join(app.root_path, 'ativos_build')),
+    )
+    ativos.construir()
+    app.extensions['ativos'] = ativos
+
+    @app.url_defaults
+    def _url_static_com_hash(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = ativos.nome_publico(values['filename'])
+
+    app.view_functions['static'] = ativos.servir
+    return ativos
@@ -0,0 +1,261 @@
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from flask import g, current_app
+
+# PRAGMAs aplicados uma única vez, quando a conexão é criada
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout={busy_timeout}",
+    "PRAGMA mmap_size={mmap_size}",
+    "PRAGMA cache_size={cache_size}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+# Funções (sql, parametros, segundos) chamadas depois de cada execute/executemany/
+# executescript das conexões do pool (ver telemetria.py e analise_sql.py). O tempo
+# medido é o da chamada: no SQLite é quando a consulta roda até a primeira linha
+# (agregados inteiros).
+observadores = []
+
+
+def _notificar(sql, parametros, inicio):
+    duracao = time.perf_counter() - inicio
+    for observador in observadores:
+        observador(sql, parametros, duracao)
+
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor que cronometra cada comando e avisa os observadores"""
+
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            _notificar(sql, parametros, inicio)
+
+    def executemany(self, sql, parametros):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            _notificar(sql, None, inicio)
+
+    def executescript(self, script):
+        inicio = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            _notificar(script, None, inicio)
+
+
+class ConexaoMedida(sqlite3.Connection):
+    """Conexão cujos atalhos con.execute(...) também passam pelo CursorMedido"""
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+
+class PoolConexoes:
+    """Pool limitado de conexões SQLite (um por processo/worker)"""
+
+    def __init__(self, caminho, tamanho=8, timeout_espera=10.0, busy_timeout_ms=5000,
+                 mmap_size=256 * 1024 * 1024, cache_size_kb=16 * 1024, medir=True):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self.timeout_espera = timeout_espera
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.medir = medir
+        self._lock = threading.Lock()
+        self._resetar()
+
+    def _resetar(self):
+        """(Re)inicia o estado do pool - também usado após fork do worker"""
+        self._pid = os.getpid()
+        self._livres = queue.LifoQueue(maxsize=self.tamanho)
+        self._criadas = 0
+        self.acertos = 0
+        self.falhas = 0
+        self.esperas = 0
+        self.tempo_espera = 0.0
+        self.timeouts = 0
+
+    def _criar(self):
+        """Abre uma nova conexão já configurada"""
+        con = sqlite3.connect(
+            self.caminho,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            factory=ConexaoMedida if self.medir else sqlite3.Connection,
+        )
+        con.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            con.execute(pragma.format(
+                busy_timeout=self.busy_timeout_ms,
+                mmap_size=self.mmap_size,
+                cache_size=-self.cache_size_kb,
+            ))
+        return con
+
+    def obter(self):
+        """Retira uma conexão do pool, criando ou aguardando se necessário"""
+        if self._pid != os.getpid():
+            # Processo filho (ex: gunicorn --preload) não pode herdar conexões do pai
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._resetar()
+
+        try:
+            con = self._livres.get_nowait()
+            with self._lock:
+                self.acertos += 1
+            return con
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            pode_criar = self._criadas < self.tamanho
+            if pode_criar:
+                self._criadas += 1
+                self.falhas += 1
+
+        if pode_criar:
+            try:
+                return self._criar()
+            except Exception:
+                with self._lock:
+                    self._criadas -= 1
+                raise
+
+        # Pool esgotado: aguardar uma conexão ser devolvida
+        inicio = time.perf_counter()
+        try:
+            con = self._livres.get(timeout=self.timeout_espera)
+        except queue.Empty:
+            with self._lock:
+                self.timeouts += 1
+            raise RuntimeError(f"Pool de conexões esgotado ({self.tamanho} em uso)")
+        with self._lock:
+            self.esperas += 1
+            self.tempo_espera += time.perf_counter() - inicio
+        return con
+
+    def devolver(self, con):
+        """Devolve a conexão ao pool, descartando transações pendentes"""
+        if self._pid != os.getpid():
+            return
+        try:
+            if con.in_transaction:
+                con.rollback()
+            self._livres.put_nowait(con)
+        except (sqlite3.Error, queue.Full):
+            con.close()
+            with self._lock:
+                self._criadas -= 1
+
+    def fechar_todas(self):
+        """Fecha as conexões ociosas (usado em testes e no encerramento)"""
+        while True:
+            try:
+                con = self._livres.get_nowait()
+            except queue.Empty:
+                break
+            con.close()
+            with self._lock:
+                self._criadas -= 1
+
+    def estatisticas(self):
+        """Contadores para dimensionar o pool"""
+        with self._lock:
+            return {
+                'tamanho': self.tamanho,
+                'criadas': self._criadas,
+                'livres': self._livres.qsize(),
+                'em_uso': self._criadas - self._livres.qsize(),
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'esperas': self.esperas,
+                'tempo_espera_s': round(self.tempo_espera, 6),
+                'timeouts': self.timeouts,
+            }
+
+
+def init_app(app, caminho):
+    """Registra o pool na aplicação e a devolução automática da conexão"""
+    pool = PoolConexoes(
+        caminho,
+        tamanho=int(os.getenv('DB_POOL_TAMANHO', '8')),
+        timeout_espera=float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        busy_timeout_ms=int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000')),
+        mmap_size=int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024))),
+        cache_size_kb=int(os.getenv('DB_CACHE_SIZE_KB', str(16 * 1024))),
+        medir=os.getenv('DB_MEDIR', 'True') == 'True',
+    )
+    app.extensions['pool_db'] = pool
+    app.teardown_appcontext(_devolver_conexao)
+    return pool
+
+
+def conectar():
+    """Conexão do contexto atual (uma por requisição, reaproveitada do pool)"""
+    if 'db' not in g:
+        g.db = current_app.extensions['pool_db'].obter()
+    return g.db
+
+
+def _ocupado(erro):
+    """SQLITE_BUSY/SQLITE_LOCKED (inclusive códigos estendidos) depois do busy_timeout"""
+    codigo = getattr(erro, 'sqlite_errorcode', None)
+    if codigo is not None:
+        return codigo & 0xff in (5, 6)
+    return 'locked' in str(erro) or 'busy' in str(erro)
+
+
+def em_transacao(con, funcao, tentativas=3, espera=0.05):
+    """Executa funcao(con) entre BEGIN IMMEDIATE e um único COMMIT.
+
+    O lock de escrita é pego logo no início (sem upgrade de leitura para escrita
+    no meio da transação); se o banco continuar ocupado após o busy_timeout, a
+    transação inteira é refeita com backoff exponencial.
+    """
+    for tentativa in range(tentativas):
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            resultado = funcao(con)
+            con.commit()
+            return resultado
+        except sqlite3.OperationalError as e:
+            if con.in_transaction:
+                con.rollback()
+            if not _ocupado(e) or tentativa == tentativas - 1:
+                raise
+            pausa = espera * 2 ** tentativa * (0.5 + random.random())
+            print(f"⏳ Banco ocupado, refazendo a transação em {pausa * 1000:.0f} ms ({tentativa + 1}/{tentativas})")
+            time.sleep(pausa)
+        except BaseException:
+            if con.in_transaction:
+                con.rollback()
+            raise
+
+
+def _devolver_conexao(exc=None):
+    con = g.pop('db', None)
+    if con is not None:
+        current_app.extensions['pool_db'].devolver(con)
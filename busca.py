@@ -0,0 +1,63 @@
+import html
+import re
+
+# Busca textual no catálogo via FTS5 (tabela livros_fts, criada em migracoes.py).
+# O tokenizer usa remove_diacritics, então "acao" encontra "Ação".
+
+# Pesos do bm25 por coluna: titulo, autor, descricao
+PESOS_BM25 = (10.0, 5.0, 1.0)
+BUSCA_LIMITE_MAXIMO = 50
+
+# Marcadores neutros devolvidos pelo FTS5; viram <mark> depois do escape HTML
+_INICIO, _FIM = '\x02', '\x03'
+_TERMO = re.compile(r'\w+', re.UNICODE)
+
+
+def montar_consulta(texto):
+    """Converte o texto digitado em uma consulta FTS5 segura (todos os termos, com prefixo)"""
+    termos = _TERMO.findall(texto or '')
+    # Cada termo entre aspas (nada de operadores vindos do usuário) e com * para prefixo
+    return ' '.join(f'"{termo}"*' for termo in termos[:10])
+
+
+def _destacar(texto):
+    """Escapa o HTML do conteúdo e troca os marcadores do FTS5 por <mark>"""
+    if texto is None:
+        return None
+    return html.escape(texto).replace(_INICIO, '<mark>').replace(_FIM, '</mark>')
+
+
+def buscar(con, texto, limite=20, inicio=0):
+    """Livros que casam com o texto, ordenados por relevância (bm25)"""
+    consulta = montar_consulta(texto)
+    if not consulta:
+        return []
+    rows = con.execute(f"""
+        SELECT l.id, l.titulo, l.autor, l.preco, l.imagem,
+               highlight(livros_fts, 0, '{_INICIO}', '{_FIM}') as titulo_destaque,
+               highlight(livros_fts, 1, '{_INICIO}', '{_FIM}') as autor_destaque,
+               snippet(livros_fts, 2, '{_INICIO}', '{_FIM}', '…', 16) as trecho,
+               bm25(livros_fts, ?, ?, ?) as relevancia
+        FROM livros_fts
+        JOIN livros l ON l.id = livros_fts.rowid
+        WHERE livros_fts MATCH ?
+        ORDER BY relevancia
+        LIMIT ? OFFSET ?
+    """, (*PESOS_BM25, consulta, limite, inicio)).fetchall()
+    return [{
+        'id': row['id'],
+        'titulo': row['titulo'],
+        'autor': row['autor'],
+        'preco': row['preco'],
+        'imagem': row['imagem'],
+        'titulo_destaque': _destacar(row['titulo_destaque']),
+        'autor_destaque': _destacar(row['autor_destaque']),
+        'trecho': _destacar(row['trecho']),
+        'relevancia': round(-row['relevancia'], 6),
+    } for row in rows]
+
+
+def reindexar(con):
+    """Reconstrói o índice FTS a partir da tabela livros (não faz commit)"""
+    con.execute("INSERT INTO livros_fts(livros_fts) VALUES ('rebuild')")
+    con.execute("INSERT INTO livros_fts(livros_fts) VALUES ('optimize')")
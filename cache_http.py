@@ -0,0 +1,85 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+from functools import wraps
+from flask import current_app, g, make_response, request
+from banco import conectar
+
+# Validação condicional (ETag / Last-Modified / 304) a partir de versões de dados.
+# A tabela versoes (migracoes.py) guarda um contador por chave, incrementado por
+# triggers: 'livros', 'livro:<id>', 'carrinho:<usuario_id>', 'usuario:<id>'.
+
+
+def init_app(app):
+    """Calcula a versão do código (.py, templates e static) que entra em todo ETag"""
+    versao = os.getenv('APP_VERSAO')
+    if not versao:
+        h = hashlib.sha1()
+        for pasta in (app.root_path, os.path.join(app.root_path, app.template_folder)):
+            for nome in sorted(os.listdir(pasta)):
+                if nome.endswith(('.py', '.html')):
+                    st = os.stat(os.path.join(pasta, nome))
+                    h.update(f"{nome}:{st.st_mtime_ns}:{st.st_size};".encode())
+        # As páginas embutem as URLs com hash dos arquivos estáticos
+        for diretorio, _, arquivos in sorted(os.walk(app.static_folder)):
+            for nome in sorted(arquivos):
+                st = os.stat(os.path.join(diretorio, nome))
+                h.update(f"{diretorio}/{nome}:{st.st_mtime_ns}:{st.st_size};".encode())
+        versao = h.hexdigest()[:8]
+    app.config['VERSAO_CODIGO'] = versao
+
+
+def versoes(con, chaves):
+    """{chave: (versao, atualizado_em)} - chaves nunca alteradas ficam com versão 0"""
+    marcadores = ', '.join('?' * len(chaves))
+    rows = con.execute(f"SELECT chave, versao, atualizado_em FROM versoes WHERE chave IN ({marcadores})",
+                       tuple(chaves)).fetchall()
+    encontradas = {row['chave']: (row['versao'], row['atualizado_em']) for row in rows}
+    return {chave: encontradas.get(chave, (0, None)) for chave in chaves}
+
+
+def _ultima_modificacao(valores):
+    datas = [atualizado for _, atualizado in valores if atualizado]
+    if not datas:
+        return None
+    return datetime.strptime(max(datas), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+
+def condicional(chaves, cache_control):
+    """Decorator: responde 304 antes de rodar a view quando as versões não mudaram.
+
+    chaves recebe os mesmos argumentos da rota e devolve as chaves de versão
+    das quais a resposta depende.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            lista = chaves(**kwargs)
+            valores = versoes(conectar(), lista)
+            assinatura = ';'.join(f"{chave}={valores[chave][0]}" for chave in lista)
+            etag = hashlib.sha1(
+                f"{request.endpoint}|{request.query_string.decode()}|{current_app.config['VERSAO_CODIGO']}|{assinatura}".encode()
+            ).hexdigest()[:16]
+            ultima = _ultima_modificacao(valores.values())
+
+            if request.if_none_match:
+                nao_modificado = request.if_none_match.contains_weak(etag)
+            else:
+                nao_modificado = bool(ultima and request.if_modified_since
+                                      and ultima <= request.if_modified_since)
+
+            if nao_modificado:
+                resp = make_response('', 304)
+            else:
+                g.etag = etag  # usado como chave de validade pelo cache_paginas
+                resp = make_response(f(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+
+            resp.set_etag(etag, weak=True)
+            if ultima:
+                resp.last_modified = ultima
+            resp.headers['Cache-Control'] = cache_control
+            return resp
+        return decorated_function
+    return decorator
@@ -0,0 +1,127 @@
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, make_response, request
+
+# Cache em memória (LRU, limitado em bytes) do HTML já renderizado das páginas
+# públicas do catálogo. Cada entrada guarda o ETag calculado por
+# cache_http.condicional: quando livros muda, o ETag muda e a entrada é descartada.
+
+
+class CachePaginas:
+    """LRU de páginas renderizadas (bytes + variante gzip opcional)"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, comprimir=True):
+        self.max_bytes = max_bytes
+        self.comprimir = comprimir
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+        self.invalidacoes = 0
+
+    @staticmethod
+    def _tamanho(entrada):
+        return len(entrada['corpo']) + len(entrada['gzip'] or b'')
+
+    def obter(self, chave, etag):
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self.falhas += 1
+                return None
+            if entrada['etag'] != etag:
+                # Dados mudaram desde a renderização
+                del self._entradas[chave]
+                self.bytes -= self._tamanho(entrada)
+                self.invalidacoes += 1
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            return entrada
+
+    def guardar(self, chave, etag, corpo, mimetype):
+        """Guarda a página e devolve a entrada (None se não couber no limite)"""
+        entrada = {
+            'etag': etag,
+            'corpo': corpo,
+            'gzip': gzip.compress(corpo, compresslevel=6) if self.comprimir else None,
+            'mimetype': mimetype,
+        }
+        tamanho = self._tamanho(entrada)
+        if tamanho > self.max_bytes:
+            return None
+        with self._lock:
+            antiga = self._entradas.pop(chave, None)
+            if antiga is not None:
+                self.bytes -= self._tamanho(antiga)
+            self._entradas[chave] = entrada
+            self.bytes += tamanho
+            while self.bytes > self.max_bytes:
+                _, removida = self._entradas.popitem(last=False)
+                self.bytes -= self._tamanho(removida)
+                self.remocoes += 1
+        return entrada
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+            self.bytes = 0
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'entradas': len(self._entradas),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'remocoes': self.remocoes,
+                'invalidacoes': self.invalidacoes,
+            }
+
+
+def init_app(app):
+    cache = CachePaginas(
+        max_bytes=int(os.getenv('PAGINAS_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+        comprimir=os.getenv('PAGINAS_CACHE_GZIP', 'True') == 'True',
+    )
+    app.extensions['cache_paginas'] = cache
+    return cache
+
+
+def _resposta(entrada):
+    aceita_gzip = entrada['gzip'] is not None and 'gzip' in request.headers.get('Accept-Encoding', '')
+    resp = make_response(entrada['gzip'] if aceita_gzip else entrada['corpo'])
+    resp.mimetype = entrada['mimetype']
+    if aceita_gzip:
+        resp.headers['Content-Encoding'] = 'gzip'
+    resp.vary.add('Accept-Encoding')
+    return resp
+
+
+def em_cache(f):
+    """Decorator (abaixo de cache_http.condicional): serve o HTML renderizado da memória"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        cache = current_app.extensions['cache_paginas']
+        etag = g.get('etag')
+        if etag is None:
+            return f(*args, **kwargs)
+
+        chave = (request.endpoint, tuple(sorted(kwargs.items())), request.query_string)
+        entrada = cache.obter(chave, etag)
+        if entrada is None:
+            resp = make_response(f(*args, **kwargs))
+            if resp.status_code != 200 or resp.is_streamed:
+                return resp
+            entrada = cache.guardar(chave, etag, resp.get_data(), resp.mimetype)
+            if entrada is None:
+                return resp
+        return _resposta(entrada)
+    return decorated_function
@@ -0,0 +1,229 @@
+import hashlib
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+import requests
+from banco import conectar
+
+# Cache em disco dos PDFs remotos (archive.org etc.). O arquivo é guardado pelo
+# hash do conteúdo (pdfs_cache/<sha256>.pdf) e a tabela cache_pdfs (migração 007)
+# liga cada URL ao hash, com ETag/Last-Modified para revalidar e o último acesso
+# para remover os menos usados quando o total passa de max_bytes.
+# Dentro de revalidar_apos segundos o PDF sai do disco sem nenhum acesso à rede.
+# A remoção por LRU poupa os PDFs acessados nos últimos protecao segundos: o
+# caminho devolvido por obter() ainda vai ser aberto (anexo, send_file, proxy).
+
+ASSINATURA_PDF = b'%PDF-'
+BLOCO = 64 * 1024
+
+
+class PdfIndisponivel(Exception):
+    """PDF não pôde ser baixado e não há cópia em cache"""
+
+
+def _agora(segundos_atras=0):
+    return (datetime.now(timezone.utc) - timedelta(seconds=segundos_atras)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class CachePdfs:
+    """PDFs endereçados por conteúdo com orçamento de bytes (LRU)"""
+
+    def __init__(self, pasta, http, max_bytes=2 * 1024 ** 3, revalidar_apos=7 * 86400, protecao=300):
+        self.pasta = pasta
+        self.http = http  # http_remoto.ClienteHttp
+        self.max_bytes = max_bytes
+        self.revalidar_apos = revalidar_apos
+        self.protecao = protecao
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._contadores_lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.revalidacoes = 0
+        self.nao_modificados = 0
+        self.remocoes = 0
+        self.bytes_baixados = 0
+        self.bytes_economizados = 0
+        os.makedirs(pasta, exist_ok=True)
+
+    def _lock(self, url):
+        with self._locks_guard:
+            return self._locks.setdefault(url, threading.Lock())
+
+    def _contar(self, **incrementos):
+        with self._contadores_lock:
+            for nome, valor in incrementos.items():
+                setattr(self, nome, getattr(self, nome) + valor)
+
+    def _caminho(self, sha256):
+        return os.path.join(self.pasta, f"{sha256}.pdf")
+
+    def obter(self, url):
+        """Caminho local do PDF da URL, baixando ou revalidando quando preciso"""
+        con = conectar()
+        with self._lock(url):
+            entrada = con.execute("SELECT * FROM cache_pdfs WHERE url=?", (url,)).fetchone()
+            if entrada and not os.path.exists(self._caminho(entrada['sha256'])):
+                entrada = None  # arquivo apagado fora do cache
+
+            if entrada:
+                idade = con.execute("SELECT (julianday('now') - julianday(?)) * 86400",
+                                    (entrada['validado_em'],)).fetchone()[0]
+                if idade < self.revalidar_apos:
+                    return self._acerto(con, entrada)
+                return self._revalidar(con, url, entrada)
+
+            self._contar(falhas=1)
+            return self._baixar(con, url)
+
+    def _acerto(self, con, entrada, revalidado=False):
+        agora = _agora()
+        con.execute("""
+            UPDATE cache_pdfs SET ultimo_acesso=?, acessos=acessos + 1,
+                validado_em=CASE WHEN ? THEN ? ELSE validado_em END
+            WHERE url=?
+        """, (agora, revalidado, agora, entrada['url']))
+        con.commit()
+        self._contar(acertos=1, bytes_economizados=entrada['bytes'])
+        return self._caminho(entrada['sha256'])
+
+    def _revalidar(self, con, url, entrada):
+        """GET condicional: 304 mantém a cópia; 200 troca pelo conteúdo novo"""
+        self._contar(revalidacoes=1)
+        cabecalhos = {}
+        if entrada['etag']:
+            cabecalhos['If-None-Match'] = entrada['etag']
+        if entrada['last_modified']:
+            cabecalhos['If-Modified-Since'] = entrada['last_modified']
+        try:
+            return self._baixar(con, url, cabecalhos, entrada)
+        except PdfIndisponivel as e:
+            # Origem fora do ar: a cópia antiga continua válida para entregar
+            print(f"⚠️  Revalidação falhou, usando PDF em cache: {e}")
+            return self._acerto(con, entrada)
+
+    def _baixar(self, con, url, cabecalhos=None, entrada=None):
+        try:
+            with self.http.abrir(url, headers=cabecalhos) as resp:
+                if resp.status_code == 304 and entrada:
+                    self._contar(nao_modificados=1)
+                    return self._acerto(con, entrada, revalidado=True)
+                if resp.status_code in (401, 403):
+                    raise PdfIndisponivel(f"Acesso negado ({resp.status_code}) ao baixar o PDF")
+                if resp.status_code != 200:
+                    raise PdfIndisponivel(f"Erro HTTP {resp.status_code} ao baixar o PDF")
+                sha256, tamanho = self._gravar(resp)
+                etag, last_modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+        except requests.exceptions.Timeout:
+            raise PdfIndisponivel("Timeout ao baixar PDF")
+        except requests.exceptions.RequestException as e:
+            raise PdfIndisponivel(f"Erro ao baixar PDF: {e}")
+
+        self._contar(bytes_baixados=tamanho)
+        agora = _agora()
+        con.execute("""
+            INSERT INTO cache_pdfs (url, sha256, bytes, etag, last_modified,
+                                    baixado_em, validado_em, ultimo_acesso, acessos)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT(url) DO UPDATE SET
+                sha256=excluded.sha256, bytes=excluded.bytes, etag=excluded.etag,
+                last_modified=excluded.last_modified, baixado_em=excluded.baixado_em,
+                validado_em=excluded.validado_em, ultimo_acesso=excluded.ultimo_acesso,
+                acessos=acessos + 1
+        """, (url, sha256, tamanho, etag, last_modified, agora, agora, agora))
+        if entrada and entrada['sha256'] != sha256:
+            self._apagar_se_orfao(con, entrada['sha256'])
+        con.commit()
+        print(f"✅ PDF baixado para o cache: {tamanho:,} bytes ({tamanho/1024/1024:.2f} MB)")
+        self._remover_excedente(con, manter=url)
+        return self._caminho(sha256)
+
+    def _gravar(self, resp):
+        """Grava o corpo em arquivo temporário, confere %PDF e renomeia para o hash"""
+        temporario = os.path.join(self.pasta, f".{os.getpid()}.{threading.get_ident()}.tmp")
+        h = hashlib.sha256()
+        tamanho = 0
+        try:
+            with open(temporario, 'wb') as f:
+                for bloco in resp.iter_content(chunk_size=BLOCO):
+                    if not bloco:
+                        continue
+                    if tamanho == 0 and ASSINATURA_PDF not in bloco[:1024]:
+                        raise PdfIndisponivel(
+                            f"Resposta não é PDF ({resp.headers.get('Content-Type', 'sem Content-Type')})")
+                    f.write(bloco)
+                    h.update(bloco)
+                    tamanho += len(bloco)
+            if tamanho == 0:
+                raise PdfIndisponivel("PDF vazio")
+            sha256 = h.hexdigest()
+            os.replace(temporario, self._caminho(sha256))
+            return sha256, tamanho
+        except requests.exceptions.RequestException as e:
+            raise PdfIndisponivel(f"Download interrompido: {e}")
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+    def _apagar_se_orfao(self, con, sha256):
+        """O mesmo conteúdo pode servir a várias URLs: só apaga sem referências"""
+        if not con.execute("SELECT 1 FROM cache_pdfs WHERE sha256=? LIMIT 1", (sha256,)).fetchone():
+            try:
+                os.remove(self._caminho(sha256))
+            except OSError:
+                pass  # já apagado, ou aberto por outro processo (Windows)
+
+    def _remover_excedente(self, con, manter=None):
+        """Remove os PDFs menos usados até o total caber em max_bytes (exceto os
+        acessados há menos de protecao segundos, que podem estar em uso)"""
+        total = con.execute("""
+            SELECT COALESCE(SUM(bytes), 0) FROM (SELECT DISTINCT sha256, bytes FROM cache_pdfs)
+        """).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for entrada in con.execute("""
+            SELECT url, sha256, bytes FROM cache_pdfs
+            WHERE url != ? AND ultimo_acesso < ?
+            ORDER BY ultimo_acesso
+        """, (manter or '', _agora(self.protecao))).fetchall():
+            con.execute("DELETE FROM cache_pdfs WHERE url=?", (entrada['url'],))
+            if not con.execute("SELECT 1 FROM cache_pdfs WHERE sha256=? LIMIT 1", (entrada['sha256'],)).fetchone():
+                total -= entrada['bytes']
+                self._apagar_se_orfao(con, entrada['sha256'])
+            self._contar(remocoes=1)
+            if total <= self.max_bytes:
+                break
+        con.commit()
+
+    def estatisticas(self):
+        con = conectar()
+        uso = con.execute("""
+            SELECT COUNT(*) AS urls, COUNT(DISTINCT sha256) AS arquivos,
+                   COALESCE((SELECT SUM(bytes) FROM (SELECT DISTINCT sha256, bytes FROM cache_pdfs)), 0) AS bytes
+            FROM cache_pdfs
+        """).fetchone()
+        return {
+            'urls': uso['urls'],
+            'arquivos': uso['arquivos'],
+            'bytes': uso['bytes'],
+            'max_bytes': self.max_bytes,
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'revalidacoes': self.revalidacoes,
+            'nao_modificados': self.nao_modificados,
+            'remocoes': self.remocoes,
+            'bytes_baixados': self.bytes_baixados,
+            'bytes_economizados': self.bytes_economizados,
+        }
+
+
+def init_app(app, http):
+    cache = CachePdfs(
+        os.getenv('PDF_CACHE_DIR', os.path.join(app.root_path, 'pdfs_cache')),
+        http,
+        max_bytes=int(os.getenv('PDF_CACHE_MAX_BYTES', str(2 * 1024 ** 3))),
+        revalidar_apos=int(os.getenv('PDF_CACHE_REVALIDAR', str(7 * 86400))),
+        protecao=int(os.getenv('PDF_CACHE_PROTECAO', '300')),
+    )
+    app.extensions['cache_pdfs'] = cache
+    return cache
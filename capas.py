@@ -0,0 +1,209 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from io import BytesIO
+import requests
+from flask import url_for
+from PIL import Image
+
+# Capas otimizadas: a imagem original (arquivo em static/images ou URL externa)
+# é espelhada uma vez em disco, endereçada pelo hash do conteúdo, e dela saem
+# miniaturas em WebP e JPEG nas larguras abaixo. As URLs incluem a chave da
+# origem, então trocar livros.imagem gera URLs novas (cache imutável no cliente).
+
+LARGURAS = (120, 240, 480)
+FORMATOS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 6}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+CAPA_MAX_BYTES = 15 * 1024 * 1024
+ESPERA_APOS_FALHA = 600  # segundos sem tentar de novo uma origem que falhou
+MAX_FALHAS_GUARDADAS = 1024
+ACEITA_IMAGEM = {'Accept': 'image/avif,image/webp,image/*,*/*;q=0.8'}
+
+
+class CapaIndisponivel(Exception):
+    """Origem da capa não pôde ser obtida ou não é uma imagem válida"""
+
+
+def chave_origem(origem):
+    return hashlib.sha1(origem.encode('utf-8')).hexdigest()[:12]
+
+
+class Capas:
+    """Espelhamento das capas e geração das variantes redimensionadas"""
+
+    def __init__(self, pasta_cache, pasta_imagens, http, timeout=15):
+        self.pasta_cache = pasta_cache
+        self.pasta_imagens = pasta_imagens
+        self.http = http  # http_remoto.ClienteHttp
+        self.timeout = timeout
+        self._locks = {}  # chave -> [lock, threads usando]; sai quando ninguém usa
+        self._locks_guard = threading.Lock()
+        self._falhas_recentes = OrderedDict()  # chave -> instante, da mais antiga à mais nova
+        self.espelhadas = 0
+        self.geradas = 0
+        self.falhas = 0
+        for sub in ('originais', 'origens', 'variantes'):
+            os.makedirs(os.path.join(pasta_cache, sub), exist_ok=True)
+
+    @contextmanager
+    def _exclusivo(self, chave):
+        """Lock por chave, removido do dicionário quando a última thread sai"""
+        with self._locks_guard:
+            entrada = self._locks.setdefault(chave, [threading.Lock(), 0])
+            entrada[1] += 1
+        try:
+            with entrada[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entrada[1] -= 1
+                if not entrada[1]:
+                    del self._locks[chave]
+
+    def _falhou_recentemente(self, chave):
+        falhou_em = self._falhas_recentes.get(chave)
+        return falhou_em is not None and time.monotonic() - falhou_em < ESPERA_APOS_FALHA
+
+    def _registrar_falha(self, chave):
+        """Guarda a falha; as vencidas e as que passam do limite saem pela frente"""
+        agora = time.monotonic()
+        with self._locks_guard:
+            self._falhas_recentes[chave] = agora
+            self._falhas_recentes.move_to_end(chave)
+            while self._falhas_recentes:
+                chave_antiga, instante = next(iter(self._falhas_recentes.items()))
+                if agora - instante < ESPERA_APOS_FALHA and len(self._falhas_recentes) <= MAX_FALHAS_GUARDADAS:
+                    break
+                del self._falhas_recentes[chave_antiga]
+
+    def _limpar_falha(self, chave):
+        with self._locks_guard:
+            self._falhas_recentes.pop(chave, None)
+
+    @staticmethod
+    def _gravar(destino, conteudo):
+        """Escrita atômica (arquivo temporário + rename)"""
+        temporario = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, 'wb') as f:
+            f.write(conteudo)
+        os.replace(temporario, destino)
+
+    def _baixar(self, origem):
+        if origem.startswith('http'):
+            # Mesmo cliente dos PDFs: keep-alive, retry e disjuntor de 403 por host
+            try:
+                with self.http.abrir(origem, headers=ACEITA_IMAGEM, timeout=self.timeout) as resp:
+                    resp.raise_for_status()
+                    partes, total = [], 0
+                    for parte in resp.iter_content(chunk_size=65536):
+                        total += len(parte)
+                        if total > CAPA_MAX_BYTES:
+                            raise CapaIndisponivel(f"Capa maior que {CAPA_MAX_BYTES} bytes")
+                        partes.append(parte)
+                    return b''.join(partes)
+            except requests.RequestException as e:
+                raise CapaIndisponivel(str(e))
+        caminho = os.path.join(self.pasta_imagens, os.path.basename(origem))
+        if not os.path.isfile(caminho):
+            raise CapaIndisponivel(f"Arquivo não encontrado: {caminho}")
+        with open(caminho, 'rb') as f:
+            return f.read()
+
+    def original(self, origem):
+        """Hash do conteúdo original, espelhando a origem na primeira vez"""
+        chave = chave_origem(origem)
+        ponteiro = os.path.join(self.pasta_cache, 'origens', chave)
+        if os.path.exists(ponteiro):
+            with open(ponteiro) as f:
+                return f.read().strip()
+
+        if self._falhou_recentemente(chave):
+            raise CapaIndisponivel("Origem falhou recentemente")
+
+        with self._exclusivo(chave):
+            if os.path.exists(ponteiro):
+                with open(ponteiro) as f:
+                    return f.read().strip()
+            try:
+                conteudo = self._baixar(origem)
+                try:
+                    Image.open(BytesIO(conteudo)).verify()
+                except Exception:
+                    raise CapaIndisponivel("Conteúdo não é uma imagem válida")
+            except CapaIndisponivel:
+                self._registrar_falha(chave)
+                raise
+            self._limpar_falha(chave)
+            digest = hashlib.sha256(conteudo).hexdigest()
+            destino = os.path.join(self.pasta_cache, 'originais', digest)
+            if not os.path.exists(destino):
+                self._gravar(destino, conteudo)
+            self._gravar(ponteiro, digest.encode())
+            self.espelhadas += 1
+            return digest
+
+    def variante(self, origem, largura, formato):
+        """Caminho da miniatura (gerada na primeira vez)"""
+        if largura not in LARGURAS or formato not in FORMATOS:
+            raise ValueError("Largura ou formato não suportado")
+        try:
+            digest = self.original(origem)
+        except CapaIndisponivel:
+            self.falhas += 1
+            raise
+        destino = os.path.join(self.pasta_cache, 'variantes', f"{digest}-{largura}.{formato}")
+        if os.path.exists(destino):
+            return destino
+
+        with self._exclusivo(destino):
+            if os.path.exists(destino):
+                return destino
+            formato_pil, _, opcoes = FORMATOS[formato]
+            with Image.open(os.path.join(self.pasta_cache, 'originais', digest)) as img:
+                img = img.convert('RGBA' if formato == 'webp' and img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+                if img.width > largura:
+                    img = img.resize((largura, max(1, round(img.height * largura / img.width))),
+                                     Image.LANCZOS)
+                buf = BytesIO()
+                img.save(buf, format=formato_pil, **opcoes)
+            self._gravar(destino, buf.getvalue())
+            self.geradas += 1
+            return destino
+
+    def urls(self, livro):
+        """URLs prontas para <picture>/srcset (None se o livro não tem imagem)"""
+        origem = livro['imagem'] if livro else None
+        if not origem:
+            return None
+        chave = chave_origem(origem)
+
+        def url(largura, formato):
+            return url_for('capa_variante', livro_id=livro['id'], chave=chave,
+                           largura=largura, formato=formato)
+
+        return {
+            'src': url(LARGURAS[1], 'jpg'),
+            'src_grande': url(LARGURAS[-1], 'jpg'),
+            'srcset': ', '.join(f"{url(l, 'jpg')} {l}w" for l in LARGURAS),
+            'srcset_webp': ', '.join(f"{url(l, 'webp')} {l}w" for l in LARGURAS),
+        }
+
+    def estatisticas(self):
+        return {'espelhadas': self.espelhadas, 'geradas': self.geradas, 'falhas': self.falhas}
+
+
+def init_app(app, http):
+    capas = Capas(
+        os.getenv('CAPAS_CACHE_DIR', os.path.join(app.root_path, 'capas_cache')),
+        os.path.join(app.static_folder, 'images'),
+        http,
+        timeout=float(os.getenv('CAPAS_TIMEOUT', '15')),
+    )
+    app.extensions['capas'] = capas
+    app.jinja_env.globals['capa'] = capas.urls
+    return capas
@@ -0,0 +1,279 @@
+import os
+import random
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+from banco import conectar
+
+# Fila persistente (tabela entregas, migração 006) para o envio dos e-books.
+# As rotas só enfileiram; trabalhadores em threads pegam o próximo job de forma
+# atômica (UPDATE ... RETURNING), executam a tarefa registrada e, em caso de
+# falha, reagendam com backoff exponencial e jitter até o limite de tentativas.
+# Enquanto a tarefa roda, o lease é renovado (renovado_em) a cada lease/3; só
+# volta à fila o job cujo processo parou de renovar.
+#
+# Estados: PENDENTE -> PROCESSANDO -> CONCLUIDA
+#                                  -> PENDENTE (nova tentativa) / FALHOU (desistiu)
+
+PENDENTE = 'PENDENTE'
+PROCESSANDO = 'PROCESSANDO'
+CONCLUIDA = 'CONCLUIDA'
+FALHOU = 'FALHOU'
+
+
+class FalhaEntrega(Exception):
+    """Falha ao entregar; definitiva=True não gasta as tentativas restantes"""
+
+    def __init__(self, mensagem, definitiva=False):
+        super().__init__(mensagem)
+        self.definitiva = definitiva
+
+
+class FilaEntregas:
+    """Trabalhadores que consomem a tabela entregas"""
+
+    def __init__(self, app, tarefa=None, trabalhadores=2, max_tentativas=5,
+                 backoff_base=30.0, backoff_max=3600.0, intervalo=2.0, lease=900):
+        self.app = app
+        self.tarefa = tarefa
+        self.trabalhadores = trabalhadores
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.intervalo = intervalo
+        self.lease = lease
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self.concluidas = 0
+        self.falhas = 0
+        self.reagendadas = 0
+
+    # --- produtor ---
+
+    def enfileirar(self, con, pedido_id):
+        """Cria o job do pedido (ou devolve o que já está ativo) -> (id, criado).
+
+        Não faz commit: a rota decide quando confirmar junto com o resto.
+        """
+        ativo = con.execute("""
+            SELECT id FROM entregas
+            WHERE pedido_id=? AND estado IN (?, ?)
+        """, (pedido_id, PENDENTE, PROCESSANDO)).fetchone()
+        if ativo:
+            return ativo['id'], False
+        cur = con.execute("""
+            INSERT INTO entregas (pedido_id, max_tentativas)
+            VALUES (?, ?)
+        """, (pedido_id, self.max_tentativas))
+        return cur.lastrowid, True
+
+    def registrar_falha(self, con, pedido_id, erro):
+        """Grava como FALHOU uma entrega feita fora da fila (aprovação em lote),
+        para aparecer nas estatísticas e poder ser refeita. Não faz commit."""
+        cur = con.execute("""
+            INSERT INTO entregas (pedido_id, estado, tentativas, max_tentativas, ultimo_erro,
+                                  trabalhador, iniciado_em, concluido_em)
+            VALUES (?, ?, 1, ?, ?, 'lote', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        """, (pedido_id, FALHOU, self.max_tentativas, erro))
+        self.falhas += 1
+        return cur.lastrowid
+
+    @staticmethod
+    def cancelar(con, pedido_id, motivo):
+        """Marca como FALHOU as entregas PENDENTE do pedido -> quantas. Não faz commit."""
+        return con.execute("""
+            UPDATE entregas SET estado=?, ultimo_erro=?,
+                concluido_em=CURRENT_TIMESTAMP, atualizado_em=CURRENT_TIMESTAMP
+            WHERE pedido_id=? AND estado=?
+        """, (FALHOU, motivo, pedido_id, PENDENTE)).rowcount
+
+    def avisar(self):
+        """Acorda um trabalhador (chamar depois do commit do enfileiramento)"""
+        self.iniciar()
+        self._acordar.set()
+
+    # --- consulta ---
+
+    @staticmethod
+    def obter(con, entrega_id):
+        row = con.execute("SELECT * FROM entregas WHERE id=?", (entrega_id,)).fetchone()
+        return dict(row) if row else None
+
+    def estatisticas(self, con):
+        por_estado = {row['estado']: row['total'] for row in con.execute(
+            "SELECT estado, COUNT(*) AS total FROM entregas GROUP BY estado")}
+        return {
+            'trabalhadores': sum(1 for t in self._threads if t.is_alive()),
+            'por_estado': por_estado,
+            'concluidas': self.concluidas,
+            'falhas': self.falhas,
+            'reagendadas': self.reagendadas,
+        }
+
+    # --- trabalhadores ---
+
+    def iniciar(self):
+        """Sobe as threads (uma vez por processo; refaz após fork)"""
+        with self._lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._pid = os.getpid()
+            self._parar.clear()
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for n in range(len(self._threads), self.trabalhadores):
+                t = threading.Thread(target=self._laco, name=f"entregas-{n + 1}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def parar(self, espera=5.0):
+        self._parar.set()
+        self._acordar.set()
+        for t in self._threads:
+            t.join(espera)
+
+    def rodar(self):
+        """Bloqueia rodando os trabalhadores até Ctrl+C (processo dedicado)"""
+        self.iniciar()
+        try:
+            while not self._parar.wait(60):
+                pass
+        except KeyboardInterrupt:
+            self.parar()
+
+    def _laco(self):
+        nome = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+        while not self._parar.is_set():
+            try:
+                processou = self.processar_proxima(nome)
+            except Exception:
+                traceback.print_exc()
+                processou = False
+            if not processou:
+                self._acordar.wait(self.intervalo)
+                self._acordar.clear()
+
+    def _backoff(self, tentativa):
+        """Exponencial com jitter: metade fixa + metade aleatória"""
+        atraso = min(self.backoff_max, self.backoff_base * 2 ** (tentativa - 1))
+        return atraso / 2 + random.uniform(0, atraso / 2)
+
+    def _reivindicar(self, con, trabalhador):
+        """Pega o próximo job vencido numa única instrução (atômica no SQLite)"""
+        # Jobs sem renovação além do lease (processo morreu) voltam à fila
+        con.execute("""
+            UPDATE entregas SET estado=?, atualizado_em=CURRENT_TIMESTAMP
+            WHERE estado=? AND COALESCE(renovado_em, iniciado_em) < datetime('now', ?)
+        """, (PENDENTE, PROCESSANDO, f"-{int(self.lease)} seconds"))
+        job = con.execute("""
+            UPDATE entregas
+            SET estado=?, tentativas=tentativas + 1, trabalhador=?,
+                iniciado_em=CURRENT_TIMESTAMP, renovado_em=CURRENT_TIMESTAMP,
+                atualizado_em=CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM entregas
+                WHERE estado=? AND proxima_execucao <= CURRENT_TIMESTAMP
+                ORDER BY proxima_execucao, id
+                LIMIT 1
+            )
+            RETURNING id, pedido_id, tentativas, max_tentativas
+        """, (PROCESSANDO, trabalhador, PENDENTE)).fetchone()
+        con.commit()
+        return job
+
+    @contextmanager
+    def _renovando(self, job):
+        """Renova o lease do job em outra thread enquanto o bloco roda"""
+        parar = threading.Event()
+
+        def renovar():
+            while not parar.wait(max(self.lease / 3, 1)):
+                try:
+                    with self.app.app_context():
+                        con = conectar()
+                        con.execute("""
+                            UPDATE entregas SET renovado_em=CURRENT_TIMESTAMP
+                            WHERE id=? AND estado=? AND tentativas=?
+                        """, (job['id'], PROCESSANDO, job['tentativas']))
+                        con.commit()
+                except Exception:
+                    traceback.print_exc()
+
+        thread = threading.Thread(target=renovar, name=f"lease-{job['id']}", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            parar.set()
+            thread.join()
+
+    def processar_proxima(self, trabalhador='manual'):
+        """Executa um job pendente; False se a fila está vazia"""
+        with self.app.app_context():
+            con = conectar()
+            job = self._reivindicar(con, trabalhador)
+            if job is None:
+                return False
+
+            print(f"📬 Entrega #{job['id']} (pedido #{job['pedido_id']}) - "
+                  f"tentativa {job['tentativas']}/{job['max_tentativas']}")
+            # (id, tentativas) identifica esta reivindicação: se o job foi
+            # retomado por outro trabalhador, o resultado daqui não sobrescreve o dele
+            dono = (job['id'], PROCESSANDO, job['tentativas'])
+            try:
+                with self._renovando(job):
+                    self.tarefa(job['pedido_id'])
+            except Exception as e:
+                definitiva = isinstance(e, FalhaEntrega) and e.definitiva
+                erro = str(e) or e.__class__.__name__
+                if definitiva or job['tentativas'] >= job['max_tentativas']:
+                    con.execute("""
+                        UPDATE entregas SET estado=?, ultimo_erro=?,
+                            concluido_em=CURRENT_TIMESTAMP, atualizado_em=CURRENT_TIMESTAMP
+                        WHERE id=? AND estado=? AND tentativas=?
+                    """, (FALHOU, erro, *dono))
+                    self.falhas += 1
+                    print(f"❌ Entrega #{job['id']} falhou definitivamente: {erro}")
+                else:
+                    atraso = self._backoff(job['tentativas'])
+                    con.execute("""
+                        UPDATE entregas SET estado=?, ultimo_erro=?,
+                            proxima_execucao=datetime('now', ?), atualizado_em=CURRENT_TIMESTAMP
+                        WHERE id=? AND estado=? AND tentativas=?
+                    """, (PENDENTE, erro, f"+{int(atraso)} seconds", *dono))
+                    self.reagendadas += 1
+                    print(f"🔁 Entrega #{job['id']} reagendada em {int(atraso)}s: {erro}")
+            else:
+                con.execute("""
+                    UPDATE entregas SET estado=?, ultimo_erro=NULL,
+                        concluido_em=CURRENT_TIMESTAMP, atualizado_em=CURRENT_TIMESTAMP
+                    WHERE id=? AND estado=? AND tentativas=?
+                """, (CONCLUIDA, *dono))
+                self.concluidas += 1
+            con.commit()
+            return True
+
+
+def init_app(app, tarefa=None):
+    """Cria a fila; as threads sobem na primeira requisição (não em comandos CLI)"""
+    fila = FilaEntregas(
+        app,
+        tarefa=tarefa,
+        trabalhadores=int(os.getenv('ENTREGAS_TRABALHADORES', '2')),
+        max_tentativas=int(os.getenv('ENTREGAS_MAX_TENTATIVAS', '5')),
+        backoff_base=float(os.getenv('ENTREGAS_BACKOFF_BASE', '30')),
+        backoff_max=float(os.getenv('ENTREGAS_BACKOFF_MAX', '3600')),
+        intervalo=float(os.getenv('ENTREGAS_INTERVALO', '2')),
+        lease=int(os.getenv('ENTREGAS_LEASE', '900')),
+    )
+    app.extensions['entregas'] = fila
+
+    if os.getenv('ENTREGAS_AUTOINICIAR', 'True') == 'True':
+        @app.before_request
+        def _iniciar_trabalhadores():
+            fila.iniciar()
+
+    return fila
@@ -0,0 +1,112 @@
+import base64
+import os
+import smtplib
+from email import policy
+from email.message import EmailMessage, MIMEPart
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+
+# E-mail com anexo grande sem carregar o arquivo na memória: a mensagem MIME é
+# gerada em pedaços (o PDF é lido do disco e codificado em base64 bloco a bloco)
+# e cada pedaço vai direto para o socket SMTP depois do comando DATA.
+# Pico de memória por envio ~ BLOCO_ANEXO, independente do tamanho do PDF.
+
+# 57 bytes viram exatamente uma linha base64 de 76 caracteres; blocos múltiplos
+# de 57 geram linhas completas sem precisar guardar sobras entre blocos
+BLOCO_ANEXO = 57 * 1024
+
+
+def _so_cabecalhos(msg):
+    """Cabeçalhos dobrados + linha em branco (as_bytes() geraria também o corpo)"""
+    return b''.join(msg.policy.fold_binary(nome, valor) for nome, valor in msg.items()) + b"\r\n"
+
+
+def _cabecalhos(remetente, destinatarios, assunto, fronteira):
+    msg = EmailMessage(policy=policy.SMTP)
+    msg['Subject'] = assunto
+    msg['From'] = remetente
+    msg['To'] = ', '.join(destinatarios)
+    msg['Date'] = formatdate(localtime=True)
+    msg['Message-ID'] = make_msgid()
+    msg['MIME-Version'] = '1.0'
+    msg['Content-Type'] = f'multipart/mixed; boundary="{fronteira}"'
+    return _so_cabecalhos(msg)
+
+
+def _cabecalhos_anexo(nome_arquivo, mimetype):
+    parte = MIMEPart(policy=policy.SMTP)
+    parte['Content-Type'] = mimetype
+    parte.add_header('Content-Disposition', 'attachment', filename=nome_arquivo)
+    parte['Content-Transfer-Encoding'] = 'base64'
+    return _so_cabecalhos(parte)
+
+
+def mensagem_com_anexo(remetente, destinatarios, assunto, corpo, caminho_anexo,
+                       nome_arquivo, mimetype='application/pdf'):
+    """Gera a mensagem completa (bytes com CRLF) em pedaços, lendo o anexo do disco"""
+    fronteira = f"=_anexo_{make_msgid().strip('<>').split('@')[0]}"
+    delimitador = f"--{fronteira}\r\n".encode()
+
+    yield _cabecalhos(remetente, destinatarios, assunto, fronteira)
+    yield delimitador
+    # Texto em base64 (utf-8): nenhuma linha começa com "." e não precisa de dot-stuffing
+    yield MIMEText(corpo, 'plain', 'utf-8').as_bytes(policy=policy.SMTP)
+    yield b"\r\n" + delimitador
+    yield _cabecalhos_anexo(nome_arquivo, mimetype)
+    with open(caminho_anexo, 'rb') as f:
+        while True:
+            bloco = f.read(BLOCO_ANEXO)
+            if not bloco:
+                break
+            yield base64.encodebytes(bloco).replace(b"\n", b"\r\n")
+    yield f"\r\n--{fronteira}--\r\n".encode()
+
+
+def mensagem_texto(remetente, destinatarios, assunto, corpo):
+    """Mensagem só com texto (entrega por link), no mesmo formato em pedaços"""
+    msg = EmailMessage(policy=policy.SMTP)
+    msg['Subject'] = assunto
+    msg['From'] = remetente
+    msg['To'] = ', '.join(destinatarios)
+    msg['Date'] = formatdate(localtime=True)
+    msg['Message-ID'] = make_msgid()
+    msg.set_content(corpo, cte='base64')
+    yield msg.as_bytes()
+
+
+def tamanho_estimado(caminho_anexo):
+    """Tamanho aproximado da mensagem (anexo em base64 + cabeçalhos) para o SIZE do SMTP"""
+    tamanho = os.path.getsize(caminho_anexo)
+    return (tamanho + 2) // 3 * 4 * 78 // 76 + 4096
+
+
+def enviar(smtp, remetente, destinatarios, pedacos, tamanho=None):
+    """MAIL/RCPT/DATA enviando a mensagem pedaço a pedaço (smtplib.SMTP já autenticado)"""
+    smtp.ehlo_or_helo_if_needed()
+    opcoes = [f"SIZE={tamanho}"] if tamanho and smtp.has_extn('size') else []
+    codigo, resposta = smtp.mail(remetente, opcoes)
+    if codigo != 250:
+        smtp.rset()
+        raise smtplib.SMTPSenderRefused(codigo, resposta, remetente)
+    for destinatario in destinatarios:
+        codigo, resposta = smtp.rcpt(destinatario)
+        if codigo not in (250, 251):
+            smtp.rset()
+            raise smtplib.SMTPRecipientsRefused({destinatario: (codigo, resposta)})
+    codigo, resposta = smtp.docmd('data')
+    if codigo != 354:
+        smtp.rset()
+        raise smtplib.SMTPDataError(codigo, resposta)
+
+    # Com MAIL_DEBUG o smtplib imprime cada send(); o anexo inteiro iria para o log
+    nivel_debug, smtp.debuglevel = smtp.debuglevel, 0
+    try:
+        for pedaco in pedacos:
+            smtp.send(pedaco)
+        smtp.send(b".\r\n")
+    finally:
+        smtp.debuglevel = nivel_debug
+    codigo, resposta = smtp.getreply()
+    if codigo != 250:
+        raise smtplib.SMTPDataError(codigo, resposta)
+    return resposta
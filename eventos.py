@@ -0,0 +1,131 @@
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Server-Sent Events: as rotas que mudam o estado de um pedido publicam um
+# evento num canal ('admin' ou 'pedido:<id>') e cada conexão SSE aberta recebe
+# uma cópia pela sua fila. O painel e a página do cliente deixam de consultar o
+# banco em intervalos: o custo passa a ser um evento por escrita.
+#
+# O pub/sub é em memória, por processo: o publicador e as conexões SSE precisam
+# estar no mesmo processo (um worker com threads/gevent, trabalhadores da fila
+# de entregas dentro do app). Os últimos eventos de cada canal ficam guardados
+# para quem reconecta com Last-Event-ID não perder nada. Esse histórico vale
+# para no máximo canais_max canais (LRU) e o de um pedido finalizado sem
+# ninguém ouvindo é descartado (encerrar).
+
+
+class Eventos:
+    """Canais de eventos em memória com uma fila por assinante"""
+
+    def __init__(self, fila_max=100, historico=50, heartbeat=15.0, duracao_max=300.0, retry_ms=3000,
+                 canais_max=1000):
+        self.fila_max = fila_max
+        self.heartbeat = heartbeat
+        self.duracao_max = duracao_max
+        self.retry_ms = retry_ms
+        self._assinantes = {}   # canal -> set(queue.Queue)
+        self._historico = OrderedDict()  # canal -> deque((id, tipo, dados)), do menos ao mais recente
+        self._tamanho_historico = historico
+        self.canais_max = canais_max
+        self._ids = itertools.count(int(time.time() * 1000))  # crescente entre reinícios
+        self._lock = threading.Lock()
+        self.publicados = 0
+        self.entregues = 0
+        self.descartados = 0
+
+    def publicar(self, canal, tipo, dados):
+        """Entrega o evento a todos os assinantes do canal (não bloqueia)"""
+        with self._lock:
+            evento = (next(self._ids), tipo, dados)
+            historico = self._historico.get(canal)
+            if historico is None:
+                historico = self._historico[canal] = deque(maxlen=self._tamanho_historico)
+            else:
+                self._historico.move_to_end(canal)
+            historico.append(evento)
+            while len(self._historico) > self.canais_max:
+                self._historico.popitem(last=False)
+            assinantes = list(self._assinantes.get(canal, ()))
+            self.publicados += 1
+        for fila in assinantes:
+            try:
+                fila.put_nowait(evento)
+                entregue = True
+            except queue.Full:
+                # Cliente lento demais: perde o evento em vez de travar quem publicou
+                entregue = False
+            with self._lock:
+                if entregue:
+                    self.entregues += 1
+                else:
+                    self.descartados += 1
+
+    def encerrar(self, canal):
+        """Descarta o histórico do canal se ninguém está ouvindo (pedido finalizado)"""
+        with self._lock:
+            if canal not in self._assinantes:
+                self._historico.pop(canal, None)
+
+    @contextmanager
+    def assinar(self, canal, ultimo_id=None):
+        """Fila do assinante, já com os eventos perdidos desde ultimo_id"""
+        fila = queue.Queue(self.fila_max)
+        with self._lock:
+            self._assinantes.setdefault(canal, set()).add(fila)
+            if ultimo_id is not None:
+                for evento in self._historico.get(canal, ()):
+                    if evento[0] > ultimo_id and not fila.full():
+                        fila.put_nowait(evento)
+        try:
+            yield fila
+        finally:
+            with self._lock:
+                self._assinantes[canal].discard(fila)
+                if not self._assinantes[canal]:
+                    del self._assinantes[canal]
+
+    def stream(self, canal, ultimo_id=None):
+        """Gerador do corpo text/event-stream de uma conexão.
+
+        Envia um comentário a cada heartbeat (mantém proxies e o EventSource
+        vivos) e encerra após duracao_max; o navegador reconecta sozinho.
+        """
+        with self.assinar(canal, ultimo_id) as fila:
+            yield f"retry: {self.retry_ms}\n\n"
+            fim = time.monotonic() + self.duracao_max
+            while time.monotonic() < fim:
+                try:
+                    id_evento, tipo, dados = fila.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield f"id: {id_evento}\nevent: {tipo}\ndata: {json.dumps(dados)}\n\n"
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'canais': len(self._assinantes),
+                'historicos': len(self._historico),
+                'conexoes': sum(len(s) for s in self._assinantes.values()),
+                'publicados': self.publicados,
+                'entregues': self.entregues,
+                'descartados': self.descartados,
+            }
+
+
+def init_app(app):
+    eventos = Eventos(
+        fila_max=int(os.getenv('SSE_FILA_MAX', '100')),
+        historico=int(os.getenv('SSE_HISTORICO', '50')),
+        heartbeat=float(os.getenv('SSE_HEARTBEAT', '15')),
+        duracao_max=float(os.getenv('SSE_DURACAO_MAX', '300')),
+        canais_max=int(os.getenv('SSE_CANAIS_MAX', '1000')),
+    )
+    app.extensions['eventos'] = eventos
+    return eventos
@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Cliente HTTP compartilhado para baixar os PDFs remotos e as capas. Uma única
+# Session por processo, com pools de conexões keep-alive por host, repetição
+# automática com backoff exponencial que respeita Retry-After, limite de downloads
+# simultâneos por host e um disjuntor para hosts que começam a responder 403
+# (archive.org bloqueando downloads automáticos): enquanto aberto, nem tentamos.
+
+# Para Archive.org, usar headers de navegador real
+CABECALHOS_NAVEGADOR = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'application/pdf,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Referer': 'https://archive.org/',
+    'DNT': '1',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'same-origin'
+}
+STATUS_REPETIR = (429, 500, 502, 503, 504)
+
+
+class HostIndisponivel(requests.exceptions.RequestException):
+    """Disjuntor aberto ou limite de downloads simultâneos do host esgotado"""
+
+
+class RetryLimitado(Retry):
+    """Retry que respeita Retry-After, mas nunca espera mais que retry_after_max"""
+
+    def __init__(self, *args, retry_after_max=60, **kwargs):
+        self.retry_after_max = retry_after_max
+        super().__init__(*args, **kwargs)
+
+    def new(self, **kw):
+        novo = super().new(**kw)
+        novo.retry_after_max = self.retry_after_max
+        return novo
+
+    def get_retry_after(self, response):
+        espera = super().get_retry_after(response)
+        return None if espera is None else min(espera, self.retry_after_max)
+
+
+class _Host:
+    """Estado por host: semáforo de concorrência e disjuntor de 403"""
+
+    def __init__(self, limite):
+        self.semaforo = threading.BoundedSemaphore(limite)
+        self.lock = threading.Lock()
+        self.bloqueios_seguidos = 0
+        self.aberto_ate = 0.0
+        self.em_teste = False
+        self.requisicoes = 0
+        self.bloqueios = 0
+        self.rejeitadas = 0
+
+
+class ClienteHttp:
+    """Session compartilhada com pools por host, retry e disjuntor"""
+
+    def __init__(self, cabecalhos=None, limite_por_host=4, tentativas=3, backoff=1.0,
+                 backoff_max=30.0, retry_after_max=60.0, timeout=(10, 60),
+                 limite_403=3, pausa_403=300.0, espera_vaga=120.0, hosts_em_pool=10):
+        self.limite_por_host = limite_por_host
+        self.timeout = timeout
+        self.limite_403 = limite_403
+        self.pausa_403 = pausa_403
+        self.espera_vaga = espera_vaga
+        self.retry = RetryLimitado(
+            total=tentativas, connect=tentativas, read=tentativas, status=tentativas,
+            backoff_factor=backoff, backoff_max=backoff_max, backoff_jitter=backoff / 2,
+            status_forcelist=STATUS_REPETIR, allowed_methods=frozenset({'GET', 'HEAD'}),
+            respect_retry_after_header=True, raise_on_status=False,
+            retry_after_max=retry_after_max,
+        )
+        self.session = requests.Session()
+        self.session.headers.update(cabecalhos or CABECALHOS_NAVEGADOR)
+        # Adapters montados uma vez aqui: a Session é compartilhada entre threads
+        # (mount() depois alteraria session.adapters durante um get) e hosts
+        # alcançados por redirect também usam o retry. O urllib3 mantém um pool
+        # por host, do tamanho do limite de concorrência.
+        for prefixo in ('https://', 'http://'):
+            self.session.mount(prefixo, HTTPAdapter(
+                pool_connections=hosts_em_pool, pool_maxsize=limite_por_host, max_retries=self.retry))
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+
+    def _host(self, url):
+        partes = urlsplit(url)
+        chave = f"{partes.scheme}://{partes.netloc}"
+        with self._hosts_lock:
+            host = self._hosts.get(chave)
+            if host is None:
+                host = self._hosts[chave] = _Host(self.limite_por_host)
+        return chave, host
+
+    def _liberado(self, chave, host):
+        with host.lock:
+            agora = time.monotonic()
+            if host.aberto_ate > agora:
+                host.rejeitadas += 1
+                raise HostIndisponivel(
+                    f"{chave} bloqueou downloads (403); nova tentativa em {int(host.aberto_ate - agora)}s")
+            if host.bloqueios_seguidos >= self.limite_403:
+                # Meio-aberto: deixa passar uma requisição de teste
+                if host.em_teste:
+                    host.rejeitadas += 1
+                    raise HostIndisponivel(f"{chave} em teste após bloqueio (403)")
+                host.em_teste = True
+
+    def _registrar(self, chave, host, status):
+        with host.lock:
+            host.em_teste = False
+            if status in (401, 403):
+                host.bloqueios += 1
+                host.bloqueios_seguidos += 1
+                if host.bloqueios_seguidos >= self.limite_403:
+                    host.aberto_ate = time.monotonic() + self.pausa_403
+                    print(f"🚫 {chave}: {host.bloqueios_seguidos} respostas {status} seguidas, "
+                          f"pausando downloads por {int(self.pausa_403)}s")
+            else:
+                host.bloqueios_seguidos = 0
+                host.aberto_ate = 0.0
+
+    @contextmanager
+    def abrir(self, url, headers=None, timeout=None):
+        """GET em streaming; a vaga do host fica ocupada até o corpo ser lido e fechado"""
+        chave, host = self._host(url)
+        self._liberado(chave, host)
+        if not host.semaforo.acquire(timeout=self.espera_vaga):
+            with host.lock:
+                host.em_teste = False
+                host.rejeitadas += 1
+            raise HostIndisponivel(f"{chave}: nenhuma vaga de download em {int(self.espera_vaga)}s")
+        try:
+            host.requisicoes += 1
+            try:
+                resp = self.session.get(url, headers=headers, timeout=timeout or self.timeout,
+                                        stream=True, allow_redirects=True)
+            except requests.exceptions.RequestException:
+                with host.lock:
+                    host.em_teste = False
+                raise
+            self._registrar(chave, host, resp.status_code)
+            with resp:
+                yield resp
+        finally:
+            host.semaforo.release()
+
+    def estatisticas(self):
+        agora = time.monotonic()
+        with self._hosts_lock:
+            hosts = dict(self._hosts)
+        return {
+            chave: {
+                'requisicoes': h.requisicoes,
+                'bloqueios_403': h.bloqueios,
+                'rejeitadas': h.rejeitadas,
+                'disjuntor': 'aberto' if h.aberto_ate > agora else
+                             ('meio-aberto' if h.bloqueios_seguidos >= self.limite_403 else 'fechado'),
+            }
+            for chave, h in hosts.items()
+        }
+
+
+def init_app(app):
+    cliente = ClienteHttp(
+        limite_por_host=int(os.getenv('HTTP_LIMITE_POR_HOST', '4')),
+        tentativas=int(os.getenv('HTTP_TENTATIVAS', '3')),
+        backoff=float(os.getenv('HTTP_BACKOFF', '1')),
+        retry_after_max=float(os.getenv('HTTP_RETRY_AFTER_MAX', '60')),
+        timeout=(float(os.getenv('HTTP_TIMEOUT_CONEXAO', '10')), float(os.getenv('PDF_TIMEOUT', '60'))),
+        limite_403=int(os.getenv('HTTP_LIMITE_403', '3')),
+        pausa_403=float(os.getenv('HTTP_PAUSA_403', '300')),
+    )
+    app.extensions['http_remoto'] = cliente
+    return cliente
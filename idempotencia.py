@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+from banco import em_transacao
+
+# Checkout idempotente: o cliente manda um cabeçalho Idempotency-Key (um UUID
+# por tentativa de compra) e a resposta de sucesso fica guardada na tabela
+# idempotencia (migração 010), gravada na MESMA transação que cria o pedido.
+# Repetir a requisição com a mesma chave devolve a resposta guardada sem criar
+# outro pedido nem outro PIX; como a transação é BEGIN IMMEDIATE, duas cópias
+# simultâneas se enfileiram e a segunda já encontra a resposta da primeira.
+
+CHAVE_TAMANHO_MAXIMO = 255
+
+
+class ErroIdempotencia(Exception):
+    """Chave inválida ou reaproveitada com outro corpo de requisição"""
+
+    def __init__(self, mensagem, status=422):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def executar(con, rota, chave, corpo, funcao):
+    """Roda funcao(con) -> (resposta, status) numa transação única.
+
+    Devolve (resposta, status, repetida). Sem chave, só garante a transação;
+    com chave, respostas 2xx são gravadas e reproduzidas nas repetições.
+    """
+    if chave is not None and not 0 < len(chave) <= CHAVE_TAMANHO_MAXIMO:
+        raise ErroIdempotencia(f"Idempotency-Key deve ter de 1 a {CHAVE_TAMANHO_MAXIMO} caracteres", 400)
+    hash_corpo = hashlib.sha256(corpo or b'').hexdigest()
+    validade_horas = int(os.getenv('IDEMPOTENCIA_VALIDADE_H', '24'))
+
+    def transacao(con):
+        if chave is not None:
+            # Chave vencida ainda não apagada vale como nova (o INSERT abaixo a substitui)
+            salva = con.execute("""
+                SELECT hash_corpo, status, resposta FROM idempotencia
+                WHERE rota=? AND chave=? AND criado_em >= datetime('now', ?)
+            """, (rota, chave, f'-{validade_horas} hours')).fetchone()
+            if salva:
+                if salva['hash_corpo'] != hash_corpo:
+                    raise ErroIdempotencia("Idempotency-Key já usada com outro conteúdo")
+                return json.loads(salva['resposta']), salva['status'], True
+
+        resposta, status = funcao(con)
+        if chave is not None and 200 <= status < 300:
+            con.execute("DELETE FROM idempotencia WHERE criado_em < datetime('now', ?)",
+                        (f'-{validade_horas} hours',))
+            con.execute("""
+                INSERT INTO idempotencia (rota, chave, hash_corpo, status, resposta)
+                VALUES (?, ?, ?, ?, ?)
+            """, (rota, chave, hash_corpo, status, json.dumps(resposta)))
+        return resposta, status, False
+
+    return em_transacao(con, transacao)
@@ -0,0 +1,143 @@
+import base64
+import hashlib
+import hmac
+import os
+import time
+from flask import current_app, request
+from werkzeug.utils import send_file as werkzeug_send_file
+
+# Entrega por link: em vez de anexar o PDF, o e-mail leva uma URL
+# /download/<token> assinada com HMAC-SHA256 e com validade. O token só carrega
+# pedido e expiração; cada link emitido também fica na tabela downloads
+# (migração 008), que conta os downloads e permite revogar apagando a linha.
+# O arquivo sai do cache de PDFs com Range/206 (downloads retomáveis) e, atrás
+# de um proxy, por X-Sendfile ou X-Accel-Redirect (o proxy faz o sendfile).
+
+
+class LinkInvalido(Exception):
+    """Token adulterado, expirado, revogado ou sem downloads restantes"""
+
+    def __init__(self, mensagem, status=403):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def _b64(dados):
+    return base64.urlsafe_b64encode(dados).rstrip(b'=').decode()
+
+
+def _hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class LinksDownload:
+    """Emissão e validação dos tokens de download"""
+
+    def __init__(self, segredo, validade=7 * 86400, max_downloads=10, modo_sendfile='',
+                 prefixo_accel='/protegido-pdfs/', pasta_pdfs=''):
+        self.segredo = segredo.encode() if isinstance(segredo, str) else segredo
+        self.validade = validade
+        self.max_downloads = max_downloads
+        self.modo_sendfile = modo_sendfile
+        self.prefixo_accel = prefixo_accel
+        self.pasta_pdfs = pasta_pdfs
+
+    def _assinatura(self, mensagem):
+        return _b64(hmac.new(self.segredo, mensagem.encode(), hashlib.sha256).digest()[:24])
+
+    def emitir(self, con, pedido_id):
+        """Cria o token do pedido e registra o link (não faz commit)"""
+        expira_em = int(time.time()) + self.validade
+        nonce = _b64(os.urandom(6))
+        mensagem = f"{pedido_id}.{expira_em}.{nonce}"
+        token = f"{mensagem}.{self._assinatura(mensagem)}"
+        con.execute("""
+            INSERT INTO downloads (token_hash, pedido_id, expira_em, max_downloads)
+            VALUES (?, ?, datetime(?, 'unixepoch'), ?)
+        """, (_hash_token(token), pedido_id, expira_em, self.max_downloads))
+        return token
+
+    def validar(self, con, token):
+        """Confere assinatura, validade e limite; devolve a linha de downloads"""
+        try:
+            pedido_id, expira_em, nonce, assinatura = token.split('.')
+            pedido_id, expira_em = int(pedido_id), int(expira_em)
+        except ValueError:
+            raise LinkInvalido("Link inválido")
+        mensagem = f"{pedido_id}.{expira_em}.{nonce}"
+        if not hmac.compare_digest(assinatura, self._assinatura(mensagem)):
+            raise LinkInvalido("Link inválido")
+        if expira_em < time.time():
+            raise LinkInvalido("Link expirado", 410)
+        link = con.execute("SELECT * FROM downloads WHERE token_hash=?", (_hash_token(token),)).fetchone()
+        if link is None or link['pedido_id'] != pedido_id:
+            raise LinkInvalido("Link revogado", 410)
+        if link['max_downloads'] and link['downloads'] >= link['max_downloads']:
+            raise LinkInvalido("Limite de downloads deste link atingido", 429)
+        return link
+
+    def registrar(self, con, link, intervalo, tamanho):
+        """Conta um download.
+
+        Um pedido de Range que começa no byte 0 (ou sem Range) conta como
+        download novo, e os que continuam um download não contam. Os bytes
+        pedidos também são somados por link, e o número de downloads nunca fica
+        abaixo de bytes_enviados / tamanho. Assim, repetir Range: bytes=1- não
+        escapa do limite.
+        """
+        faixa = intervalo.range_for_length(tamanho) if intervalo is not None else None
+        enviados = faixa[1] - faixa[0] if faixa else tamanho
+        novo = faixa is None or faixa[0] == 0
+        con.execute("""
+            UPDATE downloads SET
+                downloads = MAX(downloads + ?, (bytes_enviados + ?) / ?),
+                bytes_enviados = bytes_enviados + ?,
+                requisicoes = requisicoes + 1,
+                ultimo_download = CURRENT_TIMESTAMP
+            WHERE token_hash=?
+        """, (1 if novo else 0, enviados, max(tamanho, 1), enviados, link['token_hash']))
+        con.commit()
+
+    def resposta(self, caminho, nome_arquivo):
+        """Resposta com o PDF: X-Accel-Redirect, X-Sendfile ou send_file com Range"""
+        relativo = os.path.relpath(caminho, self.pasta_pdfs)
+        if self.modo_sendfile == 'x-accel' and not relativo.startswith('..'):
+            # O nginx serve o arquivo do location interno mapeado para pdfs_cache/
+            resp = current_app.response_class(mimetype='application/pdf')
+            resp.headers['X-Accel-Redirect'] = f"{self.prefixo_accel.rstrip('/')}/{relativo.replace(os.sep, '/')}"
+            resp.headers.set('Content-Disposition', 'attachment', filename=nome_arquivo)
+        else:
+            # conditional=True: Range -> 206 / If-Range. Sem proxy, o Werkzeug usa o
+            # wsgi.file_wrapper do servidor (sendfile no gunicorn/uwsgi)
+            resp = werkzeug_send_file(
+                caminho, request.environ, mimetype='application/pdf', as_attachment=True,
+                download_name=nome_arquivo, conditional=True, max_age=0,
+                use_x_sendfile=self.modo_sendfile == 'x-sendfile',
+                response_class=current_app.response_class,
+            )
+        resp.headers['Cache-Control'] = 'private, no-store'
+        return resp
+
+    @staticmethod
+    def estatisticas(con):
+        row = con.execute("""
+            SELECT COUNT(*) AS links, COALESCE(SUM(downloads), 0) AS downloads,
+                   COALESCE(SUM(requisicoes), 0) AS requisicoes,
+                   COALESCE(SUM(bytes_enviados), 0) AS bytes_enviados,
+                   COALESCE(SUM(expira_em < CURRENT_TIMESTAMP), 0) AS expirados
+            FROM downloads
+        """).fetchone()
+        return dict(row)
+
+
+def init_app(app, pasta_pdfs):
+    links = LinksDownload(
+        os.getenv('DOWNLOAD_SEGREDO') or app.secret_key,
+        validade=int(os.getenv('DOWNLOAD_VALIDADE', str(7 * 86400))),
+        max_downloads=int(os.getenv('DOWNLOAD_MAX_POR_LINK', '10')),
+        modo_sendfile=os.getenv('DOWNLOAD_SENDFILE', '').lower(),
+        prefixo_accel=os.getenv('DOWNLOAD_ACCEL_PREFIXO', '/protegido-pdfs/'),
+        pasta_pdfs=pasta_pdfs,
+    )
+    app.extensions['links_download'] = links
+    return links
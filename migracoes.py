@@ -0,0 +1,727 @@
+import sqlite3
+import rollups
+
+# Cada migração é (versão, descrição, função). A versão aplicada fica gravada
+# em PRAGMA user_version; novas migrações entram sempre no FINAL da lista.
+
+
+def _executar(con, script):
+    """Como executescript(), mas sem o COMMIT implícito (mantém a transação)"""
+    comando = ''
+    for linha in script.splitlines(keepends=True):
+        if not comando and (not linha.strip() or linha.strip().startswith('--')):
+            continue
+        comando += linha
+        if sqlite3.complete_statement(comando):
+            con.execute(comando)
+            comando = ''
+    if comando.strip():
+        con.execute(comando)
+
+
+def _colunas(con, tabela):
+    return {c[1] for c in con.execute(f"PRAGMA table_info({tabela})")}
+
+
+def _m001_esquema_base(con):
+    """Tabelas principais + colunas que antes eram criadas em tempo de requisição"""
+    _executar(con, """
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            email TEXT NOT NULL UNIQUE,
+            senha TEXT NOT NULL,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS livros (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            titulo TEXT NOT NULL,
+            autor TEXT NOT NULL,
+            preco REAL NOT NULL,
+            imagem TEXT,
+            pdf TEXT NOT NULL,
+            origem TEXT DEFAULT 'local',
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            descricao TEXT
+        );
+        CREATE TABLE IF NOT EXISTS pedidos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL,
+            livro_id INTEGER NOT NULL,
+            usuario_id INTEGER,
+            status TEXT DEFAULT 'PENDENTE',
+            pix_code TEXT,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            observacao TEXT,
+            FOREIGN KEY (livro_id) REFERENCES livros(id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id)
+        );
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL UNIQUE,
+            senha_hash TEXT NOT NULL,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS carrinho (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            livro_id INTEGER NOT NULL,
+            adicionado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
+            FOREIGN KEY (livro_id) REFERENCES livros(id),
+            UNIQUE(usuario_id, livro_id)
+        );
+    """)
+
+    # Bancos antigos (criados antes destas colunas existirem)
+    colunas_pedidos = _colunas(con, 'pedidos')
+    if 'usuario_id' not in colunas_pedidos:
+        con.execute("ALTER TABLE pedidos ADD COLUMN usuario_id INTEGER")
+    if 'observacao' not in colunas_pedidos:
+        con.execute("ALTER TABLE pedidos ADD COLUMN observacao TEXT")
+    if 'descricao' not in _colunas(con, 'livros'):
+        con.execute("ALTER TABLE livros ADD COLUMN descricao TEXT")
+
+
+def _m002_indices(con):
+    """Índices de cobertura para perfil, carrinho, pendentes e dashboard"""
+    _executar(con, """
+        -- api_perfil: estatísticas e histórico por usuário, ordenado por data
+        CREATE INDEX IF NOT EXISTS idx_pedidos_usuario
+            ON pedidos(usuario_id, criado_em, status, livro_id);
+        -- dashboard / pedidos pendentes: filtros por status
+        CREATE INDEX IF NOT EXISTS idx_pedidos_status
+            ON pedidos(status, criado_em, livro_id, usuario_id);
+        -- dashboard: pedidos do dia
+        CREATE INDEX IF NOT EXISTS idx_pedidos_criado
+            ON pedidos(criado_em);
+        -- api_carrinho_listar: itens do usuário, mais recentes primeiro
+        CREATE INDEX IF NOT EXISTS idx_carrinho_usuario
+            ON carrinho(usuario_id, adicionado_em, livro_id);
+        -- dashboard: clientes novos no mês
+        CREATE INDEX IF NOT EXISTS idx_usuarios_criado
+            ON usuarios(criado_em);
+        ANALYZE;
+    """)
+
+
+def _delta_pedido(ref, sinal, snapshot=False):
+    """Comandos de trigger que somam (sinal=+1) ou subtraem (-1) um pedido dos rollups.
+
+    snapshot=True (migração 011 em diante) usa o total gravado no pedido e os
+    itens de pedido_itens; antes disso o valor vinha do preço atual do livro.
+    """
+    pago = f"({ref}.status IS 'PAGO')"
+    if snapshot:
+        return f"""
+        INSERT INTO rollup_status (status, total, receita)
+        VALUES (COALESCE({ref}.status, '{rollups.STATUS_NULO}'), {sinal}, {sinal} * {ref}.total)
+        ON CONFLICT(status) DO UPDATE SET
+            total = total + excluded.total, receita = receita + excluded.receita;
+        INSERT INTO rollup_dia (dia, pedidos, pedidos_pagos, receita)
+        VALUES (COALESCE(DATE({ref}.criado_em), '{rollups.DIA_NULO}'), {sinal}, {sinal} * {pago}, {sinal} * {pago} * {ref}.total)
+        ON CONFLICT(dia) DO UPDATE SET
+            pedidos = pedidos + excluded.pedidos,
+            pedidos_pagos = pedidos_pagos + excluded.pedidos_pagos,
+            receita = receita + excluded.receita;
+        INSERT INTO rollup_livro (livro_id, vendas, receita)
+        SELECT livro_id, {sinal}, {sinal} * preco FROM pedido_itens
+        WHERE pedido_id = {ref}.id AND {pago}
+        ON CONFLICT(livro_id) DO UPDATE SET
+            vendas = vendas + excluded.vendas, receita = receita + excluded.receita;"""
+    preco = f"COALESCE((SELECT preco FROM livros WHERE id = {ref}.livro_id), 0)"
+    return f"""
+        INSERT INTO rollup_status (status, total, receita)
+        VALUES (COALESCE({ref}.status, '{rollups.STATUS_NULO}'), {sinal}, {sinal} * {preco})
+        ON CONFLICT(status) DO UPDATE SET
+            total = total + excluded.total, receita = receita + excluded.receita;
+        INSERT INTO rollup_dia (dia, pedidos, pedidos_pagos, receita)
+        VALUES (COALESCE(DATE({ref}.criado_em), '{rollups.DIA_NULO}'), {sinal}, {sinal} * {pago}, {sinal} * {pago} * {preco})
+        ON CONFLICT(dia) DO UPDATE SET
+            pedidos = pedidos + excluded.pedidos,
+            pedidos_pagos = pedidos_pagos + excluded.pedidos_pagos,
+            receita = receita + excluded.receita;
+        INSERT INTO rollup_livro (livro_id, vendas, receita)
+        SELECT {ref}.livro_id, {sinal}, {sinal} * {preco} WHERE {pago}
+        ON CONFLICT(livro_id) DO UPDATE SET
+            vendas = vendas + excluded.vendas, receita = receita + excluded.receita;"""
+
+
+def _m003_rollups(con):
+    """Agregados do dashboard (status, dia, livro, totais) mantidos por triggers"""
+    _executar(con, f"""
+        CREATE TABLE IF NOT EXISTS rollup_status (
+            status TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            receita REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS rollup_dia (
+            dia TEXT PRIMARY KEY,
+            pedidos INTEGER NOT NULL DEFAULT 0,
+            pedidos_pagos INTEGER NOT NULL DEFAULT 0,
+            receita REAL NOT NULL DEFAULT 0,
+            novos_clientes INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS rollup_livro (
+            livro_id INTEGER PRIMARY KEY,
+            vendas INTEGER NOT NULL DEFAULT 0,
+            receita REAL NOT NULL DEFAULT 0
+        );
+        -- top-K de mais vendidos sem ordenar a tabela inteira
+        CREATE INDEX IF NOT EXISTS idx_rollup_livro_vendas
+            ON rollup_livro(vendas DESC, livro_id);
+        CREATE TABLE IF NOT EXISTS rollup_totais (
+            chave TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_pedidos_ins AFTER INSERT ON pedidos
+        BEGIN {_delta_pedido('NEW', 1)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_pedidos_upd
+        AFTER UPDATE OF status, livro_id, criado_em ON pedidos
+        WHEN OLD.status IS NOT NEW.status
+          OR OLD.livro_id IS NOT NEW.livro_id
+          OR OLD.criado_em IS NOT NEW.criado_em
+        BEGIN {_delta_pedido('OLD', -1)} {_delta_pedido('NEW', 1)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_pedidos_del AFTER DELETE ON pedidos
+        BEGIN {_delta_pedido('OLD', -1)}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_usuarios_ins AFTER INSERT ON usuarios
+        BEGIN
+            UPDATE rollup_totais SET valor = valor + 1 WHERE chave = 'usuarios';
+            INSERT INTO rollup_dia (dia, novos_clientes)
+            VALUES (COALESCE(DATE(NEW.criado_em), '{rollups.DIA_NULO}'), 1)
+            ON CONFLICT(dia) DO UPDATE SET novos_clientes = novos_clientes + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_usuarios_del AFTER DELETE ON usuarios
+        BEGIN
+            UPDATE rollup_totais SET valor = valor - 1 WHERE chave = 'usuarios';
+            UPDATE rollup_dia SET novos_clientes = novos_clientes - 1
+            WHERE dia = COALESCE(DATE(OLD.criado_em), '{rollups.DIA_NULO}');
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_livros_ins AFTER INSERT ON livros
+        BEGIN
+            UPDATE rollup_totais SET valor = valor + 1 WHERE chave = 'livros';
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_livros_del AFTER DELETE ON livros
+        BEGIN
+            UPDATE rollup_totais SET valor = valor - 1 WHERE chave = 'livros';
+        END;
+    """)
+    # Carga inicial com o esquema desta versão (valor = preço atual do livro).
+    # O SQL fica aqui, e não em rollups.reconstruir, para a migração não mudar
+    # quando o código da aplicação mudar.
+    _executar(con, f"""
+        INSERT INTO rollup_status (status, total, receita)
+        SELECT COALESCE(p.status, '{rollups.STATUS_NULO}'), COUNT(*), COALESCE(SUM(l.preco), 0)
+        FROM pedidos p
+        LEFT JOIN livros l ON p.livro_id = l.id
+        GROUP BY 1;
+        INSERT INTO rollup_dia (dia, pedidos, pedidos_pagos, receita)
+        SELECT COALESCE(DATE(p.criado_em), '{rollups.DIA_NULO}'),
+               COUNT(*),
+               SUM(p.status IS 'PAGO'),
+               COALESCE(SUM(CASE WHEN p.status IS 'PAGO' THEN l.preco END), 0)
+        FROM pedidos p
+        LEFT JOIN livros l ON p.livro_id = l.id
+        GROUP BY 1;
+        INSERT INTO rollup_dia (dia, novos_clientes)
+        SELECT COALESCE(DATE(criado_em), '{rollups.DIA_NULO}'), COUNT(*)
+        FROM usuarios
+        WHERE true
+        GROUP BY 1
+        ON CONFLICT(dia) DO UPDATE SET novos_clientes = excluded.novos_clientes;
+        INSERT INTO rollup_livro (livro_id, vendas, receita)
+        SELECT p.livro_id, COUNT(*), COALESCE(SUM(l.preco), 0)
+        FROM pedidos p
+        LEFT JOIN livros l ON p.livro_id = l.id
+        WHERE p.status = 'PAGO'
+        GROUP BY p.livro_id;
+        INSERT INTO rollup_totais (chave, valor)
+        VALUES ('livros', (SELECT COUNT(*) FROM livros)),
+               ('usuarios', (SELECT COUNT(*) FROM usuarios));
+    """)
+
+
+def _m004_busca_fts(con):
+    """Índice FTS5 (external content) sobre titulo/autor/descricao, sincronizado por triggers"""
+    _executar(con, """
+        CREATE VIRTUAL TABLE IF NOT EXISTS livros_fts USING fts5(
+            titulo, autor, descricao,
+            content='livros', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_livros_fts_ins AFTER INSERT ON livros
+        BEGIN
+            INSERT INTO livros_fts(rowid, titulo, autor, descricao)
+            VALUES (NEW.id, NEW.titulo, NEW.autor, NEW.descricao);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_livros_fts_del AFTER DELETE ON livros
+        BEGIN
+            INSERT INTO livros_fts(livros_fts, rowid, titulo, autor, descricao)
+            VALUES ('delete', OLD.id, OLD.titulo, OLD.autor, OLD.descricao);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_livros_fts_upd AFTER UPDATE OF titulo, autor, descricao ON livros
+        BEGIN
+            INSERT INTO livros_fts(livros_fts, rowid, titulo, autor, descricao)
+            VALUES ('delete', OLD.id, OLD.titulo, OLD.autor, OLD.descricao);
+            INSERT INTO livros_fts(rowid, titulo, autor, descricao)
+            VALUES (NEW.id, NEW.titulo, NEW.autor, NEW.descricao);
+        END;
+
+        -- carga inicial a partir de livros (SQL próprio, não muda com busca.py)
+        INSERT INTO livros_fts(livros_fts) VALUES ('rebuild');
+        INSERT INTO livros_fts(livros_fts) VALUES ('optimize');
+    """)
+
+
+def _incrementar_versao(chave, condicao='1'):
+    """Comando de trigger que incrementa a versão de uma chave em versoes"""
+    return f"""
+            INSERT INTO versoes (chave, versao, atualizado_em)
+            SELECT {chave}, 1, CURRENT_TIMESTAMP WHERE {condicao}
+            ON CONFLICT(chave) DO UPDATE SET
+                versao = versao + 1, atualizado_em = excluded.atualizado_em;"""
+
+
+def _m005_versoes(con):
+    """Contadores de versão por chave de dados, usados nos ETags (cache_http.py)"""
+    livro = lambda ref: _incrementar_versao("'livros'") + _incrementar_versao(f"'livro:' || {ref}.id")
+    carrinho = lambda ref: _incrementar_versao(f"'carrinho:' || {ref}.usuario_id")
+    usuario_pedido = lambda ref: _incrementar_versao(f"'usuario:' || {ref}.usuario_id",
+                                                     f"{ref}.usuario_id IS NOT NULL")
+    _executar(con, f"""
+        CREATE TABLE IF NOT EXISTS versoes (
+            chave TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL DEFAULT 0,
+            atualizado_em TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID;
+        INSERT OR IGNORE INTO versoes (chave, versao) VALUES ('livros', 1);
+
+        CREATE TRIGGER IF NOT EXISTS trg_versao_livros_ins AFTER INSERT ON livros
+        BEGIN {livro('NEW')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_versao_livros_upd AFTER UPDATE ON livros
+        BEGIN {livro('OLD')} {livro('NEW')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_versao_livros_del AFTER DELETE ON livros
+        BEGIN {livro('OLD')}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_versao_carrinho_ins AFTER INSERT ON carrinho
+        BEGIN {carrinho('NEW')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_versao_carrinho_upd AFTER UPDATE ON carrinho
+        BEGIN {carrinho('OLD')} {carrinho('NEW')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_versao_carrinho_del AFTER DELETE ON carrinho
+        BEGIN {carrinho('OLD')}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_versao_pedidos_ins AFTER INSERT ON pedidos
+        BEGIN {usuario_pedido('NEW')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_versao_pedidos_upd AFTER UPDATE ON pedidos
+        BEGIN {usuario_pedido('OLD')} {usuario_pedido('NEW')}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_versao_pedidos_del AFTER DELETE ON pedidos
+        BEGIN {usuario_pedido('OLD')}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS trg_versao_usuarios_upd AFTER UPDATE ON usuarios
+        BEGIN {_incrementar_versao("'usuario:' || NEW.id")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_versao_usuarios_del AFTER DELETE ON usuarios
+        BEGIN {_incrementar_versao("'usuario:' || OLD.id")}
+        END;
+    """)
+
+
+
+def _m006_entregas(con):
+    """Fila persistente de envio dos e-books (entregas.py)"""
+    _executar(con, """
+        CREATE TABLE IF NOT EXISTS entregas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pedido_id INTEGER NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'PENDENTE',
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            max_tentativas INTEGER NOT NULL DEFAULT 5,
+            proxima_execucao TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            ultimo_erro TEXT,
+            trabalhador TEXT,
+            criado_em TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            iniciado_em TEXT,
+            concluido_em TEXT,
+            atualizado_em TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        -- Próximo job vencido: WHERE estado='PENDENTE' ORDER BY proxima_execucao
+        CREATE INDEX IF NOT EXISTS idx_entregas_fila ON entregas(estado, proxima_execucao);
+        -- No máximo um job ativo por pedido (aprovar duas vezes não envia dois e-mails)
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_entregas_pedido_ativo ON entregas(pedido_id)
+            WHERE estado IN ('PENDENTE', 'PROCESSANDO');
+    """)
+
+
+
+def _m007_cache_pdfs(con):
+    """Índice do cache de PDFs em disco (cache_pdfs.py)"""
+    _executar(con, """
+        CREATE TABLE IF NOT EXISTS cache_pdfs (
+            url TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            baixado_em TEXT NOT NULL,
+            validado_em TEXT NOT NULL,
+            ultimo_acesso TEXT NOT NULL,
+            acessos INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_cache_pdfs_acesso ON cache_pdfs(ultimo_acesso);
+        CREATE INDEX IF NOT EXISTS idx_cache_pdfs_sha256 ON cache_pdfs(sha256);
+    """)
+
+
+
+def _m008_downloads(con):
+    """Links de download assinados emitidos por pedido (links_download.py)"""
+    _executar(con, """
+        CREATE TABLE IF NOT EXISTS downloads (
+            token_hash TEXT PRIMARY KEY,
+            pedido_id INTEGER NOT NULL,
+            criado_em TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            expira_em TEXT NOT NULL,
+            max_downloads INTEGER NOT NULL DEFAULT 0,
+            downloads INTEGER NOT NULL DEFAULT 0,
+            requisicoes INTEGER NOT NULL DEFAULT 0,
+            ultimo_download TEXT
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_downloads_pedido ON downloads(pedido_id);
+    """)
+
+
+
+def _delta_usuario(ref, sinal, snapshot=False):
+    """Comandos de trigger que somam (+1) ou subtraem (-1) um pedido do rollup do usuário"""
+    preco = f"{ref}.total" if snapshot else f"COALESCE((SELECT preco FROM livros WHERE id = {ref}.livro_id), 0)"
+    pago = f"({ref}.status IS 'PAGO')"
+    return f"""
+        INSERT INTO rollup_usuario (usuario_id, pedidos, pedidos_pagos, pedidos_pendentes, total_gasto)
+        SELECT {ref}.usuario_id, {sinal}, {sinal} * {pago}, {sinal} * ({ref}.status IS 'PENDENTE'),
+               {sinal} * {pago} * {preco}
+        WHERE {ref}.usuario_id IS NOT NULL
+        ON CONFLICT(usuario_id) DO UPDATE SET
+            pedidos = pedidos + excluded.pedidos,
+            pedidos_pagos = pedidos_pagos + excluded.pedidos_pagos,
+            pedidos_pendentes = pedidos_pendentes + excluded.pedidos_pendentes,
+            total_gasto = total_gasto + excluded.total_gasto;"""
+
+
+def _m009_perfil(con):
+    """Resumo do perfil por usuário (rollup) e índice (usuario_id, criado_em) do histórico"""
+    _executar(con, f"""
+        CREATE TABLE IF NOT EXISTS rollup_usuario (
+            usuario_id INTEGER PRIMARY KEY,
+            pedidos INTEGER NOT NULL DEFAULT 0,
+            pedidos_pagos INTEGER NOT NULL DEFAULT 0,
+            pedidos_pendentes INTEGER NOT NULL DEFAULT 0,
+            total_gasto REAL NOT NULL DEFAULT 0
+        );
+
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_usuario_ins AFTER INSERT ON pedidos
+        BEGIN {_delta_usuario('NEW', 1)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_usuario_upd
+        AFTER UPDATE OF status, livro_id, usuario_id ON pedidos
+        WHEN OLD.status IS NOT NEW.status
+          OR OLD.livro_id IS NOT NEW.livro_id
+          OR OLD.usuario_id IS NOT NEW.usuario_id
+        BEGIN {_delta_usuario('OLD', -1)} {_delta_usuario('NEW', 1)}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_usuario_del AFTER DELETE ON pedidos
+        BEGIN {_delta_usuario('OLD', -1)}
+        END;
+
+        -- histórico do perfil por keyset: (criado_em, rowid) em ordem decrescente
+        -- direto do índice; as estatísticas agora vêm de rollup_usuario
+        DROP INDEX IF EXISTS idx_pedidos_usuario;
+        CREATE INDEX IF NOT EXISTS idx_pedidos_usuario_data
+            ON pedidos(usuario_id, criado_em);
+        ANALYZE;
+    """)
+    # Carga inicial com o esquema desta versão (ver _m003_rollups)
+    _executar(con, """
+        INSERT INTO rollup_usuario (usuario_id, pedidos, pedidos_pagos, pedidos_pendentes, total_gasto)
+        SELECT p.usuario_id,
+               COUNT(*),
+               SUM(p.status IS 'PAGO'),
+               SUM(p.status IS 'PENDENTE'),
+               COALESCE(SUM(CASE WHEN p.status IS 'PAGO' THEN l.preco END), 0)
+        FROM pedidos p
+        LEFT JOIN livros l ON p.livro_id = l.id
+        WHERE p.usuario_id IS NOT NULL
+        GROUP BY p.usuario_id;
+    """)
+
+
+
+def _m010_idempotencia(con):
+    """Respostas do checkout guardadas por Idempotency-Key (idempotencia.py)"""
+    _executar(con, """
+        CREATE TABLE IF NOT EXISTS idempotencia (
+            rota TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            hash_corpo TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            resposta TEXT NOT NULL,
+            criado_em TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (rota, chave)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_idempotencia_criado ON idempotencia(criado_em);
+    """)
+
+
+
+def _valor_br_code(payload):
+    """Valor (campo 54) de um BR Code com CRC16 correto, ou None.
+
+    Cópia própria da leitura do pix.py, para o backfill da 011 não depender
+    de mudanças futuras naquele módulo.
+    """
+    if not payload or len(payload) <= 8 or payload[-8:-4] != '6304':
+        return None
+    crc = 0xFFFF
+    for byte in payload[:-4].encode('utf-8'):
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+    if payload[-4:].upper() != f"{crc:04X}":
+        return None
+    i = 0
+    while i + 4 <= len(payload):
+        try:
+            id_campo, tamanho = payload[i:i + 2], int(payload[i + 2:i + 4])
+            if id_campo == '54':
+                return float(payload[i + 4:i + 4 + tamanho])
+        except ValueError:
+            return None
+        i += 4 + tamanho
+    return None
+
+
+def _itens_consolidados(observacao, por_titulo):
+    """Livros de um pedido consolidado antigo, a partir da observação
+    "PEDIDO CONSOLIDADO - N livro(s): Título A, Título B" (títulos podem ter vírgula)"""
+    partes = observacao.split(': ', 1)[1].split(', ') if ': ' in observacao else []
+    itens, atual = [], ''
+    for parte in partes:
+        atual = f"{atual}, {parte}" if atual else parte
+        if atual in por_titulo:
+            itens.append(por_titulo[atual])
+            atual = ''
+    return itens if not atual else []
+
+
+def _m011_pedido_itens(con):
+    """Itens de pedido com o preço da compra e total gravado em pedidos (backfill)"""
+    if 'total' not in _colunas(con, 'pedidos'):
+        con.execute("ALTER TABLE pedidos ADD COLUMN total REAL NOT NULL DEFAULT 0")
+    _executar(con, """
+        CREATE TABLE IF NOT EXISTS pedido_itens (
+            id INTEGER PRIMARY KEY,
+            pedido_id INTEGER NOT NULL REFERENCES pedidos(id),
+            livro_id INTEGER NOT NULL,
+            titulo TEXT NOT NULL,
+            preco REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_pedido_itens_pedido ON pedido_itens(pedido_id);
+        CREATE INDEX IF NOT EXISTS idx_pedido_itens_livro ON pedido_itens(livro_id);
+    """)
+
+    # Backfill: o preço da época não foi guardado; usa o preço atual do livro
+    # (ou o valor do BR Code, que é o que o cliente pagou, nos consolidados)
+    livros = {row[0]: row for row in con.execute("SELECT id, titulo, COALESCE(preco, 0) FROM livros")}
+    por_titulo = {}
+    for livro in livros.values():
+        por_titulo.setdefault(livro[1], livro)
+    itens, totais = [], []
+    pedidos = con.execute("""
+        SELECT id, livro_id, observacao, pix_code FROM pedidos
+        WHERE id NOT IN (SELECT pedido_id FROM pedido_itens)
+    """).fetchall()
+    for pedido_id, livro_id, observacao, pix_code in pedidos:
+        livros_pedido = []
+        if observacao and observacao.startswith('PEDIDO CONSOLIDADO'):
+            livros_pedido = _itens_consolidados(observacao, por_titulo)
+        if not livros_pedido and livro_id in livros:
+            livros_pedido = [livros[livro_id]]
+        itens += [(pedido_id, id_livro, titulo, preco) for id_livro, titulo, preco in livros_pedido]
+        total = _valor_br_code(pix_code) if len(livros_pedido) > 1 else None
+        totais.append((total if total is not None else sum(l[2] for l in livros_pedido), pedido_id))
+    con.executemany("INSERT INTO pedido_itens (pedido_id, livro_id, titulo, preco) VALUES (?, ?, ?, ?)", itens)
+    con.executemany("UPDATE pedidos SET total=? WHERE id=?", totais)
+
+    # Rollups passam a somar o total gravado (e os itens, por livro), sem JOIN com livros
+    _executar(con, f"""
+        DROP TRIGGER IF EXISTS trg_rollup_pedidos_ins;
+        DROP TRIGGER IF EXISTS trg_rollup_pedidos_upd;
+        DROP TRIGGER IF EXISTS trg_rollup_pedidos_del;
+        DROP TRIGGER IF EXISTS trg_rollup_usuario_ins;
+        DROP TRIGGER IF EXISTS trg_rollup_usuario_upd;
+        DROP TRIGGER IF EXISTS trg_rollup_usuario_del;
+
+        CREATE TRIGGER trg_rollup_pedidos_ins AFTER INSERT ON pedidos
+        BEGIN {_delta_pedido('NEW', 1, snapshot=True)} {_delta_usuario('NEW', 1, snapshot=True)}
+        END;
+        CREATE TRIGGER trg_rollup_pedidos_upd
+        AFTER UPDATE OF status, total, criado_em, usuario_id ON pedidos
+        WHEN OLD.status IS NOT NEW.status
+          OR OLD.total IS NOT NEW.total
+          OR OLD.criado_em IS NOT NEW.criado_em
+          OR OLD.usuario_id IS NOT NEW.usuario_id
+        BEGIN
+            {_delta_pedido('OLD', -1, snapshot=True)} {_delta_usuario('OLD', -1, snapshot=True)}
+            {_delta_pedido('NEW', 1, snapshot=True)} {_delta_usuario('NEW', 1, snapshot=True)}
+        END;
+        CREATE TRIGGER trg_rollup_pedidos_del AFTER DELETE ON pedidos
+        BEGIN {_delta_pedido('OLD', -1, snapshot=True)} {_delta_usuario('OLD', -1, snapshot=True)}
+            DELETE FROM pedido_itens WHERE pedido_id = OLD.id;
+        END;
+        -- itens acrescentados a um pedido já pago entram direto nas vendas do livro
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_pedido_itens_ins AFTER INSERT ON pedido_itens
+        WHEN (SELECT status FROM pedidos WHERE id = NEW.pedido_id) IS 'PAGO'
+        BEGIN
+            INSERT INTO rollup_livro (livro_id, vendas, receita) VALUES (NEW.livro_id, 1, NEW.preco)
+            ON CONFLICT(livro_id) DO UPDATE SET
+                vendas = vendas + excluded.vendas, receita = receita + excluded.receita;
+        END;
+
+        -- recálculo dos agregados de pedidos com os valores gravados; novos
+        -- clientes e totais de livros/usuários não mudam
+        DELETE FROM rollup_status;
+        INSERT INTO rollup_status (status, total, receita)
+        SELECT COALESCE(status, '{rollups.STATUS_NULO}'), COUNT(*), COALESCE(SUM(total), 0)
+        FROM pedidos
+        GROUP BY 1;
+        UPDATE rollup_dia SET pedidos = 0, pedidos_pagos = 0, receita = 0;
+        INSERT INTO rollup_dia (dia, pedidos, pedidos_pagos, receita)
+        SELECT COALESCE(DATE(criado_em), '{rollups.DIA_NULO}'),
+               COUNT(*),
+               SUM(status IS 'PAGO'),
+               COALESCE(SUM(CASE WHEN status IS 'PAGO' THEN total END), 0)
+        FROM pedidos
+        WHERE true
+        GROUP BY 1
+        ON CONFLICT(dia) DO UPDATE SET
+            pedidos = excluded.pedidos,
+            pedidos_pagos = excluded.pedidos_pagos,
+            receita = excluded.receita;
+        DELETE FROM rollup_livro;
+        INSERT INTO rollup_livro (livro_id, vendas, receita)
+        SELECT i.livro_id, COUNT(*), COALESCE(SUM(i.preco), 0)
+        FROM pedido_itens i
+        JOIN pedidos p ON p.id = i.pedido_id
+        WHERE p.status = 'PAGO'
+        GROUP BY i.livro_id;
+        DELETE FROM rollup_usuario;
+        INSERT INTO rollup_usuario (usuario_id, pedidos, pedidos_pagos, pedidos_pendentes, total_gasto)
+        SELECT usuario_id,
+               COUNT(*),
+               SUM(status IS 'PAGO'),
+               SUM(status IS 'PENDENTE'),
+               COALESCE(SUM(CASE WHEN status IS 'PAGO' THEN total END), 0)
+        FROM pedidos
+        WHERE usuario_id IS NOT NULL
+        GROUP BY usuario_id;
+        ANALYZE;
+    """)
+
+
+def _m012_tabelas_admin(con):
+    """Índices das ordenações e filtros das tabelas do painel (tabelas_admin.py)"""
+    _executar(con, """
+        -- livros: ordenar por título ou preço com o id como desempate
+        CREATE INDEX IF NOT EXISTS idx_livros_titulo ON livros(titulo, id);
+        CREATE INDEX IF NOT EXISTS idx_livros_preco ON livros(preco, id);
+        -- clientes: ordenar por nome
+        CREATE INDEX IF NOT EXISTS idx_usuarios_nome ON usuarios(nome, id);
+        -- pedidos: filtro por e-mail do comprador
+        CREATE INDEX IF NOT EXISTS idx_pedidos_email ON pedidos(email, id);
+        ANALYZE;
+    """)
+
+
+def _m013_bytes_downloads(con):
+    """Bytes enviados por link de download, para o limite valer também com Range"""
+    if 'bytes_enviados' not in _colunas(con, 'downloads'):
+        con.execute("ALTER TABLE downloads ADD COLUMN bytes_enviados INTEGER NOT NULL DEFAULT 0")
+
+
+def _m014_renovacao_entregas(con):
+    """Renovação do lease das entregas em andamento (entregas.py)"""
+    if 'renovado_em' not in _colunas(con, 'entregas'):
+        con.execute("ALTER TABLE entregas ADD COLUMN renovado_em TEXT")
+
+
+MIGRACOES = [
+    (1, 'esquema base', _m001_esquema_base),
+    (2, 'índices das consultas quentes', _m002_indices),
+    (3, 'rollups do dashboard', _m003_rollups),
+    (4, 'busca textual FTS5 no catálogo', _m004_busca_fts),
+    (5, 'versões de dados para ETag', _m005_versoes),
+    (6, 'fila de entregas dos e-books', _m006_entregas),
+    (7, 'cache de PDFs baixados', _m007_cache_pdfs),
+    (8, 'links de download assinados', _m008_downloads),
+    (9, 'resumo e histórico paginado do perfil', _m009_perfil),
+    (10, 'chaves de idempotência do checkout', _m010_idempotencia),
+    (11, 'itens de pedido com preço da compra', _m011_pedido_itens),
+    (12, 'índices das tabelas do painel', _m012_tabelas_admin),
+    (13, 'bytes enviados por link de download', _m013_bytes_downloads),
+    (14, 'renovação do lease das entregas', _m014_renovacao_entregas),
+]
+
+
+def versao_atual(con):
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+
+def aplicar(caminho):
+    """Aplica as migrações pendentes; seguro com vários workers subindo juntos"""
+    con = sqlite3.connect(caminho, timeout=30, isolation_level=None)
+    aplicadas = []
+    try:
+        for versao, descricao, funcao in MIGRACOES:
+            # BEGIN IMMEDIATE garante que só um processo aplica cada versão
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                if versao_atual(con) >= versao:
+                    con.execute("COMMIT")
+                    continue
+                funcao(con)
+                con.execute(f"PRAGMA user_version={int(versao)}")
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+            aplicadas.append((versao, descricao))
+            print(f"🗄️  Migração {versao:03d} aplicada: {descricao}")
+        return aplicadas
+    finally:
+        con.close()
+
+
+def explicar(con, consultas):
+    """Imprime o EXPLAIN QUERY PLAN de cada (nome, sql, parâmetros)"""
+    for nome, sql, params in consultas:
+        print(f"\n=== {nome} ===")
+        profundidade = {0: 0}
+        for id_no, pai, _, detalhe in con.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall():
+            profundidade[id_no] = profundidade.get(pai, 0) + 1
+            print(f"   {'  ' * profundidade[id_no]}{detalhe}")
@@ -0,0 +1,98 @@
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from io import BytesIO
+import qrcode
+import qrcode.image.svg
+
+# PIX "copia e cola" no padrão EMV/BR Code do Banco Central e QR Codes em cache.
+# Cada campo é TLV: ID (2 dígitos) + tamanho (2 dígitos) + valor.
+
+GUI_PIX = 'br.gov.bcb.pix'
+NOME_RECEBEDOR = 'ClicLeitura'
+CIDADE_RECEBEDOR = 'Sao Paulo'
+FORMATOS_QR = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+
+def _tabela_crc16(polinomio=0x1021):
+    tabela = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ polinomio) if crc & 0x8000 else (crc << 1)
+        tabela.append(crc & 0xFFFF)
+    return tuple(tabela)
+
+
+_CRC16_TABELA = _tabela_crc16()
+
+
+def crc16(dados):
+    """CRC16-CCITT (polinômio 0x1021, valor inicial 0xFFFF), por tabela"""
+    crc = 0xFFFF
+    for byte in dados.encode('utf-8'):
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16_TABELA[((crc >> 8) ^ byte) & 0xFF]
+    return crc
+
+
+def _campo(id_campo, valor):
+    if len(valor) > 99:
+        raise ValueError(f"Campo {id_campo} excede 99 caracteres")
+    return f"{id_campo}{len(valor):02d}{valor}"
+
+
+def _ascii(texto, limite):
+    """Remove acentos e caracteres fora do conjunto aceito pelos bancos"""
+    texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^A-Za-z0-9 .\-]', '', texto)[:limite]
+
+
+def gerar_payload(chave, valor, txid='***', nome=NOME_RECEBEDOR, cidade=CIDADE_RECEBEDOR):
+    """Monta o BR Code completo, com o CRC16 do campo 63"""
+    txid = re.sub(r'[^A-Za-z0-9*]', '', txid)[:25] or '***'
+    conta = _campo('00', GUI_PIX) + _campo('01', chave)
+    payload = (
+        _campo('00', '01')
+        + _campo('26', conta)
+        + _campo('52', '0000')
+        + _campo('53', '986')
+        + (_campo('54', f"{valor:.2f}") if valor else '')
+        + _campo('58', 'BR')
+        + _campo('59', _ascii(nome, 25))
+        + _campo('60', _ascii(cidade, 15))
+        + _campo('62', _campo('05', txid))
+        + '6304'
+    )
+    return payload + f"{crc16(payload):04X}"
+
+
+def payload_valido(payload):
+    """Confere o CRC de um BR Code recebido"""
+    return (len(payload) > 8 and payload[-8:-4] == '6304'
+            and payload[-4:].upper() == f"{crc16(payload[:-4]):04X}")
+
+
+def chave_recebedor():
+    return os.getenv('PIX_CHAVE') or os.getenv('MAIL_USERNAME') or 'contato@clicleitura.com.br'
+
+
+def payload_pedido(pedido_id, valor):
+    return gerar_payload(chave_recebedor(), valor, txid=f"PEDIDO{pedido_id}")
+
+
+@lru_cache(maxsize=int(os.getenv('PIX_QR_CACHE', '512')))
+def renderizar_qr(payload, formato='png'):
+    """QR Code do payload em bytes (PNG ou SVG), em cache LRU por payload"""
+    if formato == 'svg':
+        img = qrcode.make(payload, image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        img = qrcode.make(payload)
+    buf = BytesIO()
+    img.save(buf)
+    return buf.getvalue()
+
+
+def estatisticas():
+    info = renderizar_qr.cache_info()
+    return {'acertos': info.hits, 'falhas': info.misses, 'entradas': info.currsize, 'max': info.maxsize}
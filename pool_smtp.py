@@ -0,0 +1,200 @@
+import os
+import queue
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+# Conexões SMTP autenticadas reaproveitadas entre envios: o handshake TLS e o
+# AUTH acontecem uma vez por conexão, não uma vez por e-mail. Antes de emprestar
+# uma conexão parada há algum tempo, um NOOP confirma que o servidor ainda está
+# do outro lado; se não estiver (ou se passou do tempo ocioso), reconecta.
+
+ERROS_CONEXAO = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+
+class PoolSmtp:
+    """Pool LIFO de conexões smtplib configuradas a partir de MAIL_*"""
+
+    def __init__(self, servidor, porta, usuario=None, senha=None, usar_ssl=True, usar_tls=False,
+                 tamanho=2, timeout=30.0, ocioso_max=240.0, verificar_apos=5.0,
+                 max_mensagens=100, timeout_espera=60.0, debug=False, suprimir=False):
+        self.servidor = servidor
+        self.porta = porta
+        self.usuario = usuario
+        self.senha = senha
+        self.usar_ssl = usar_ssl
+        self.usar_tls = usar_tls
+        self.tamanho = tamanho
+        self.timeout = timeout
+        self.ocioso_max = ocioso_max
+        self.verificar_apos = verificar_apos
+        self.max_mensagens = max_mensagens
+        self.timeout_espera = timeout_espera
+        self.debug = debug
+        self.suprimir = suprimir
+        self._livres = queue.LifoQueue()
+        self._vagas = threading.BoundedSemaphore(tamanho)
+        self._lock = threading.Lock()
+        self.criadas = 0
+        self.reaproveitadas = 0
+        self.noop_falhas = 0
+        self.descartadas = 0
+        self.enviadas = 0
+        self.tempo_envio_s = 0.0
+
+    def _conectar(self):
+        # Timeout por conexão (antes era socket.setdefaulttimeout global)
+        if self.usar_ssl:
+            smtp = smtplib.SMTP_SSL(self.servidor, self.porta, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.servidor, self.porta, timeout=self.timeout)
+        try:
+            smtp.set_debuglevel(int(self.debug))
+            if self.usar_tls:
+                smtp.starttls()
+            if self.usuario and self.senha:
+                smtp.login(self.usuario, self.senha)
+        except Exception:
+            self._fechar(smtp)
+            raise
+        with self._lock:
+            self.criadas += 1
+        return {'smtp': smtp, 'usado_em': time.monotonic(), 'mensagens': 0}
+
+    @staticmethod
+    def _fechar(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _viva(self, conexao):
+        """Descarta conexões velhas demais e testa com NOOP as que ficaram paradas"""
+        parada = time.monotonic() - conexao['usado_em']
+        if parada > self.ocioso_max or conexao['mensagens'] >= self.max_mensagens:
+            return False
+        if parada < self.verificar_apos:
+            return True
+        try:
+            codigo, _ = conexao['smtp'].noop()
+            if codigo == 250:
+                return True
+        except ERROS_CONEXAO:
+            pass
+        with self._lock:
+            self.noop_falhas += 1
+        return False
+
+    def _obter(self):
+        if not self._vagas.acquire(timeout=self.timeout_espera):
+            raise smtplib.SMTPConnectError(421, f"Nenhuma conexão SMTP livre em {self.timeout_espera:g}s")
+        try:
+            while True:
+                try:
+                    conexao = self._livres.get_nowait()
+                except queue.Empty:
+                    return self._conectar()
+                if self._viva(conexao):
+                    with self._lock:
+                        self.reaproveitadas += 1
+                    return conexao
+                self._fechar(conexao['smtp'])
+                with self._lock:
+                    self.descartadas += 1
+        except Exception:
+            self._vagas.release()
+            raise
+
+    def _devolver(self, conexao, quebrada=False):
+        try:
+            if quebrada:
+                self._fechar(conexao['smtp'])
+                with self._lock:
+                    self.descartadas += 1
+            else:
+                conexao['usado_em'] = time.monotonic()
+                self._livres.put(conexao)
+        finally:
+            self._vagas.release()
+
+    @contextmanager
+    def conexao(self):
+        """Empresta uma conexão para um lote de envios (None com MAIL_SUPPRESS_SEND)"""
+        if self.suprimir:
+            yield None
+            return
+        conexao = self._obter()
+        quebrada = False
+        try:
+            yield _Envio(self, conexao)
+        except BaseException:
+            # Qualquer erro pode ter parado a sessão no meio do DATA (um RSET
+            # ali viraria corpo da mensagem): descarta em vez de devolver
+            quebrada = True
+            raise
+        finally:
+            self._devolver(conexao, quebrada)
+
+    def fechar_todas(self):
+        while True:
+            try:
+                conexao = self._livres.get_nowait()
+            except queue.Empty:
+                return
+            self._fechar(conexao['smtp'])
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'tamanho': self.tamanho,
+                'livres': self._livres.qsize(),
+                'criadas': self.criadas,
+                'reaproveitadas': self.reaproveitadas,
+                'noop_falhas': self.noop_falhas,
+                'descartadas': self.descartadas,
+                'enviadas': self.enviadas,
+                'tempo_medio_envio_s': round(self.tempo_envio_s / self.enviadas, 4) if self.enviadas else None,
+            }
+
+
+class _Envio:
+    """Conexão emprestada: envia uma ou mais mensagens pela mesma sessão SMTP"""
+
+    def __init__(self, pool, conexao):
+        self._pool = pool
+        self._conexao = conexao
+        self.smtp = conexao['smtp']
+
+    def enviar(self, funcao_envio, *args, **kwargs):
+        """Chama funcao_envio(smtp, ...) contando a mensagem e o tempo gasto"""
+        inicio = time.perf_counter()
+        resultado = funcao_envio(self.smtp, *args, **kwargs)
+        self._conexao['mensagens'] += 1
+        with self._pool._lock:
+            self._pool.enviadas += 1
+            self._pool.tempo_envio_s += time.perf_counter() - inicio
+        return resultado
+
+
+def init_app(app):
+    config = app.config
+    pool = PoolSmtp(
+        config['MAIL_SERVER'],
+        config['MAIL_PORT'],
+        usuario=config.get('MAIL_USERNAME'),
+        senha=config.get('MAIL_PASSWORD'),
+        usar_ssl=config.get('MAIL_USE_SSL', False),
+        usar_tls=config.get('MAIL_USE_TLS', False),
+        tamanho=int(os.getenv('SMTP_POOL_TAMANHO', '2')),
+        timeout=float(config.get('MAIL_TIMEOUT', 30)),
+        ocioso_max=float(os.getenv('SMTP_OCIOSO_MAX', '240')),
+        max_mensagens=int(os.getenv('SMTP_MAX_MENSAGENS', '100')),
+        debug=config.get('MAIL_DEBUG', False),
+        suprimir=config.get('MAIL_SUPPRESS_SEND', False) or app.testing,
+    )
+    app.extensions['pool_smtp'] = pool
+    return pool
@@ -0,0 +1,196 @@
+from datetime import date, timedelta
+
+# Agregados do painel admin mantidos incrementalmente por triggers
+# (criados em migracoes.py). Aqui ficam só a leitura e a reconstrução.
+
+STATUS_NULO = 'SEM_STATUS'
+DIA_NULO = '0000-00-00'
+
+
+def reconstruir(con):
+    """Recalcula todos os agregados a partir de pedidos/usuarios/livros (não faz commit)"""
+    if not con.in_transaction:
+        con.execute("BEGIN IMMEDIATE")
+    for tabela in ('rollup_status', 'rollup_dia', 'rollup_livro', 'rollup_totais'):
+        con.execute(f"DELETE FROM {tabela}")
+
+    # Valores vêm do total gravado em cada pedido (preço da compra), sem JOIN com livros
+    con.execute(f"""
+        INSERT INTO rollup_status (status, total, receita)
+        SELECT COALESCE(status, '{STATUS_NULO}'), COUNT(*), COALESCE(SUM(total), 0)
+        FROM pedidos
+        GROUP BY 1
+    """)
+    con.execute(f"""
+        INSERT INTO rollup_dia (dia, pedidos, pedidos_pagos, receita)
+        SELECT COALESCE(DATE(criado_em), '{DIA_NULO}'),
+               COUNT(*),
+               SUM(status IS 'PAGO'),
+               COALESCE(SUM(CASE WHEN status IS 'PAGO' THEN total END), 0)
+        FROM pedidos
+        GROUP BY 1
+    """)
+    con.execute(f"""
+        INSERT INTO rollup_dia (dia, novos_clientes)
+        SELECT COALESCE(DATE(criado_em), '{DIA_NULO}'), COUNT(*)
+        FROM usuarios
+        WHERE true
+        GROUP BY 1
+        ON CONFLICT(dia) DO UPDATE SET novos_clientes = excluded.novos_clientes
+    """)
+    con.execute("""
+        INSERT INTO rollup_livro (livro_id, vendas, receita)
+        SELECT i.livro_id, COUNT(*), COALESCE(SUM(i.preco), 0)
+        FROM pedido_itens i
+        JOIN pedidos p ON p.id = i.pedido_id
+        WHERE p.status = 'PAGO'
+        GROUP BY i.livro_id
+    """)
+    con.execute("""
+        INSERT INTO rollup_totais (chave, valor)
+        VALUES ('livros', (SELECT COUNT(*) FROM livros)),
+               ('usuarios', (SELECT COUNT(*) FROM usuarios))
+    """)
+
+
+
+def reconstruir_usuarios(con):
+    """Recalcula rollup_usuario (resumo do perfil) a partir dos pedidos (não faz commit)"""
+    if not con.in_transaction:
+        con.execute("BEGIN IMMEDIATE")
+    con.execute("DELETE FROM rollup_usuario")
+    con.execute("""
+        INSERT INTO rollup_usuario (usuario_id, pedidos, pedidos_pagos, pedidos_pendentes, total_gasto)
+        SELECT usuario_id,
+               COUNT(*),
+               SUM(status IS 'PAGO'),
+               SUM(status IS 'PENDENTE'),
+               COALESCE(SUM(CASE WHEN status IS 'PAGO' THEN total END), 0)
+        FROM pedidos
+        WHERE usuario_id IS NOT NULL
+        GROUP BY usuario_id
+    """)
+
+
+def mais_vendidos(con, k=5):
+    """Top-K livros por vendas pagas (lido direto do índice de rollup_livro)"""
+    return con.execute("""
+        SELECT r.livro_id, l.titulo, r.vendas, r.receita
+        FROM rollup_livro r
+        JOIN livros l ON l.id = r.livro_id
+        WHERE r.vendas > 0
+        ORDER BY r.vendas DESC, r.livro_id
+        LIMIT ?
+    """, (k,)).fetchall()
+
+
+def total_livros(con):
+    """Total de livros do catálogo sem COUNT(*) na tabela"""
+    row = con.execute("SELECT valor FROM rollup_totais WHERE chave = 'livros'").fetchone()
+    return row['valor'] if row else 0
+
+
+def painel(con):
+    """Estatísticas do dashboard em número fixo de consultas, independente do histórico"""
+    por_status = {
+        row['status']: row
+        for row in con.execute("SELECT status, total, receita FROM rollup_status")
+    }
+    resumo = con.execute("""
+        SELECT
+            (SELECT COALESCE(SUM(pedidos), 0) FROM rollup_dia WHERE dia = DATE('now')) as pedidos_hoje,
+            (SELECT COALESCE(SUM(receita), 0) FROM rollup_dia WHERE dia = DATE('now')) as receita_hoje,
+            (SELECT COALESCE(SUM(novos_clientes), 0) FROM rollup_dia
+             WHERE dia >= DATE('now', 'start of month') AND dia < DATE('now', 'start of month', '+1 month')) as clientes_mes,
+            (SELECT valor FROM rollup_totais WHERE chave = 'livros') as total_livros,
+            (SELECT valor FROM rollup_totais WHERE chave = 'usuarios') as total_clientes
+    """).fetchone()
+    top = mais_vendidos(con)
+
+    def total(status):
+        return por_status[status]['total'] if status in por_status else 0
+
+    pago = por_status.get('PAGO')
+    return {
+        'total_pedidos': sum(row['total'] for row in por_status.values()),
+        'pedidos_pagos': total('PAGO'),
+        'pedidos_pendentes': total('PENDENTE'),
+        'pedidos_aguardando_aprovacao': total('PENDENTE_APROVACAO'),
+        'receita_total': pago['receita'] if pago else 0,
+        'pedidos_hoje': resumo['pedidos_hoje'],
+        'receita_hoje': resumo['receita_hoje'],
+        'total_livros': resumo['total_livros'] or 0,
+        'total_clientes': resumo['total_clientes'] or 0,
+        'livro_mais_vendido': top[0]['titulo'][:50] if top else None,
+        'mais_vendidos': [dict(row) for row in top],
+        'clientes_mes': resumo['clientes_mes'],
+    }
+
+
+# Início do balde de cada granularidade a partir do dia (semana começa na segunda)
+BALDES = {
+    'dia': "dia",
+    'semana': "DATE(dia, 'weekday 0', '-6 days')",
+    'mes': "DATE(dia, 'start of month')",
+}
+SERIE_MAXIMO_BALDES = 1000
+
+
+def _inicio_balde(dia, granularidade):
+    if granularidade == 'semana':
+        return dia - timedelta(days=dia.weekday())
+    if granularidade == 'mes':
+        return dia.replace(day=1)
+    return dia
+
+
+def _proximo_balde(dia, granularidade):
+    if granularidade == 'semana':
+        return dia + timedelta(days=7)
+    if granularidade == 'mes':
+        return (dia.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return dia + timedelta(days=1)
+
+
+def serie(con, de, ate, granularidade='dia'):
+    """Pedidos, receita e clientes novos por dia/semana/mês entre as datas de e ate (inclusive).
+
+    Lê só rollup_dia, por intervalo semiaberto na chave primária (dia >= de AND
+    dia < ate + 1): um ano custa no máximo 366 linhas, qualquer que seja o
+    volume de pedidos. Baldes sem movimento aparecem zerados.
+    """
+    rows = con.execute(f"""
+        SELECT {BALDES[granularidade]} AS periodo,
+               SUM(pedidos) AS pedidos,
+               SUM(pedidos_pagos) AS pedidos_pagos,
+               SUM(receita) AS receita,
+               SUM(novos_clientes) AS novos_clientes
+        FROM rollup_dia
+        WHERE dia >= ? AND dia < ?
+        GROUP BY 1
+        ORDER BY 1
+    """, (de.isoformat(), (ate + timedelta(days=1)).isoformat())).fetchall()
+    por_periodo = {row['periodo']: row for row in rows}
+
+    pontos = []
+    periodo = _inicio_balde(de, granularidade)
+    while periodo <= ate:
+        row = por_periodo.get(periodo.isoformat())
+        pontos.append({
+            'periodo': periodo.isoformat(),
+            'pedidos': row['pedidos'] if row else 0,
+            'pedidos_pagos': row['pedidos_pagos'] if row else 0,
+            'receita': round(row['receita'], 2) if row else 0,
+            'novos_clientes': row['novos_clientes'] if row else 0,
+        })
+        periodo = _proximo_balde(periodo, granularidade)
+    return pontos
+
+
+def quantidade_baldes(de, ate, granularidade):
+    """Número de pontos que serie() vai devolver (para limitar o intervalo pedido)"""
+    if granularidade == 'mes':
+        return (ate.year - de.year) * 12 + ate.month - de.month + 1
+    if granularidade == 'semana':
+        return (_inicio_balde(ate, 'semana') - _inicio_balde(de, 'semana')).days // 7 + 1
+    return (ate - de).days + 1
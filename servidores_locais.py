@@ -0,0 +1,246 @@
+import argparse
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Servidores de mentira para testar e medir a entrega sem depender do archive.org.
+#
+#   python servidores_locais.py pdf --porta 8099
+#   python servidores_locais.py smtp --porta 8025
+#
+# Rotas do servidor de PDFs (qualquer nome terminado em .pdf gera um PDF fixo):
+#   /livro.pdf?mb=5&atraso=0.2   PDF de 5 MB, responde após 0,2 s (ETag + 304)
+#   /bloqueado.pdf               sempre 403 (exercita o disjuntor)
+#   /ocupado.pdf?vezes=2         429 com Retry-After: 1 nas 2 primeiras chamadas
+#   /instavel.pdf?vezes=2        503 nas 2 primeiras chamadas
+#
+# O servidor SMTP aceita qualquer remetente/destinatário sem autenticação,
+# descarta o conteúdo e só conta mensagens, bytes e conexões. Usa aiosmtpd se
+# estiver instalado; senão o módulo smtpd da biblioteca padrão (até Python 3.11).
+
+
+def _pdf_falso(nome, tamanho):
+    """Conteúdo determinístico (mesmo nome e tamanho -> mesmos bytes)"""
+    semente = hashlib.sha256(nome.encode()).digest()
+    corpo = (semente * (tamanho // len(semente) + 1))[:max(0, tamanho - 9)]
+    return b'%PDF-1.4\n' + corpo
+
+
+class _ManipuladorPdf(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como o archive.org
+
+    def log_message(self, *args):
+        pass
+
+    def _parametros(self):
+        caminho, _, consulta = self.path.partition('?')
+        params = dict(p.split('=', 1) for p in consulta.split('&') if '=' in p)
+        return caminho, params
+
+    def _vazio(self, status, **cabecalhos):
+        self.send_response(status)
+        for nome, valor in cabecalhos.items():
+            self.send_header(nome.replace('_', '-'), valor)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        servidor = self.server
+        caminho, params = self._parametros()
+        with servidor.lock:
+            servidor.chamadas[caminho] = servidor.chamadas.get(caminho, 0) + 1
+            chamada = servidor.chamadas[caminho]
+        time.sleep(float(params.get('atraso', servidor.atraso)))
+
+        if caminho.startswith('/bloqueado'):
+            return self._vazio(403)
+        if caminho.startswith('/ocupado') and chamada <= int(params.get('vezes', 1)):
+            return self._vazio(429, Retry_After='1')
+        if caminho.startswith('/instavel') and chamada <= int(params.get('vezes', 1)):
+            return self._vazio(503)
+        if not caminho.endswith('.pdf'):
+            return self._vazio(404)
+
+        conteudo = _pdf_falso(caminho, int(float(params.get('mb', 1)) * 1024 * 1024))
+        etag = f'"{hashlib.sha1(conteudo[:4096]).hexdigest()[:16]}-{len(conteudo)}"'
+        if self.headers.get('If-None-Match') == etag:
+            return self._vazio(304, ETag=etag)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(conteudo)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', 'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.end_headers()
+        for i in range(0, len(conteudo), 64 * 1024):
+            self.wfile.write(conteudo[i:i + 64 * 1024])
+
+
+class ServidorPdf:
+    """Servidor HTTP local em thread; use como context manager nos testes"""
+
+    def __init__(self, porta=0, atraso=0.0):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', porta), _ManipuladorPdf)
+        self.httpd.daemon_threads = True
+        self.httpd.atraso = atraso
+        self.httpd.chamadas = {}
+        self.httpd.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    @property
+    def chamadas(self):
+        return self.httpd.chamadas
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+
+class ServidorSmtp:
+    """SMTP local em thread (sem TLS/AUTH); use como context manager nos testes"""
+
+    def __init__(self, porta=0, atraso=0.0):
+        self.porta = porta
+        self.atraso = atraso
+        self.mensagens = 0
+        self.bytes = 0
+        self.conexoes = 0
+        self._lock = threading.Lock()
+        self._parar = None
+
+    @property
+    def url(self):
+        return f"smtp://127.0.0.1:{self.porta}"
+
+    def _registrar(self, dados):
+        time.sleep(self.atraso)
+        with self._lock:
+            self.mensagens += 1
+            self.bytes += len(dados)
+
+    def iniciar(self):
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            return self._iniciar_smtpd()
+
+        servidor = self
+
+        class Manipulador:
+            async def handle_EHLO(self, server, session, envelope, hostname, responses):
+                with servidor._lock:
+                    servidor.conexoes += 1
+                session.host_name = hostname
+                return responses
+
+            async def handle_DATA(self, server, session, envelope):
+                servidor._registrar(envelope.content)
+                return '250 OK'
+
+        if not self.porta:
+            import socket
+            with socket.socket() as s:
+                s.bind(('127.0.0.1', 0))
+                self.porta = s.getsockname()[1]
+        controller = Controller(Manipulador(), hostname='127.0.0.1', port=self.porta,
+                                data_size_limit=None)
+        controller.start()
+        self._parar = controller.stop
+        return self
+
+    def _iniciar_smtpd(self):
+        import asyncore
+        import smtpd
+        servidor = self
+
+        class Canal(smtpd.SMTPChannel):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                with servidor._lock:
+                    servidor.conexoes += 1
+
+        class Smtpd(smtpd.SMTPServer):
+            channel_class = Canal
+
+            def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+                servidor._registrar(data)
+
+        mapa = {}
+        smtpd_servidor = Smtpd(('127.0.0.1', self.porta), None, map=mapa,
+                               decode_data=False, data_size_limit=0)
+        self.porta = smtpd_servidor.socket.getsockname()[1]
+        parar = threading.Event()
+
+        def laco():
+            while not parar.is_set():
+                asyncore.loop(timeout=0.1, count=1, map=mapa)
+
+        threading.Thread(target=laco, daemon=True).start()
+
+        def fechar():
+            parar.set()
+            for canal in list(mapa.values()):
+                canal.close()
+
+        self._parar = fechar
+        return self
+
+    def parar(self):
+        if self._parar:
+            self._parar()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidores locais para testes de entrega")
+    sub = parser.add_subparsers(dest='servico', required=True)
+    pdf = sub.add_parser('pdf', help="servidor HTTP de PDFs falsos")
+    pdf.add_argument('--porta', type=int, default=int(os.getenv('PORTA_PDF', '8099')))
+    pdf.add_argument('--atraso', type=float, default=0.0, help="segundos antes de cada resposta")
+    smtp = sub.add_parser('smtp', help="servidor SMTP que só conta as mensagens")
+    smtp.add_argument('--porta', type=int, default=int(os.getenv('PORTA_SMTP', '8025')))
+    smtp.add_argument('--atraso', type=float, default=0.0, help="segundos para aceitar cada mensagem")
+    args = parser.parse_args()
+
+    if args.servico == 'pdf':
+        servidor = ServidorPdf(args.porta, args.atraso)
+        print(f"📄 Servidor de PDFs em {servidor.url} (Ctrl+C para sair)")
+        try:
+            servidor.httpd.serve_forever()
+        except KeyboardInterrupt:
+            servidor.parar()
+    else:
+        servidor = ServidorSmtp(args.porta, args.atraso).iniciar()
+        print(f"📧 Servidor SMTP em 127.0.0.1:{servidor.porta} (Ctrl+C para sair)")
+        try:
+            while True:
+                time.sleep(60)
+                print(f"   {servidor.mensagens} mensagens, {servidor.bytes:,} bytes, {servidor.conexoes} conexões")
+        except KeyboardInterrupt:
+            servidor.parar()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,89 @@
 // ClicLeitura - Frontend JavaScript
 
-// Função para carregar livros dinamicamente (alternativa ao Jinja2)
-async function carregarLivrosDinamicamente() {
+// Busca uma página do catálogo (paginação por cursor em /api/livros)
+async function buscarPaginaLivros(cursor = null, limite = 8) {
+    const params = new URLSearchParams({ limite });
+    if (cursor) params.set('cursor', cursor);
+    
+    const response = await fetch(`/api/livros?${params}`);
+    if (!response.ok) {
+        throw new Error('Erro ao carregar livros');
+    }
+    return response.json(); // {livros, proximo_cursor, limite}
+}
+
+// Carrega a próxima página e adiciona os cards ao catálogo.
+// Retorna o novo cursor (null quando não há mais livros)
+async function carregarLivrosDinamicamente(cursor = null, limite = 8) {
     try {
-        const response = await fetch('/api/livros');
-        const livros = await response.json();
+        const dados = await buscarPaginaLivros(cursor, limite);
         
         const container = document.querySelector('.produtos');
-        if (!container) return;
-        
-        // Limpar container se necessário
-        // container.innerHTML = '';
-        
-        // Renderizar cada livro (caso queira usar fetch em vez de Jinja2)
-        livros.forEach(livro => {
-            const card = criarCardLivro(livro);
-            container.appendChild(card);
-        });
+        if (container) {
+            dados.livros.forEach(livro => {
+                container.appendChild(criarCardLivro(livro));
+            });
+        }
+        return dados.proximo_cursor;
     } catch (error) {
         console.error('Erro ao carregar livros:', error);
+        return cursor; // mantém o cursor para tentar de novo
     }
 }
 
-// Criar card de livro
+// Corta o texto como o template faz ([:n] + '...')
+function truncarTexto(texto, limite) {
+    texto = texto || '';
+    return texto.length > limite ? texto.slice(0, limite) + '...' : texto;
+}
+
+// Criar card de livro (mesma marcação do card renderizado no index.html)
 function criarCardLivro(livro) {
     const card = document.createElement('div');
-    card.className = 'card';
-    card.innerHTML = `
-        <img src="/static/images/${livro.imagem}" alt="${livro.titulo}" />
-        <h4>${livro.titulo}</h4>
-        <p>Por ${livro.autor}</p>
-        <h3>R$ ${livro.preco.toFixed(2)}</h3>
-        <a href="/livro/${livro.id}">
-            <button>Ver detalhes</button>
-        </a>
-    `;
+    card.className = 'card livro-card';
+    
+    // Capa em <picture>: WebP quando suportado, JPEG redimensionado como fallback
+    const sizes = '(max-width: 768px) 45vw, 240px';
+    const picture = document.createElement('picture');
+    const img = document.createElement('img');
+    img.alt = livro.titulo;
+    img.loading = 'lazy';
+    img.decoding = 'async';
+    if (livro.capa) {
+        const webp = document.createElement('source');
+        webp.type = 'image/webp';
+        webp.srcset = livro.capa.srcset_webp;
+        webp.sizes = sizes;
+        picture.appendChild(webp);
+        img.src = livro.capa.src;
+        img.srcset = livro.capa.srcset;
+        img.sizes = sizes;
+    } else {
+        img.src = '/static/images/default-book.jpg';
+    }
+    picture.appendChild(img);
+    
+    const titulo = document.createElement('h4');
+    titulo.textContent = truncarTexto(livro.titulo, 60);
+    
+    const autor = document.createElement('p');
+    autor.textContent = `Por ${truncarTexto(livro.autor, 40)}`;
+    
+    const preco = document.createElement('h3');
+    preco.textContent = `R$ ${Number(livro.preco).toFixed(2)}`;
+    
+    const btnCarrinho = document.createElement('button');
+    btnCarrinho.style.marginBottom = '0.5rem';
+    btnCarrinho.innerHTML = '<i class="fas fa-cart-plus"></i> Adicionar ao Carrinho';
+    btnCarrinho.addEventListener('click', () => adicionarAoCarrinho(livro.id));
+    
+    const link = document.createElement('a');
+    link.href = `/livro/${livro.id}`;
+    const btnDetalhes = document.createElement('button');
+    btnDetalhes.textContent = 'Ver detalhes';
+    link.appendChild(btnDetalhes);
+    
+    card.append(picture, titulo, autor, preco, btnCarrinho, link);
     return card;
 }
 
@@ -44,7 +93,8 @@ async function realizarCheckout(livroId, email) {
         const response = await fetch('/api/checkout', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Idempotency-Key': chaveIdempotencia(`checkout-${livroId}`)
             },
             body: JSON.stringify({
                 livro_id: livroId,
@@ -55,7 +105,8 @@ async function realizarCheckout(livroId, email) {
         const data = await response.json();
         
         if (response.ok) {
-            return data; // {pedido_id, qr_base64, pix_text}
+            renovarChaveIdempotencia(`checkout-${livroId}`);
+            return data; // {pedido_id, qr_url, pix_text}
         } else {
             throw new Error(data.error || 'Erro ao realizar checkout');
         }
@@ -96,8 +147,3 @@ function exibirMensagem(mensagem, tipo = 'info') {
     alert(mensagem); // Pode ser substituído por toast/modal mais elaborado
 }
 
-// Carregar conteúdo ao inicializar página
-// document.addEventListener('DOMContentLoaded', () => {
-//     // Descomente se quiser usar fetch em vez de Jinja2 server-side
-//     // carregarLivrosDinamicamente();
-// });
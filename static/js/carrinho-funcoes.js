@@ -146,7 +146,10 @@ async function fecharPedidoEPagarComPix() {
         // Criar pedidos e gerar PIX
         const responseFinalizacao = await fetch('/api/carrinho/finalizar-pix', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: {
+                'Content-Type': 'application/json',
+                'Idempotency-Key': chaveIdempotencia('finalizar-pix')
+            },
             body: JSON.stringify({
                 usuario_id: usuarioLogado.id,
                 email: usuarioLogado.email
@@ -156,6 +159,7 @@ async function fecharPedidoEPagarComPix() {
         const resultado = await responseFinalizacao.json();
 
         if (responseFinalizacao.ok) {
+            renovarChaveIdempotencia('finalizar-pix');
             // Exibir modal com QR Code PIX
             mostrarModalPix(resultado);
             fecharCarrinho();
@@ -184,7 +188,7 @@ function mostrarModalPix(dados) {
         </div>
 
         <div style="background: #f8f8f8; padding: 2rem; border-radius: 10px; margin-bottom: 2rem;">
-            <img src="data:image/png;base64,${dados.qr_base64}" 
+            <img src="${dados.qr_url}" 
                  alt="QR Code PIX" 
                  style="max-width: 300px; width: 100%; margin: 0 auto; display: block;" />
         </div>
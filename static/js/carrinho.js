@@ -1,3 +1,21 @@
+// Chave Idempotency-Key por tentativa de compra: a mesma chave é reenviada em
+// cliques repetidos / novas tentativas e o servidor devolve o mesmo pedido.
+// Só é trocada depois de uma resposta de sucesso.
+const chavesIdempotencia = {};
+
+function chaveIdempotencia(escopo) {
+    if (!chavesIdempotencia[escopo]) {
+        chavesIdempotencia[escopo] = window.crypto && crypto.randomUUID
+            ? crypto.randomUUID()
+            : Date.now().toString(36) + Math.random().toString(36).slice(2);
+    }
+    return chavesIdempotencia[escopo];
+}
+
+function renovarChaveIdempotencia(escopo) {
+    delete chavesIdempotencia[escopo];
+}
+
 // Função para atualizar o contador do carrinho
 async function atualizarContadorCarrinho() {
     const usuario = JSON.parse(localStorage.getItem('usuario') || 'null');
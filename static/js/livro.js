@@ -127,15 +127,19 @@ document.addEventListener('DOMContentLoaded', () => {
             try {
                 const response = await fetch('/api/checkout', {
                     method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'Idempotency-Key': chaveIdempotencia(`checkout-${livroId}`)
+                    },
                     body: JSON.stringify({ email, livro_id: livroId, usuario_id: usuario.id })
                 });
 
                 const data = await response.json();
 
                 if (response.ok) {
+                    renovarChaveIdempotencia(`checkout-${livroId}`);
                     pedidoAtual = data.pedido_id;
-                    document.getElementById('qrImage').src = 'data:image/png;base64,' + data.qr_base64;
+                    document.getElementById('qrImage').src = data.qr_url;
                     document.getElementById('pixText').textContent = data.pix_text;
                     document.getElementById('qrContainer').classList.add('active');
                 } else {
@@ -0,0 +1,192 @@
+import base64
+import json
+import re
+
+# Tabelas do painel admin (pedidos, livros, clientes) servidas em JSON, uma
+# página por vez. Paginação por cursor (keyset) na ordenação escolhida, com o
+# id como desempate: o cursor carrega (valor da coluna, id) da última linha e a
+# próxima página começa com WHERE (coluna, id) < (?, ?), sem OFFSET, usando o
+# índice da coluna (migração 012). Filtros são sempre por igualdade e as
+# colunas devolvidas podem ser escolhidas (?campos=).
+
+LIMITE_PADRAO = 25
+LIMITE_MAXIMO = 200
+
+
+class ConsultaInvalida(Exception):
+    """Parâmetro de ordenação, filtro, campo ou cursor inválido"""
+
+
+# Cada tabela: origem (FROM), juncoes (alias -> LEFT JOIN, usado só quando
+# alguma coluna pedida é desse alias), id (desempate único), colunas
+# (nome na resposta -> expressão SQL), ordenaveis (só colunas com índice),
+# filtros (parâmetro -> expressão comparada com "= ?"), padrao (campos sem
+# ?campos=) e anulaveis (ordenáveis que podem ser NULL).
+TABELAS = {
+    'pedidos': dict(
+        origem="FROM pedidos p",
+        juncoes={
+            'l': "LEFT JOIN livros l ON p.livro_id = l.id",
+            'u': "LEFT JOIN usuarios u ON p.usuario_id = u.id",
+        },
+        id='p.id',
+        colunas={
+            'id': 'p.id',
+            'email': 'p.email',
+            'livro_id': 'p.livro_id',
+            'usuario_id': 'p.usuario_id',
+            'status': 'p.status',
+            'total': 'p.total',
+            'criado_em': 'p.criado_em',
+            'observacao': 'p.observacao',
+            'nome_cliente': "COALESCE(u.nome, 'Cliente não identificado')",
+            'titulo': "COALESCE(l.titulo, 'Livro não disponível (ID: ' || p.livro_id || ')')",
+        },
+        ordenaveis={'id': 'p.id', 'criado_em': 'p.criado_em'},
+        filtros={'status': 'p.status', 'email': 'p.email', 'usuario_id': 'p.usuario_id',
+                 'livro_id': 'p.livro_id'},
+        padrao=('id', 'nome_cliente', 'email', 'titulo', 'total', 'status', 'criado_em'),
+        anulaveis={'criado_em'},
+    ),
+    'livros': dict(
+        origem="FROM livros l",
+        id='l.id',
+        colunas={
+            'id': 'l.id',
+            'titulo': 'l.titulo',
+            'autor': 'l.autor',
+            'preco': 'l.preco',
+            'imagem': 'l.imagem',
+            'pdf': 'l.pdf',
+            'origem': 'l.origem',
+            'criado_em': 'l.criado_em',
+        },
+        ordenaveis={'id': 'l.id', 'titulo': 'l.titulo', 'preco': 'l.preco'},
+        filtros={'origem': 'l.origem', 'autor': 'l.autor'},
+        padrao=('id', 'imagem', 'titulo', 'autor', 'preco', 'origem'),
+    ),
+    'clientes': dict(
+        # Compras e total gasto vêm de rollup_usuario (uma linha por cliente)
+        origem="FROM usuarios u",
+        juncoes={'r': "LEFT JOIN rollup_usuario r ON r.usuario_id = u.id"},
+        id='u.id',
+        colunas={
+            'id': 'u.id',
+            'nome': 'u.nome',
+            'email': 'u.email',
+            'criado_em': 'u.criado_em',
+            'total_compras': 'COALESCE(r.pedidos, 0)',
+            'pedidos_pagos': 'COALESCE(r.pedidos_pagos, 0)',
+            'total_gasto': 'COALESCE(r.total_gasto, 0)',
+        },
+        ordenaveis={'id': 'u.id', 'nome': 'u.nome', 'criado_em': 'u.criado_em'},
+        filtros={'email': 'u.email'},
+        padrao=('id', 'nome', 'email', 'total_compras', 'total_gasto', 'criado_em'),
+        anulaveis={'criado_em'},
+    ),
+}
+
+
+def _codificar_cursor(valor, id_linha):
+    return base64.urlsafe_b64encode(json.dumps([valor, id_linha]).encode()).decode().rstrip('=')
+
+
+def _decodificar_cursor(cursor):
+    try:
+        valor, id_linha = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return valor, int(id_linha)
+    except (ValueError, TypeError):
+        raise ConsultaInvalida("Cursor inválido")
+
+
+def _apos_cursor(coluna, id_sql, valor, id_linha, desc, anulavel):
+    """Condição "depois do cursor" na ordem (coluna, id). NULL vem por último
+    em DESC e primeiro em ASC, como o SQLite ordena."""
+    if coluna == id_sql:
+        return f"{id_sql} {'<' if desc else '>'} ?", [id_linha]
+    op = '<' if desc else '>'
+    if valor is None:
+        if desc:
+            return f"({coluna} IS NULL AND {id_sql} < ?)", [id_linha]
+        return f"({coluna} IS NOT NULL OR {id_sql} > ?)", [id_linha]
+    condicao = f"({coluna}, {id_sql}) {op} (?, ?)"
+    if anulavel and desc:
+        condicao = f"({condicao} OR {coluna} IS NULL)"
+    return condicao, [valor, id_linha]
+
+
+def consulta(nome, args):
+    """Monta o SELECT de uma página: devolve (sql, params, campos, limite, ordem).
+
+    args: ordem (coluna ou -coluna para decrescente), campos, cursor, limite
+    e um parâmetro por filtro.
+    """
+    tabela = TABELAS[nome]
+
+    ordem = args.get('ordem') or '-id'
+    desc = ordem.startswith('-')
+    chave_ordem = ordem.lstrip('-')
+    if chave_ordem not in tabela['ordenaveis']:
+        raise ConsultaInvalida(f"ordem deve ser uma de: {', '.join(tabela['ordenaveis'])} (prefixo - para decrescente)")
+    coluna = tabela['ordenaveis'][chave_ordem]
+
+    campos = tabela['padrao']
+    if args.get('campos'):
+        campos = tuple(dict.fromkeys(c.strip() for c in args['campos'].split(',') if c.strip()))
+        invalidos = [c for c in campos if c not in tabela['colunas']]
+        if invalidos or not campos:
+            raise ConsultaInvalida(f"Campos inválidos: {', '.join(invalidos)}. "
+                                   f"Permitidos: {', '.join(tabela['colunas'])}")
+
+    try:
+        limite = max(1, min(int(args.get('limite', LIMITE_PADRAO)), LIMITE_MAXIMO))
+    except ValueError:
+        raise ConsultaInvalida("limite deve ser um número")
+
+    condicoes, params = [], []
+    for parametro, expressao in tabela['filtros'].items():
+        if args.get(parametro):
+            condicoes.append(f"{expressao} = ?")
+            params.append(args[parametro])
+    if args.get('cursor'):
+        valor, id_linha = _decodificar_cursor(args['cursor'])
+        condicao, valores = _apos_cursor(coluna, tabela['id'], valor, id_linha, desc,
+                                         chave_ordem in tabela.get('anulaveis', ()))
+        condicoes.append(condicao)
+        params += valores
+
+    # A coluna de ordenação e o id sempre vêm na consulta (para montar o cursor)
+    selecao = ', '.join(f"{tabela['colunas'][c]} AS {c}" for c in campos)
+    # Só entram os JOINs das colunas pedidas (todos são LEFT JOIN pela chave)
+    juncoes = [sql for alias, sql in tabela.get('juncoes', {}).items() if re.search(rf'\b{alias}\.', selecao)]
+    direcao = 'DESC' if desc else 'ASC'
+    ordenacao = f"{coluna} {direcao}"
+    if coluna != tabela['id']:
+        ordenacao += f", {tabela['id']} {direcao}"
+    sql = f"""
+        SELECT {selecao}, {coluna} AS _ordem, {tabela['id']} AS _id
+        {tabela['origem']} {' '.join(juncoes)}
+        {'WHERE ' + ' AND '.join(condicoes) if condicoes else ''}
+        ORDER BY {ordenacao}
+        LIMIT ?
+    """
+    return sql, params + [limite + 1], campos, limite, ordem
+
+
+def listar(con, nome, args):
+    """Uma página da tabela; devolve o dict da resposta JSON"""
+    sql, params, campos, limite, ordem = consulta(nome, args)
+    rows = con.execute(sql, params).fetchall()
+
+    # Uma linha a mais indica que existe próxima página
+    proximo_cursor = None
+    if len(rows) > limite:
+        ultima = rows[limite - 1]
+        proximo_cursor = _codificar_cursor(ultima['_ordem'], ultima['_id'])
+    return {
+        'itens': [{c: row[c] for c in campos} for row in rows[:limite]],
+        'proximo_cursor': proximo_cursor,
+        'limite': limite,
+        'ordem': ordem,
+        'campos': list(campos),
+    }
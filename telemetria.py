@@ -0,0 +1,219 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request
+import banco
+
+# Métricas no formato texto do Prometheus (/metrics), sem dependência externa.
+# Cada requisição alimenta histogramas de latência por endpoint, contadores por
+# status e o número de requisições em andamento; as consultas SQL chegam pelos
+# observadores de banco.py e são somadas por requisição (quantas e quanto tempo).
+# O custo por requisição é um punhado de perf_counter() e somas sob um lock.
+#
+# Os valores são por processo: com vários workers, o Prometheus deve raspar
+# cada um (ou rodar um único processo com threads).
+
+LATENCIA_BALDES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BALDES = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+CONSULTAS_BALDES = (0, 1, 2, 5, 10, 20, 50, 100)
+OPERACAO_BALDES = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _rotulos(nomes, valores, extra=''):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Metrica:
+    tipo = 'untyped'
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def _chave(self, rotulos):
+        return tuple(rotulos.get(nome, '') for nome in self.rotulos)
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            itens = sorted(self._valores.items())
+            linhas += self._linhas(itens)
+        return linhas
+
+    def _linhas(self, itens):
+        return [f"{self.nome}{_rotulos(self.rotulos, chave)} {_numero(valor)}" for chave, valor in itens]
+
+
+class Contador(Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+
+class Medidor(Metrica):
+    tipo = 'gauge'
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def dec(self, valor=1, **rotulos):
+        self.inc(-valor, **rotulos)
+
+
+class Histograma(Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), baldes=LATENCIA_BALDES):
+        super().__init__(nome, ajuda, rotulos)
+        self.baldes = tuple(sorted(baldes))
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        indice = bisect.bisect_left(self.baldes, valor)
+        with self._lock:
+            serie = self._valores.get(chave)
+            if serie is None:
+                # contagens por balde (não cumulativas) + soma + total
+                serie = self._valores[chave] = [[0] * (len(self.baldes) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def cronometrar(self, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **rotulos)
+
+    def _linhas(self, itens):
+        linhas = []
+        for chave, (contagens, soma, total) in itens:
+            acumulado = 0
+            for limite, contagem in zip(self.baldes + (float('inf'),), contagens):
+                acumulado += contagem
+                le = '+Inf' if limite == float('inf') else _numero(float(limite))
+                rotulos = _rotulos(self.rotulos, chave, 'le="%s"' % le)
+                linhas.append(f"{self.nome}_bucket{rotulos} {acumulado}")
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, chave)} {_numero(soma)}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, chave)} {total}")
+        return linhas
+
+
+class Telemetria:
+    """Registro das métricas da aplicação e ganchos de requisição/SQL"""
+
+    def __init__(self):
+        self.metricas = []
+        self._local = threading.local()  # consultas da requisição em andamento
+        self.requisicoes = self.histograma(
+            'clicleitura_requisicao_segundos', 'Latência das requisições por endpoint',
+            ('endpoint', 'metodo'))
+        self.respostas = self.contador(
+            'clicleitura_respostas_total', 'Respostas por endpoint e status HTTP',
+            ('endpoint', 'metodo', 'status'))
+        self.em_andamento = self.medidor(
+            'clicleitura_requisicoes_em_andamento', 'Requisições sendo processadas agora')
+        self.em_andamento.inc(0)
+        self.sql_consulta = self.histograma(
+            'clicleitura_sql_consulta_segundos', 'Duração de cada comando SQL', baldes=SQL_BALDES)
+        self.sql_por_requisicao = self.histograma(
+            'clicleitura_sql_consultas_por_requisicao', 'Comandos SQL por requisição',
+            ('endpoint',), baldes=CONSULTAS_BALDES)
+        self.sql_tempo_requisicao = self.histograma(
+            'clicleitura_sql_segundos_por_requisicao', 'Tempo em SQL por requisição',
+            ('endpoint',), baldes=SQL_BALDES)
+        self.qr = self.histograma(
+            'clicleitura_qr_geracao_segundos', 'Geração de QR Code PIX (fora do cache)',
+            ('formato',), baldes=OPERACAO_BALDES)
+        self.pdf = self.histograma(
+            'clicleitura_pdf_obtencao_segundos', 'Obtenção do PDF remoto (cache em disco ou download)',
+            ('resultado',), baldes=OPERACAO_BALDES)
+        self.smtp = self.histograma(
+            'clicleitura_smtp_envio_segundos', 'Envio de um e-mail pelo pool SMTP',
+            ('resultado',), baldes=OPERACAO_BALDES)
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(nome, ajuda, rotulos))
+
+    def medidor(self, nome, ajuda, rotulos=()):
+        return self._registrar(Medidor(nome, ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, rotulos=(), baldes=LATENCIA_BALDES):
+        return self._registrar(Histograma(nome, ajuda, rotulos, baldes))
+
+    def _registrar(self, metrica):
+        self.metricas.append(metrica)
+        return metrica
+
+    def exportar(self):
+        linhas = []
+        for metrica in self.metricas:
+            linhas += metrica.exportar()
+        return '\n'.join(linhas) + '\n'
+
+    # --- SQL (observador de banco.py) ---
+
+    def observar_sql(self, sql, parametros, duracao):
+        self.sql_consulta.observar(duracao)
+        local = self._local
+        local.consultas = getattr(local, 'consultas', 0) + 1
+        local.tempo_sql = getattr(local, 'tempo_sql', 0.0) + duracao
+
+    # --- ganchos de requisição ---
+
+    def _inicio(self):
+        g._telemetria_inicio = time.perf_counter()
+        self._local.consultas = 0
+        self._local.tempo_sql = 0.0
+        self.em_andamento.inc()
+
+    def _resposta(self, resposta):
+        g._telemetria_status = resposta.status_code
+        return resposta
+
+    def _fim(self, exc=None):
+        inicio = g.pop('_telemetria_inicio', None)
+        if inicio is None:
+            return
+        self.em_andamento.dec()
+        endpoint = request.endpoint or 'nao_encontrado'
+        metodo = request.method
+        self.requisicoes.observar(time.perf_counter() - inicio, endpoint=endpoint, metodo=metodo)
+        status = g.pop('_telemetria_status', 500)
+        self.respostas.inc(endpoint=endpoint, metodo=metodo, status=status)
+        self.sql_por_requisicao.observar(self._local.consultas, endpoint=endpoint)
+        self.sql_tempo_requisicao.observar(self._local.tempo_sql, endpoint=endpoint)
+
+
+def init_app(app):
+    telemetria = Telemetria()
+    app.extensions['telemetria'] = telemetria
+    if os.getenv('METRICAS_ATIVAS', 'True') == 'True':
+        app.before_request(telemetria._inicio)
+        app.after_request(telemetria._resposta)
+        app.teardown_request(telemetria._fim)
+        banco.observadores.append(telemetria.observar_sql)
+    return telemetria